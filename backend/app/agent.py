@@ -1,7 +1,9 @@
-import pickle
+import os
 from enum import Enum
+from functools import lru_cache
 from typing import Any, Dict, Mapping, Optional, Sequence, Union
 
+import orjson
 from langchain_core.messages import AnyMessage
 from langchain_core.runnables import (
     ConfigurableField,
@@ -11,6 +13,7 @@ from langgraph.checkpoint import CheckpointAt
 from langgraph.graph.message import Messages
 from langgraph.pregel import Pregel
 
+from app import metrics
 from app.agent_types.tools_agent import get_tools_agent_executor
 from app.agent_types.xml_agent import get_xml_agent_executor
 from app.chatbot import get_chatbot_executor
@@ -32,7 +35,8 @@ from app.llms import (
     get_groq_deepseek_llm,
     get_deepseek_llm,
     get_deepseek_reasoner_llm,
-    get_grok_llm
+    get_grok_llm,
+    get_query_rewrite_llm,
 )
 from app.retrieval import get_retrieval_executor
 from app.tools import (
@@ -100,7 +104,10 @@ class AgentType(str, Enum):
 
 DEFAULT_SYSTEM_MESSAGE = "You are a helpful assistant."
 
-CHECKPOINTER = PostgresCheckpoint(serde=pickle, at=CheckpointAt.END_OF_STEP)
+CHECKPOINTER = PostgresCheckpoint(at=CheckpointAt.END_OF_STEP)
+
+EXECUTOR_CACHE_SIZE = int(os.environ.get("AGENT_EXECUTOR_CACHE_SIZE", "128"))
+"""Maximum number of compiled graphs kept per bot type."""
 
 
 def get_agent_executor(
@@ -221,6 +228,45 @@ def get_agent_executor(
         raise ValueError("Unexpected agent type")
 
 
+def _tools_key(tools: Sequence[Tool]) -> str:
+    """Canonical JSON of the tools config, used as a cache key."""
+    return orjson.dumps(
+        list(tools),
+        default=lambda t: t.dict(),
+        option=orjson.OPT_SORT_KEYS,
+    ).decode()
+
+
+@lru_cache(maxsize=EXECUTOR_CACHE_SIZE)
+def get_cached_agent_executor(
+    tools_key: str,
+    agent: AgentType,
+    system_message: str,
+    interrupt_before_action: bool,
+    retrieval_description: str,
+):
+    """Build and compile an agent graph, reusing it across runs.
+
+    The retrieval tool is left unscoped; it is bound to the assistant and
+    thread of each run when the tool is called.
+    """
+    _tools = []
+    for _tool in orjson.loads(tools_key):
+        if _tool["type"] == AvailableTools.RETRIEVAL:
+            _tools.append(get_retrieval_tool(None, None, retrieval_description))
+        else:
+            tool_config = _tool.get("config") or {}
+            _returned_tools = TOOLS[_tool["type"]](**tool_config)
+            if isinstance(_returned_tools, list):
+                _tools.extend(_returned_tools)
+            else:
+                _tools.append(_returned_tools)
+    _agent = get_agent_executor(
+        _tools, agent, system_message, interrupt_before_action
+    )
+    return _agent.with_config({"recursion_limit": 50})
+
+
 class ConfigurableAgent(RunnableBinding):
     tools: Sequence[Tool]
     agent: AgentType
@@ -246,27 +292,13 @@ class ConfigurableAgent(RunnableBinding):
         **others: Any,
     ) -> None:
         others.pop("bound", None)
-        _tools = []
-        for _tool in tools:
-            if _tool["type"] == AvailableTools.RETRIEVAL:
-                if assistant_id is None or thread_id is None:
-                    raise ValueError(
-                        "Both assistant_id and thread_id must be provided if Retrieval tool is used"
-                    )
-                _tools.append(
-                    get_retrieval_tool(assistant_id, thread_id, retrieval_description)
-                )
-            else:
-                tool_config = _tool.get("config", {})
-                _returned_tools = TOOLS[_tool["type"]](**tool_config)
-                if isinstance(_returned_tools, list):
-                    _tools.extend(_returned_tools)
-                else:
-                    _tools.append(_returned_tools)
-        _agent = get_agent_executor(
-            _tools, agent, system_message, interrupt_before_action
+        agent_executor = get_cached_agent_executor(
+            _tools_key(tools),
+            agent,
+            system_message,
+            interrupt_before_action,
+            retrieval_description,
         )
-        agent_executor = _agent.with_config({"recursion_limit": 50})
         super().__init__(
             tools=tools,
             agent=agent,
@@ -303,6 +335,7 @@ class LLMType(str, Enum):
     DEEPSEEK_REASONER = "DeepSeek Reasoner"
     GROK2= "GROK 2"
 
+@lru_cache(maxsize=EXECUTOR_CACHE_SIZE)
 def get_chatbot(
     llm_type: LLMType,
     system_message: str,
@@ -397,6 +430,58 @@ chatbot = (
 )
 
 
+@lru_cache(maxsize=EXECUTOR_CACHE_SIZE)
+def get_retrieval_chatbot(
+    llm_type: LLMType,
+    system_message: str,
+):
+    # if llm_type == LLMType.GPT_35_TURBO:
+    #     llm = get_openai_llm()
+    if llm_type == LLMType.GPT_4O:
+        llm = get_openai_llm(model="gpt-4o")
+    elif llm_type == LLMType.GPT_4O_mini:
+        llm = get_openai_llm(model="gpt-4o-mini")
+    # elif llm_type == LLMType.GPT_O1:
+    #     llm = get_openai_llm(model="o1-preview")
+    # elif llm_type == LLMType.GPT_O1_mini:
+    #     llm = get_openai_llm(model="o1-mini")
+    # elif llm_type == LLMType.AZURE_OPENAI:
+    #     llm = get_openai_llm(azure=True)
+    elif llm_type == LLMType.GEMINI:
+        llm = get_google_llm()
+    elif llm_type == LLMType.MIXTRAL:
+        llm = get_mixtral_fireworks()
+    elif llm_type == LLMType.OLLAMA:
+        llm = get_ollama_llm()
+    elif llm_type == LLMType.GROQ70B:
+        llm = get_groq70B_llm()
+    elif llm_type == LLMType.GROQ8B:
+        llm = get_groq8B_llm()
+    elif llm_type == LLMType.GROQ70B_VERSATILE:
+        llm = get_groq_llama_70B_versatile_llm()
+    # elif llm_type == LLMType.GROQ90B:
+    #     llm = get_groq_llama_90B_llm()
+    # elif llm_type == LLMType.GROQ_WHISPER:
+    #     llm = get_groq_whisper_llm()
+    elif llm_type == LLMType.CLAUDE35_HAIKU:
+        llm = get_claude_3_5_haiku_llm()
+    elif llm_type == LLMType.CLAUDE35_SONNET:
+        llm = get_claude_35_sonnet_llm()
+    elif llm_type == LLMType.CLAUDE3_OPUS:
+        llm = get_claude_3_opus_llm()
+    elif llm_type == LLMType.DEEPSEEK:
+        llm = get_deepseek_llm()
+    elif llm_type == LLMType.DEEPSEEK_REASONER:
+        llm = get_deepseek_reasoner_llm()
+    elif llm_type == LLMType.GROK2:
+        llm = get_grok_llm()
+    else:
+        raise ValueError("Unexpected llm type")
+    return get_retrieval_executor(
+        llm, get_retriever, system_message, CHECKPOINTER, get_query_rewrite_llm()
+    )
+
+
 class ConfigurableRetrieval(RunnableBinding):
     llm_type: LLMType
     system_message: str = DEFAULT_SYSTEM_MESSAGE
@@ -416,50 +501,7 @@ class ConfigurableRetrieval(RunnableBinding):
         **others: Any,
     ) -> None:
         others.pop("bound", None)
-        retriever = get_retriever(assistant_id, thread_id)
-        # if llm_type == LLMType.GPT_35_TURBO:
-        #     llm = get_openai_llm()
-        if llm_type == LLMType.GPT_4O:
-            llm = get_openai_llm(model="gpt-4o")
-        elif llm_type == LLMType.GPT_4O_mini:
-            llm = get_openai_llm(model="gpt-4o-mini")
-        # elif llm_type == LLMType.GPT_O1:
-        #     llm = get_openai_llm(model="o1-preview")
-        # elif llm_type == LLMType.GPT_O1_mini:
-        #     llm = get_openai_llm(model="o1-mini")
-        # elif llm_type == LLMType.AZURE_OPENAI:
-        #     llm = get_openai_llm(azure=True)
-        elif llm_type == LLMType.GEMINI:
-            llm = get_google_llm()
-        elif llm_type == LLMType.MIXTRAL:
-            llm = get_mixtral_fireworks()
-        elif llm_type == LLMType.OLLAMA:
-            llm = get_ollama_llm()
-        elif llm_type == LLMType.GROQ70B:
-            llm = get_groq70B_llm()
-        elif llm_type == LLMType.GROQ8B:
-            llm = get_groq8B_llm()
-        elif llm_type == LLMType.GROQ70B_VERSATILE:
-            llm = get_groq_llama_70B_versatile_llm()
-        # elif llm_type == LLMType.GROQ90B:
-        #     llm = get_groq_llama_90B_llm()
-        # elif llm_type == LLMType.GROQ_WHISPER:
-        #     llm = get_groq_whisper_llm()
-        elif llm_type == LLMType.CLAUDE35_HAIKU:
-            llm = get_claude_3_5_haiku_llm()
-        elif llm_type == LLMType.CLAUDE35_SONNET:
-            llm = get_claude_35_sonnet_llm()
-        elif llm_type == LLMType.CLAUDE3_OPUS:
-            llm = get_claude_3_opus_llm()
-        elif llm_type == LLMType.DEEPSEEK:
-            llm = get_deepseek_llm()
-        elif llm_type == LLMType.DEEPSEEK_REASONER:
-            llm = get_deepseek_reasoner_llm()
-        elif llm_type == LLMType.GROK2:
-            llm = get_grok_llm()
-        else:
-            raise ValueError("Unexpected llm type")
-        chatbot = get_retrieval_executor(llm, retriever, system_message, CHECKPOINTER)
+        chatbot = get_retrieval_chatbot(llm_type, system_message)
         super().__init__(
             llm_type=llm_type,
             system_message=system_message,
@@ -486,6 +528,22 @@ chat_retrieval = (
 )
 
 
+for _name, _cached in (
+    ("agent_executor", get_cached_agent_executor),
+    ("chatbot_executor", get_chatbot),
+    ("retrieval_executor", get_retrieval_chatbot),
+):
+    metrics.register(
+        f"{_name}_cache_hits", lambda c=_cached: c.cache_info().hits
+    )
+    metrics.register(
+        f"{_name}_cache_misses", lambda c=_cached: c.cache_info().misses
+    )
+    metrics.register(
+        f"{_name}_cache_size", lambda c=_cached: c.cache_info().currsize
+    )
+
+
 agent: Pregel = (
     ConfigurableAgent(
         agent=AgentType.GPT_4O,
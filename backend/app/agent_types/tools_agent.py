@@ -9,12 +9,14 @@ from langchain_core.messages import (
     SystemMessage,
     ToolMessage,
 )
+from langchain_core.runnables import RunnableConfig
 from langgraph.checkpoint import BaseCheckpointSaver
 from langgraph.graph import END
 from langgraph.graph.message import MessageGraph
 from langgraph.prebuilt import ToolExecutor, ToolInvocation
 
 from app.message_types import LiberalToolMessage
+from app.tools import bind_runtime_tools
 
 
 def get_tools_agent_executor(
@@ -45,7 +47,6 @@ def get_tools_agent_executor(
     else:
         llm_with_tools = llm
     agent = _get_messages | llm_with_tools
-    tool_executor = ToolExecutor(tools)
 
     # Define the function that determines whether to continue or not
     def should_continue(messages):
@@ -58,7 +59,7 @@ def get_tools_agent_executor(
             return "continue"
 
     # Define the function to execute tools
-    async def call_tool(messages):
+    async def call_tool(messages, config: RunnableConfig):
         actions: list[ToolInvocation] = []
         # Based on the continue condition
         # we know the last message involves a function call
@@ -72,6 +73,7 @@ def get_tools_agent_executor(
                 )
             )
         # We call the tool_executor and get back a response
+        tool_executor = ToolExecutor(bind_runtime_tools(tools, config))
         responses = await tool_executor.abatch(actions)
         # We use the response to create a ToolMessage
         tool_messages = [
@@ -1,10 +1,19 @@
-from typing import Annotated, List
+from typing import Annotated, List, Optional
 from uuid import uuid4
 
-from fastapi import APIRouter, HTTPException, Path
+from fastapi import APIRouter, HTTPException, Path, Request
 from pydantic import BaseModel, Field
 
 import app.storage as storage
+from app.api.pagination import (
+    CursorParam,
+    Full,
+    Limit,
+    decode_cursor,
+    list_etag,
+    not_modified,
+    page_response,
+)
 from app.auth.handlers import AuthedUser
 from app.schema import Assistant
 
@@ -23,15 +32,43 @@ AssistantID = Annotated[str, Path(description="The ID of the assistant.")]
 
 
 @router.get("/")
-async def list_assistants(user: AuthedUser) -> List[Assistant]:
-    """List all assistants for the current user."""
-    return await storage.list_assistants(user["project_id"])
+async def list_assistants(
+    user: AuthedUser,
+    request: Request,
+    limit: Optional[int] = Limit,
+    cursor: Optional[str] = CursorParam,
+    full: bool = Full,
+) -> List[Assistant]:
+    """List the assistants of the current project, most recently updated first."""
+    version = await storage.list_assistants_version(user["project_id"])
+    etag = list_etag(request, user["project_id"], *version)
+    if response := not_modified(request, etag):
+        return response
+    assistants = await storage.list_assistants(
+        user["project_id"], after=decode_cursor(cursor), limit=limit, full=full
+    )
+    return page_response(
+        request, assistants, ("updated_at", "assistant_id"), limit, etag
+    )
 
 
 @router.get("/public/")
-async def list_public_assistants() -> List[Assistant]:
-    """List all public assistants."""
-    return await storage.list_public_assistants()
+async def list_public_assistants(
+    request: Request,
+    limit: Optional[int] = Limit,
+    cursor: Optional[str] = CursorParam,
+    full: bool = Full,
+) -> List[Assistant]:
+    """List all public assistants, most recently updated first."""
+    etag = list_etag(request, *await storage.list_public_assistants_version())
+    if response := not_modified(request, etag):
+        return response
+    assistants = await storage.list_public_assistants(
+        after=decode_cursor(cursor), limit=limit, full=full
+    )
+    return page_response(
+        request, assistants, ("updated_at", "assistant_id"), limit, etag
+    )
 
 
 @router.get("/{aid}")
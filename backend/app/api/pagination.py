@@ -0,0 +1,70 @@
+"""Keyset pagination and conditional responses for the list endpoints.
+
+Pages are requested with `limit` and `cursor`. When a page is full, the
+cursor of the next one is returned in the `X-Next-Cursor` header. Responses
+carry an `ETag`, so clients polling with `If-None-Match` get an empty 304 when
+nothing changed. The ETag is computed from a cheap version of the whole list,
+so the 304 is returned without fetching the rows.
+"""
+import base64
+import hashlib
+from datetime import datetime
+from typing import Any, Callable, Optional, Sequence
+
+import orjson
+from fastapi import HTTPException, Query, Request, Response
+
+from app.storage import Cursor
+from app.stream import dumps
+
+Limit = Query(None, ge=1, le=1000, description="Maximum number of items.")
+CursorParam = Query(None, description="Cursor returned in X-Next-Cursor.")
+Full = Query(True, description="Include the config and metadata of each item.")
+
+
+def encode_cursor(row: Any, order: tuple[str, str]) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps([row[k] for k in order])).decode()
+
+
+def decode_cursor(
+    cursor: Optional[str],
+    parse: Optional[Callable[[Any], Any]] = datetime.fromisoformat,
+) -> Optional[Cursor]:
+    """Decode a cursor, parsing its sort key with `parse` if given."""
+    if cursor is None:
+        return None
+    try:
+        key, id_ = orjson.loads(base64.urlsafe_b64decode(cursor))
+        return (parse(key) if parse else key), id_
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def list_etag(request: Request, *version: Any) -> str:
+    """ETag of the page requested from a list with the given version."""
+    key = dumps([*version, str(request.url.path), str(request.query_params)])
+    return f'"{hashlib.sha1(key).hexdigest()}"'
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """Return a 304 if the client already has the page with `etag`."""
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+
+def page_response(
+    request: Request,
+    rows: Sequence[Any],
+    order: tuple[str, str],
+    limit: Optional[int],
+    etag: Optional[str] = None,
+) -> Response:
+    """Return a page of `rows`, with an ETag hashed from them unless given."""
+    body = dumps([dict(row) for row in rows])
+    headers = {"ETag": etag or f'"{hashlib.sha1(body).hexdigest()}"'}
+    if limit is not None and len(rows) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1], order)
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
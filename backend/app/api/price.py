@@ -1,18 +1,14 @@
 from fastapi import APIRouter, HTTPException, Path, Form, Request
 import jwt
 from datetime import datetime, timedelta, timezone
-import os
 from app.auth.handlers import AuthedUser
 
 import app.storage as storage
-
-import stripe
+from app import billing
 
 
 router = APIRouter()
 
-stripe.api_key = os.environ["STRIPE_PRIVATE_KEY"]
-
 
 @router.get("/agent")
 async def get_agent_price(user: AuthedUser, agent_name:str) -> dict:
@@ -28,9 +24,6 @@ async def get_agent_price(user: AuthedUser, agent_name:str) -> dict:
 @router.get("/token")
 async def get_token_price() :
     """Get the price of a token."""
-    print("Token ID", os.environ["STRIPE_TOKEN_ID"])
-    product = stripe.Product.retrieve(os.environ["STRIPE_TOKEN_ID"])
-    price = stripe.Price.retrieve(product.default_price)
-    return price
+    return await billing.get_token_price()
     
    
\ No newline at end of file
@@ -2,6 +2,7 @@ import os
 from fastapi import APIRouter, HTTPException, Path, Form, Request
 from app.auth.handlers import AuthedUser
 import app.storage as storage
+from app.api.pagination import CursorParam, Limit, decode_cursor, page_response
 from typing import Any, List, Optional, Sequence, Union
 from app.schema import Assistant, Thread, User, Project
 
@@ -16,10 +17,17 @@ from datetime import datetime, timedelta, timezone
 router = APIRouter()
 
 @router.get("/")
-async def list_projects(user: AuthedUser) -> List[Project]:
-    """List all projects."""
-    project = await storage.list_projects(user["user_id"])
-    return project
+async def list_projects(
+    user: AuthedUser,
+    request: Request,
+    limit: Optional[int] = Limit,
+    cursor: Optional[str] = CursorParam,
+) -> List[Project]:
+    """List all projects by name."""
+    projects = await storage.list_projects(
+        user["user_id"], after=decode_cursor(cursor, parse=None), limit=limit
+    )
+    return page_response(request, projects, ("name", "project_id"), limit)
 
 @router.post("/")
 async def create_project(user: AuthedUser, request: Request) -> Project:
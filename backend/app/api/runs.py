@@ -2,7 +2,8 @@ from typing import Any, Dict, Optional, Sequence, Union
 from uuid import UUID
 
 import langsmith.client
-from fastapi import APIRouter, BackgroundTasks, HTTPException
+import orjson
+from fastapi import APIRouter, Header, HTTPException, Response
 from fastapi.exceptions import RequestValidationError
 from langchain.pydantic_v1 import ValidationError
 from langchain_core.messages import AnyMessage
@@ -11,14 +12,38 @@ from langsmith.utils import tracing_is_enabled
 from pydantic import BaseModel, Field
 from sse_starlette import EventSourceResponse
 
+from app import worker  # noqa: F401 registers the run worker
 from app.agent import agent
 from app.auth.handlers import AuthedUser
-from app.storage import get_assistant, get_thread
-from app.stream import astream_state, to_sse
+from app.lifespan import add_listener
+from app.schema import Run
+from app.storage import (
+    STREAM_CANCEL_CHANNEL,
+    cancel_run,
+    cancel_stream,
+    get_run,
+    get_thread_with_assistant,
+)
+from app.storage import create_run as db_create_run
+from app.stream import (
+    astream_state,
+    cancel_detached,
+    detached_sse,
+    dumps,
+    resume_sse,
+)
 
 router = APIRouter()
 
 
+def _on_stream_cancelled(payload: str) -> None:
+    owner, _, run_id = payload.partition(":")
+    cancel_detached(run_id, owner)
+
+
+add_listener(STREAM_CANCEL_CHANNEL, _on_stream_cancelled)
+
+
 class CreateRunPayload(BaseModel):
     """Payload for creating a run."""
 
@@ -30,11 +55,11 @@ class CreateRunPayload(BaseModel):
 
 
 async def _run_input_and_config(payload: CreateRunPayload, user_id: str):
-    thread = await get_thread(user_id, payload.thread_id)
-    if not thread:
+    resolved = await get_thread_with_assistant(user_id, payload.thread_id)
+    if not resolved:
         raise HTTPException(status_code=404, detail="Thread not found")
 
-    assistant = await get_assistant(user_id, str(thread["assistant_id"]))
+    thread, assistant, _ = resolved
     if not assistant:
         raise HTTPException(status_code=404, detail="Assistant not found")
 
@@ -62,24 +87,44 @@ async def _run_input_and_config(payload: CreateRunPayload, user_id: str):
 async def create_run(
     payload: CreateRunPayload,
     user: AuthedUser,
-    background_tasks: BackgroundTasks,
-):
-    """Create a run."""
+) -> Run:
+    """Queue a run for execution in the background."""
     input_, config = await _run_input_and_config(payload, user["project_id"])
-    background_tasks.add_task(agent.ainvoke, input_, config)
-    return {"status": "ok"}  # TODO add a run id
+    return await db_create_run(
+        user["project_id"],
+        config["configurable"]["thread_id"],
+        config["configurable"]["assistant_id"],
+        input=orjson.loads(dumps(input_)),
+        config=config,
+    )
 
 
 @router.post("/stream")
 async def stream_run(
     payload: CreateRunPayload,
     user: AuthedUser,
+    last_event_id: Optional[str] = Header(None),
+    deltas: bool = False,
 ):
-    """Create a run."""
+    """Create a run, or resume streaming one after `Last-Event-ID`.
+
+    With `deltas`, messages being generated are streamed as `delta` events
+    carrying only the new content, followed by the full message.
+
+    Runs can only be resumed from the process executing them, for
+    `STREAM_REPLAY_TTL` seconds after they finish. Otherwise 409 is returned,
+    and the client should reload the thread rather than start the run again.
+    """
+    if last_event_id:
+        if resumed := resume_sse(last_event_id, user["project_id"]):
+            return EventSourceResponse(resumed)
+        raise HTTPException(status_code=409, detail="Run cannot be resumed")
     input_, config = await _run_input_and_config(payload, user["project_id"])
-    """Change the input type to a dict"""
-    # input_ = {"messages": input_}
-    return EventSourceResponse(to_sse(astream_state(agent, input_, config)))
+    return EventSourceResponse(
+        detached_sse(
+            astream_state(agent, input_, config, deltas=deltas), user["project_id"]
+        )
+    )
 
 
 @router.get("/input_schema")
@@ -100,6 +145,30 @@ async def config_schema() -> dict:
     return agent.config_schema().schema()
 
 
+@router.get("/{run_id}")
+async def get_run_status(run_id: str, user: AuthedUser) -> Run:
+    """Get a run and its status."""
+    run = await get_run(user["project_id"], run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return run
+
+
+@router.post("/{run_id}/cancel", response_model=Run)
+async def cancel_run_endpoint(run_id: str, user: AuthedUser) -> Union[Run, Response]:
+    """Cancel a pending or running run.
+
+    Runs started with `/runs/stream` are not stored, so the request is passed
+    on to the process executing them, and 202 is returned.
+    """
+    run = await cancel_run(user["project_id"], run_id)
+    if run:
+        return run
+    if not cancel_detached(run_id, user["project_id"]):
+        await cancel_stream(user["project_id"], run_id)
+    return Response(status_code=202)
+
+
 if tracing_is_enabled():
     langsmith_client = langsmith.client.Client()
 
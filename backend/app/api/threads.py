@@ -1,13 +1,25 @@
+from datetime import datetime
 from typing import Annotated, Any, Dict, List, Optional, Sequence, Union
 from uuid import uuid4
 
-from fastapi import APIRouter, HTTPException, Path
+from fastapi import APIRouter, HTTPException, Path, Query, Request
+from fastapi.responses import StreamingResponse
 from langchain.schema.messages import AnyMessage
 from pydantic import BaseModel, Field
 
 import app.storage as storage
+from app.api.pagination import (
+    CursorParam,
+    Full,
+    Limit,
+    decode_cursor,
+    list_etag,
+    not_modified,
+    page_response,
+)
 from app.auth.handlers import AuthedUser
-from app.schema import Thread
+from app.schema import Assistant, Thread
+from app.stream import dumps
 
 router = APIRouter()
 
@@ -29,11 +41,33 @@ class ThreadPostRequest(BaseModel):
     config: Optional[Dict[str, Any]] = None
 
 
-@router.get("/")
-async def list_threads(user: AuthedUser) -> List[Thread]:
-    """List all threads for the current user."""
+async def _get_thread_assistant(project_id: str, tid: str) -> Assistant:
+    resolved = await storage.get_thread_with_assistant(project_id, tid)
+    if not resolved:
+        raise HTTPException(status_code=404, detail="Thread not found")
+    _, assistant, _ = resolved
+    if not assistant:
+        raise HTTPException(status_code=400, detail="Thread has no assistant")
+    return assistant
 
-    return await storage.list_threads(user["project_id"])
+
+@router.get("/")
+async def list_threads(
+    user: AuthedUser,
+    request: Request,
+    limit: Optional[int] = Limit,
+    cursor: Optional[str] = CursorParam,
+    full: bool = Full,
+) -> List[Thread]:
+    """List the threads of the current project, most recently updated first."""
+    version = await storage.list_threads_version(user["project_id"])
+    etag = list_etag(request, user["project_id"], *version)
+    if response := not_modified(request, etag):
+        return response
+    threads = await storage.list_threads(
+        user["project_id"], after=decode_cursor(cursor), limit=limit, full=full
+    )
+    return page_response(request, threads, ("updated_at", "thread_id"), limit, etag)
 
 
 @router.get("/{tid}/state")
@@ -42,12 +76,7 @@ async def get_thread_state(
     tid: ThreadID,
 ):
     """Get state for a thread."""
-    thread = await storage.get_thread(user["project_id"], tid)
-    if not thread:
-        raise HTTPException(status_code=404, detail="Thread not found")
-    assistant = await storage.get_assistant(user["project_id"], thread["assistant_id"])
-    if not assistant:
-        raise HTTPException(status_code=400, detail="Thread has no assistant")
+    assistant = await _get_thread_assistant(user["project_id"], tid)
     return await storage.get_thread_state(
         project_id=user["project_id"],
         thread_id=tid,
@@ -62,12 +91,7 @@ async def add_thread_state(
     payload: ThreadPostRequest,
 ):
     """Add state to a thread."""
-    thread = await storage.get_thread(user["project_id"], tid)
-    if not thread:
-        raise HTTPException(status_code=404, detail="Thread not found")
-    assistant = await storage.get_assistant(user["project_id"], thread["assistant_id"])
-    if not assistant:
-        raise HTTPException(status_code=400, detail="Thread has no assistant")
+    assistant = await _get_thread_assistant(user["project_id"], tid)
     return await storage.update_thread_state(
         payload.config or {"configurable": {"thread_id": tid}},
         payload.values,
@@ -80,19 +104,33 @@ async def add_thread_state(
 async def get_thread_history(
     user: AuthedUser,
     tid: ThreadID,
+    limit: Optional[int] = Query(None, ge=1, description="Maximum number of states."),
+    before: Optional[datetime] = Query(
+        None, description="Only return states older than this thread_ts."
+    ),
+    stream: bool = Query(False, description="Stream states as NDJSON."),
+    metadata_only: bool = Query(
+        False, description="Only return checkpoint configs, not the state values."
+    ),
 ):
-    """Get all past states for a thread."""
-    thread = await storage.get_thread(user["project_id"], tid)
-    if not thread:
-        raise HTTPException(status_code=404, detail="Thread not found")
-    assistant = await storage.get_assistant(user["project_id"], thread["assistant_id"])
-    if not assistant:
-        raise HTTPException(status_code=400, detail="Thread has no assistant")
-    return await storage.get_thread_history(
-        user_id=user["project_id"],
+    """Get past states for a thread, newest first."""
+    assistant = await _get_thread_assistant(user["project_id"], tid)
+    kwargs = dict(
+        project_id=user["project_id"],
         thread_id=tid,
         assistant=assistant,
+        limit=limit,
+        before=before,
+        metadata_only=metadata_only,
     )
+    if stream:
+
+        async def _ndjson():
+            async for state in storage.astream_thread_history(**kwargs):
+                yield dumps(state) + b"\n"
+
+        return StreamingResponse(_ndjson(), media_type="application/x-ndjson")
+    return await storage.get_thread_history(**kwargs)
 
 
 @router.get("/{tid}")
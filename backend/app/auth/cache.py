@@ -0,0 +1,47 @@
+"""Caches sparing authenticated requests a database round trip.
+
+Users are cached for a short TTL and invalidated whenever storage mutates
+them, locally and in other processes through NOTIFY. Verified JWT payloads
+are cached until the token expires.
+"""
+import hashlib
+import os
+import time
+from typing import Any
+
+from app import metrics
+from app.cache import TTLCache
+from app.lifespan import add_listener
+
+USERS_CHANNEL = "users"
+"""Channel notified with the user ID whenever a user is updated."""
+
+user_cache: TTLCache[Any] = TTLCache(
+    int(os.environ.get("AUTH_USER_CACHE_SIZE", "10000")),
+    float(os.environ.get("AUTH_USER_CACHE_TTL", "30")),
+)
+"""User records by user ID."""
+
+token_cache: TTLCache[dict] = TTLCache(
+    int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", "10000")), float("inf")
+)
+"""Verified JWT payloads by token hash."""
+
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def cache_token(token: str, payload: dict) -> None:
+    """Cache a verified payload until the token expires."""
+    if "exp" in payload:
+        token_cache.put(token_key(token), payload, payload["exp"] - time.time())
+
+
+def invalidate_user(user_id: str) -> None:
+    user_cache.invalidate(str(user_id))
+
+
+add_listener(USERS_CHANNEL, invalidate_user, user_cache.clear)
+metrics.register("auth_user_cache_size", lambda: len(user_cache))
+metrics.register("auth_token_cache_size", lambda: len(token_cache))
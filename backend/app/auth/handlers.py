@@ -8,6 +8,8 @@ from fastapi import Depends, HTTPException, Request
 from fastapi.security.http import HTTPBearer
 
 import app.storage as storage
+from app import metrics
+from app.auth.cache import cache_token, token_cache, token_key, user_cache
 from app.auth.settings import AuthType, settings
 from app.schema import User
 
@@ -31,13 +33,21 @@ class JWTAuthBase(AuthHandler):
     async def __call__(self, request: Request) -> User:
         http_bearer = await HTTPBearer()(request)
         token = http_bearer.credentials
-        try:
-            payload = self.decode_token(token, self.get_decode_key(token))
-        except jwt.PyJWTError as e:
-            raise HTTPException(status_code=401, detail=str(e))
-
-
-        user = await storage.get_user_by_id(payload["user_id"])
+        if (payload := token_cache.get(token_key(token))) is None:
+            try:
+                payload = self.decode_token(token, self.get_decode_key(token))
+            except jwt.PyJWTError as e:
+                raise HTTPException(status_code=401, detail=str(e))
+            cache_token(token, payload)
+
+        user_id = str(payload["user_id"])
+        if (user := user_cache.get(user_id)) is not None:
+            metrics.inc("auth_user_cache_hits")
+        else:
+            metrics.inc("auth_user_cache_misses")
+            user = await storage.get_user_by_id(user_id)
+            if user is not None:
+                user_cache.put(user_id, user)
         #Check if payload has project_id
         if ("project_id" in payload):
             user = dict(user)
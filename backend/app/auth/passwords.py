@@ -0,0 +1,60 @@
+"""Password hashing off the event loop.
+
+bcrypt takes tens to hundreds of milliseconds of CPU per call, so hashing and
+verification run on a small thread pool, which bcrypt can use in parallel as
+it releases the GIL. The pool size bounds how many run at once.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from app import metrics
+
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+"""Cost factor of new hashes. Older hashes are upgraded on login."""
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("PASSWORD_HASH_WORKERS", "2")),
+    thread_name_prefix="bcrypt",
+)
+
+
+def _hash(password: str) -> str:
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode("utf-8"), salt).decode("utf-8")
+
+
+def _verify(password: str, hashed: str) -> bool:
+    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+async def hash_password(password: str) -> str:
+    start = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            _executor, _hash, password
+        )
+    finally:
+        metrics.observe("password_hash_seconds", time.perf_counter() - start)
+
+
+async def verify_password(password: str, hashed: str) -> bool:
+    if not hashed:
+        # Users signed up through an identity provider have no password.
+        return False
+    start = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            _executor, _verify, password, hashed
+        )
+    finally:
+        metrics.observe("password_verify_seconds", time.perf_counter() - start)
+
+
+def needs_rehash(hashed: str) -> bool:
+    """Whether `hashed` was made with a cost factor other than the current one."""
+    # bcrypt hashes look like $2b$<rounds>$<salt and hash>
+    return int(hashed.split("$")[2]) != BCRYPT_ROUNDS
@@ -0,0 +1,82 @@
+"""Stripe calls that don't block the event loop.
+
+The Stripe SDK is synchronous, so its calls run on a bounded thread pool.
+The token price is cached for `STRIPE_PRICE_CACHE_TTL` seconds.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import stripe
+
+from app.cache import TTLCache
+
+stripe.api_key = os.environ.get("STRIPE_PRIVATE_KEY")
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("STRIPE_MAX_WORKERS", "8")),
+    thread_name_prefix="stripe",
+)
+_prices: TTLCache[Any] = TTLCache(
+    16, float(os.environ.get("STRIPE_PRICE_CACHE_TTL", "300"))
+)
+
+
+async def _call(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor, functools.partial(fn, *args, **kwargs)
+    )
+
+
+async def create_customer(email: str) -> str:
+    """Create a Stripe customer and return its ID."""
+    customer = await _call(stripe.Customer.create, email=email)
+    return customer["id"]
+
+
+async def get_token_price() -> stripe.Price:
+    """Get the default price of the token product."""
+    product_id = os.environ["STRIPE_TOKEN_ID"]
+    if (price := _prices.get(product_id)) is None:
+        product = await _call(stripe.Product.retrieve, product_id)
+        price = await _call(stripe.Price.retrieve, product.default_price)
+        _prices.put(product_id, price)
+    return price
+
+
+async def create_checkout_session(
+    client_reference_id: str, quantity: int
+) -> stripe.checkout.Session:
+    """Create a checkout session for `quantity` tokens."""
+    return await _call(
+        stripe.checkout.Session.create,
+        line_items=[
+            {
+                # Provide the exact Price ID (for example, pr_1234) of the product you want to sell
+                "price": os.environ["STRIPE_TOKEN_PRICE"],
+                "quantity": quantity,
+            },
+        ],
+        client_reference_id=client_reference_id,
+        mode="payment",
+        success_url=os.environ["FRONTEND_URL"] + "/payment/success",
+        cancel_url=os.environ["FRONTEND_URL"] + "/payment/canceled",
+        automatic_tax={"enabled": True},
+    )
+
+
+async def list_line_items(session_id: str, limit: int = 1) -> stripe.ListObject:
+    """List the line items of a checkout session."""
+    return await _call(stripe.checkout.Session.list_line_items, session_id, limit=limit)
+
+
+def construct_event(payload: bytes, sig_header: str) -> stripe.Event:
+    """Verify the signature of a webhook payload and parse it.
+
+    This doesn't call Stripe, so it runs inline.
+    """
+    return stripe.Webhook.construct_event(
+        payload, sig_header, os.environ["STRIPE_ENDPOINT_SECRET"]
+    )
@@ -1,7 +1,10 @@
-import pickle
-from datetime import datetime
-from typing import AsyncIterator, Optional
+import os
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, NamedTuple, Optional
+from uuid import uuid4
 
+import asyncpg
 from langchain_core.messages import BaseMessage
 from langchain_core.runnables import ConfigurableFieldSpec, RunnableConfig
 from langgraph.checkpoint import BaseCheckpointSaver
@@ -13,25 +16,175 @@ from langgraph.checkpoint.base import (
     SerializerProtocol,
 )
 
-from app.lifespan import get_pg_pool
+from app import metrics
+from app.lifespan import add_listener, get_pg_pool, prepare
+from app.serde import CheckpointSerializer, is_legacy
 
+DELTAS_KEY = "deltas"
+"""Key of delta rows mapping each delta channel to its parent list length."""
 
-def loads(value: bytes) -> Checkpoint:
-    loaded: Checkpoint = pickle.loads(value)
-    for key, value in loaded["channel_values"].items():
-        if isinstance(value, list) and all(isinstance(v, BaseMessage) for v in value):
-            loaded["channel_values"][key] = [v.__class__(**v.__dict__) for v in value]
-    return loaded
+NOTIFY_CHANNEL = "checkpoints"
+"""Channel notified with "<process token>:<thread id>" on every write."""
+
+_PROCESS_TOKEN = uuid4().hex
+
+_GET_LATEST = prepare(
+    "SELECT checkpoint, parent_ts, delta, thread_ts FROM checkpoints "
+    "WHERE thread_id = $1 ORDER BY thread_ts DESC LIMIT 1"
+)
+
+
+class _Latest(NamedTuple):
+    """The latest checkpoint of a thread, as last read or written here."""
+
+    thread_ts: datetime
+    parent_ts: Optional[datetime]
+    checkpoint: Checkpoint
+    depth: int
+    """Number of delta rows between this checkpoint and its snapshot."""
+    size: int
+    """Approximate size in bytes, from the encoded rows."""
+
+
+class CheckpointCache:
+    """LRU of the latest checkpoint per thread, bounded by count and bytes."""
+
+    def __init__(self, max_threads: int, max_bytes: int) -> None:
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: OrderedDict[str, _Latest] = OrderedDict()
+
+    def get(self, thread_id: str) -> Optional[_Latest]:
+        entry = self._entries.get(thread_id)
+        if entry is not None:
+            self._entries.move_to_end(thread_id)
+        return entry
+
+    def put(self, thread_id: str, entry: _Latest) -> None:
+        if self.max_threads <= 0 or entry.size > self.max_bytes:
+            self.invalidate(thread_id)
+            return
+        current = self._entries.get(thread_id)
+        if current is not None:
+            if current.thread_ts > entry.thread_ts:
+                return
+            self.bytes -= current.size
+        self._entries[thread_id] = entry
+        self._entries.move_to_end(thread_id)
+        self.bytes += entry.size
+        while len(self._entries) > self.max_threads or self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= evicted.size
+
+    def invalidate(self, thread_id: str) -> None:
+        if (entry := self._entries.pop(thread_id, None)) is not None:
+            self.bytes -= entry.size
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.bytes = 0
+
+    def on_notify(self, payload: str) -> None:
+        token, _, thread_id = payload.partition(":")
+        if token != _PROCESS_TOKEN:
+            self.invalidate(thread_id)
+
+
+def _is_message_list(value: Any) -> bool:
+    return isinstance(value, list) and all(isinstance(v, BaseMessage) for v in value)
+
+
+def _diff(parent: Checkpoint, checkpoint: Checkpoint) -> Optional[Checkpoint]:
+    """Encode the message channels of checkpoint relative to parent.
+
+    A channel is delta-encoded only when the parent's message list is an
+    unchanged prefix of the new one; any other channel is stored in full.
+    Returns None when no channel could be delta-encoded.
+    """
+    deltas = {}
+    channel_values = dict(checkpoint["channel_values"])
+    for key, value in checkpoint["channel_values"].items():
+        base = parent["channel_values"].get(key)
+        if not (_is_message_list(value) and _is_message_list(base)):
+            continue
+        if len(base) > len(value):
+            continue
+        if all(a is b or a == b for a, b in zip(base, value)):
+            deltas[key] = len(base)
+            channel_values[key] = value[len(base) :]
+    if not deltas:
+        return None
+    return {**checkpoint, "channel_values": channel_values, DELTAS_KEY: deltas}
+
+
+def _apply(parent: Checkpoint, stored: Checkpoint) -> Checkpoint:
+    """Rebuild a full checkpoint from its parent and a delta row."""
+    deltas = stored.pop(DELTAS_KEY)
+    for key, base_len in deltas.items():
+        base = parent["channel_values"][key]
+        if len(base) != base_len:
+            raise ValueError(f"Checkpoint delta for {key} does not match its parent")
+        stored["channel_values"][key] = base + stored["channel_values"][key]
+    return stored
+
+
+def _parent_config(thread_id: str, parent_ts: Optional[datetime]):
+    if not parent_ts:
+        return None
+    return {"configurable": {"thread_id": thread_id, "thread_ts": parent_ts}}
+
+
+def _before_ts(
+    before: Optional[RunnableConfig], configurable: dict
+) -> Optional[datetime]:
+    thread_ts = (
+        before["configurable"].get("thread_ts")
+        if before
+        else configurable.get("history_before")
+    )
+    if isinstance(thread_ts, str):
+        return datetime.fromisoformat(thread_ts)
+    return thread_ts
 
 
 class PostgresCheckpoint(BaseCheckpointSaver):
+    """Checkpoint saver backed by the `checkpoints` table.
+
+    With a snapshot interval above 1, each row stores only the messages added
+    since its parent, and a full snapshot is written at least every
+    `snapshot_interval` rows. Reads replay deltas from the nearest snapshot.
+
+    The latest checkpoint of recently used threads is kept in memory and
+    updated on every write, so a graph step does not read back what this
+    process just wrote. Writes are announced with NOTIFY so that other
+    processes drop their copy.
+    """
+
     def __init__(
         self,
         *,
         serde: Optional[SerializerProtocol] = None,
         at: Optional[CheckpointAt] = None,
+        snapshot_interval: Optional[int] = None,
+        cache_max_threads: Optional[int] = None,
+        cache_max_bytes: Optional[int] = None,
     ) -> None:
-        super().__init__(serde=serde, at=at)
+        super().__init__(serde=serde or CheckpointSerializer(), at=at)
+        self.snapshot_interval = (
+            snapshot_interval
+            if snapshot_interval is not None
+            else int(os.environ.get("CHECKPOINT_SNAPSHOT_INTERVAL", "1"))
+        )
+        self.cache = CheckpointCache(
+            max_threads=cache_max_threads
+            if cache_max_threads is not None
+            else int(os.environ.get("CHECKPOINT_CACHE_MAX_THREADS", "1000")),
+            max_bytes=cache_max_bytes
+            if cache_max_bytes is not None
+            else int(os.environ.get("CHECKPOINT_CACHE_MAX_BYTES", str(64 * 2**20))),
+        )
+        add_listener(NOTIFY_CHANNEL, self.cache.on_notify, self.cache.clear)
 
     @property
     def config_specs(self) -> list[ConfigurableFieldSpec]:
@@ -53,95 +206,315 @@ class PostgresCheckpoint(BaseCheckpointSaver):
     def put(self, config: RunnableConfig, checkpoint: Checkpoint) -> RunnableConfig:
         raise NotImplementedError
 
-    async def alist(self, config: RunnableConfig) -> AsyncIterator[CheckpointTuple]:
+    async def _aget_full(
+        self, conn: asyncpg.Connection, thread_id: str, thread_ts: datetime
+    ) -> tuple[Checkpoint, int, int]:
+        """Load a checkpoint by replaying its delta chain in one query."""
+        chain = await conn.fetch(
+            """
+            WITH RECURSIVE chain AS (
+                SELECT thread_ts, parent_ts, checkpoint, delta
+                FROM checkpoints WHERE thread_id = $1 AND thread_ts = $2
+                UNION ALL
+                SELECT c.thread_ts, c.parent_ts, c.checkpoint, c.delta
+                FROM checkpoints c JOIN chain ON c.thread_ts = chain.parent_ts
+                WHERE c.thread_id = $1 AND chain.delta
+            )
+            SELECT checkpoint, delta FROM chain ORDER BY thread_ts""",
+            thread_id,
+            thread_ts,
+        )
+        if not chain or chain[0]["delta"]:
+            raise ValueError(f"Missing snapshot for checkpoint {thread_ts}")
+        checkpoint = self.serde.loads(chain[0]["checkpoint"])
+        for row in chain[1:]:
+            checkpoint = _apply(checkpoint, self.serde.loads(row["checkpoint"]))
+        return checkpoint, len(chain) - 1, sum(len(r["checkpoint"]) for r in chain)
+
+    async def alist(
+        self,
+        config: RunnableConfig,
+        *,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        """List checkpoints of a thread, newest first.
+
+        Args:
+            config: Config holding the thread ID. Since
+                `Pregel.aget_state_history` only forwards the config,
+                `history_before` and `history_limit` configurable keys are
+                used when `before` and `limit` are not given.
+            before: Only list checkpoints older than this checkpoint config.
+            limit: Maximum number of checkpoints to list.
+        """
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        before_ts = _before_ts(before, configurable)
+        limit = limit if limit is not None else configurable.get("history_limit")
+        async with get_pg_pool().acquire() as db, db.transaction():
+            # Rows are read newest first, but deltas need their (older)
+            # parents, so buffer each run of deltas down to its snapshot.
+            pending = []
+            async for value in db.cursor(
+                "SELECT checkpoint, thread_ts, parent_ts, delta FROM checkpoints WHERE thread_id = $1 AND ($2::timestamptz IS NULL OR thread_ts < $2) ORDER BY thread_ts DESC LIMIT $3",
+                thread_id,
+                before_ts,
+                limit,
+            ):
+                pending.append(value)
+                if value["delta"]:
+                    continue
+                for item in await self._aresolve(db, thread_id, pending):
+                    yield item
+                pending = []
+            for item in await self._aresolve(db, thread_id, pending):
+                yield item
+
+    async def alist_metadata(
+        self,
+        config: RunnableConfig,
+        *,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[dict]:
+        """List checkpoint configs of a thread without decoding them.
+
+        Takes the same arguments as `alist`.
+        """
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        limit = limit if limit is not None else configurable.get("history_limit")
         async with get_pg_pool().acquire() as db, db.transaction():
-            thread_id = config["configurable"]["thread_id"]
             async for value in db.cursor(
-                "SELECT checkpoint, thread_ts, parent_ts FROM checkpoints WHERE thread_id = $1 ORDER BY thread_ts DESC",
+                "SELECT thread_ts, parent_ts, octet_length(checkpoint) FROM checkpoints WHERE thread_id = $1 AND ($2::timestamptz IS NULL OR thread_ts < $2) ORDER BY thread_ts DESC LIMIT $3",
                 thread_id,
+                _before_ts(before, configurable),
+                limit,
             ):
-                yield CheckpointTuple(
-                    {
+                yield {
+                    "config": {
                         "configurable": {
                             "thread_id": thread_id,
-                            "thread_ts": value[1],
+                            "thread_ts": value[0],
                         }
                     },
-                    loads(value[0]),
-                    {
-                        "configurable": {
-                            "thread_id": thread_id,
-                            "thread_ts": value[2],
-                        }
+                    "parent": _parent_config(thread_id, value[1]),
+                    "size": value[2],
+                }
+
+    async def _aresolve(
+        self, conn: asyncpg.Connection, thread_id: str, rows: list
+    ) -> list[CheckpointTuple]:
+        known: dict[datetime, Checkpoint] = {}
+        for row in reversed(rows):
+            stored = self.serde.loads(row["checkpoint"])
+            if row["delta"]:
+                parent = known.get(row["parent_ts"])
+                if parent is None:
+                    parent, _, _ = await self._aget_full(
+                        conn, thread_id, row["parent_ts"]
+                    )
+                stored = _apply(parent, stored)
+            known[row["thread_ts"]] = stored
+        return [
+            CheckpointTuple(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "thread_ts": row["thread_ts"],
                     }
-                    if value[2]
-                    else None,
-                )
+                },
+                known[row["thread_ts"]],
+                _parent_config(thread_id, row["parent_ts"]),
+            )
+            for row in rows
+        ]
 
     async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
         thread_id = config["configurable"]["thread_id"]
         thread_ts = config["configurable"].get("thread_ts")
+        cached = self.cache.get(thread_id)
+        if cached is not None and (
+            not thread_ts or cached.thread_ts == datetime.fromisoformat(thread_ts)
+        ):
+            metrics.inc("checkpoint_cache_hits")
+            return CheckpointTuple(
+                config
+                if thread_ts
+                else {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "thread_ts": cached.thread_ts,
+                    }
+                },
+                {
+                    **cached.checkpoint,
+                    "channel_values": dict(cached.checkpoint["channel_values"]),
+                },
+                _parent_config(thread_id, cached.parent_ts),
+            )
+        metrics.inc("checkpoint_cache_misses")
         async with get_pg_pool().acquire() as conn:
             if thread_ts:
                 if value := await conn.fetchrow(
-                    "SELECT checkpoint, parent_ts FROM checkpoints WHERE thread_id = $1 AND thread_ts = $2",
+                    "SELECT checkpoint, parent_ts, delta FROM checkpoints WHERE thread_id = $1 AND thread_ts = $2",
                     thread_id,
                     datetime.fromisoformat(thread_ts),
                 ):
+                    checkpoint, _, _ = await self._aload(
+                        conn, thread_id, datetime.fromisoformat(thread_ts), value
+                    )
                     return CheckpointTuple(
                         config,
-                        loads(value[0]),
-                        {
-                            "configurable": {
-                                "thread_id": thread_id,
-                                "thread_ts": value[1],
-                            }
-                        }
-                        if value[1]
-                        else None,
+                        checkpoint,
+                        _parent_config(thread_id, value[1]),
                     )
             else:
-                if value := await conn.fetchrow(
-                    "SELECT checkpoint, thread_ts, parent_ts FROM checkpoints WHERE thread_id = $1 ORDER BY thread_ts DESC LIMIT 1",
-                    thread_id,
-                ):
+                statement = await conn.prepared(_GET_LATEST)
+                if value := await statement.fetchrow(thread_id):
+                    checkpoint, depth, size = await self._aload(
+                        conn, thread_id, value[3], value
+                    )
+                    # Only the latest checkpoint is cached, never historical
+                    # ones, which would be served as the latest.
+                    self.cache.put(
+                        thread_id,
+                        _Latest(value[3], value[1], checkpoint, depth, size),
+                    )
                     return CheckpointTuple(
                         {
                             "configurable": {
                                 "thread_id": thread_id,
-                                "thread_ts": value[1],
+                                "thread_ts": value[3],
                             }
                         },
-                        loads(value[0]),
-                        {
-                            "configurable": {
-                                "thread_id": thread_id,
-                                "thread_ts": value[2],
-                            }
-                        }
-                        if value[2]
-                        else None,
+                        checkpoint,
+                        _parent_config(thread_id, value[1]),
                     )
 
+    async def _aload(
+        self,
+        conn: asyncpg.Connection,
+        thread_id: str,
+        thread_ts: datetime,
+        value: asyncpg.Record,
+    ) -> tuple[Checkpoint, int, int]:
+        if value["delta"]:
+            return await self._aget_full(conn, thread_id, thread_ts)
+        return self.serde.loads(value["checkpoint"]), 0, len(value["checkpoint"])
+
     async def aput(self, config: RunnableConfig, checkpoint: Checkpoint) -> None:
         thread_id = config["configurable"]["thread_id"]
+        thread_ts = datetime.fromisoformat(checkpoint["ts"])
+        parent_ts = (
+            datetime.fromisoformat(checkpoint.get("parent_ts"))
+            if checkpoint.get("parent_ts")
+            else None
+        )
+        stored, depth = checkpoint, 0
+        latest = self.cache.get(thread_id)
+        if (
+            latest is not None
+            and parent_ts is not None
+            and latest.thread_ts == parent_ts
+            and latest.depth + 1 < self.snapshot_interval
+        ):
+            if (delta := _diff(latest.checkpoint, checkpoint)) is not None:
+                stored, depth = delta, latest.depth + 1
+        blob = self.serde.dumps(stored)
         async with get_pg_pool().acquire() as conn:
             await conn.execute(
                 """
-                INSERT INTO checkpoints (thread_id, thread_ts, parent_ts, checkpoint)
-                VALUES ($1, $2, $3, $4) 
-                ON CONFLICT (thread_id, thread_ts) 
-                DO UPDATE SET checkpoint = EXCLUDED.checkpoint;""",
+                WITH inserted AS (
+                    INSERT INTO checkpoints (thread_id, thread_ts, parent_ts, checkpoint, delta)
+                    VALUES ($1, $2, $3, $4, $5)
+                    ON CONFLICT (thread_id, thread_ts)
+                    DO UPDATE SET checkpoint = EXCLUDED.checkpoint, delta = EXCLUDED.delta
+                    RETURNING thread_id
+                )
+                SELECT pg_notify($6, $7 || thread_id) FROM inserted;""",
                 thread_id,
-                datetime.fromisoformat(checkpoint["ts"]),
-                datetime.fromisoformat(checkpoint.get("parent_ts"))
-                if checkpoint.get("parent_ts")
-                else None,
-                pickle.dumps(checkpoint),
+                thread_ts,
+                parent_ts,
+                blob,
+                depth > 0,
+                NOTIFY_CHANNEL,
+                f"{_PROCESS_TOKEN}:",
             )
+        size = len(blob) + (latest.size if depth > 0 else 0)
+        self.cache.put(
+            thread_id, _Latest(thread_ts, parent_ts, checkpoint, depth, size)
+        )
         return {
             "configurable": {
                 "thread_id": thread_id,
                 "thread_ts": checkpoint["ts"],
             }
         }
+
+
+async def migrate_legacy_checkpoints(
+    pool: asyncpg.pool.Pool,
+    serde: Optional[SerializerProtocol] = None,
+    *,
+    batch_size: int = 500,
+) -> int:
+    """Rewrite pickled checkpoints with the versioned codec.
+
+    Rows are processed in batches keyed on (thread_id, thread_ts), so the
+    migration can be interrupted and resumed at any time. Returns the number
+    of rows rewritten.
+    """
+    serde = serde or CheckpointSerializer()
+    rewritten = 0
+    cursor = ("", datetime.min.replace(tzinfo=timezone.utc))
+    while True:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT thread_id, thread_ts, checkpoint FROM checkpoints "
+                "WHERE (thread_id, thread_ts) > ($1, $2) "
+                "ORDER BY thread_id, thread_ts LIMIT $3",
+                cursor[0],
+                cursor[1],
+                batch_size,
+            )
+            if not rows:
+                return rewritten
+            updates = [
+                (
+                    serde.dumps(serde.loads(row["checkpoint"])),
+                    row["thread_id"],
+                    row["thread_ts"],
+                )
+                for row in rows
+                if is_legacy(row["checkpoint"])
+            ]
+            if updates:
+                await conn.executemany(
+                    "UPDATE checkpoints SET checkpoint = $1 "
+                    "WHERE thread_id = $2 AND thread_ts = $3",
+                    updates,
+                )
+            rewritten += len(updates)
+            cursor = (rows[-1]["thread_id"], rows[-1]["thread_ts"])
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    async def main() -> None:
+        pool = await asyncpg.create_pool(
+            database=os.environ["POSTGRES_DB"],
+            user=os.environ["POSTGRES_USER"],
+            password=os.environ["POSTGRES_PASSWORD"],
+            host=os.environ["POSTGRES_HOST"],
+            port=os.environ["POSTGRES_PORT"],
+        )
+        try:
+            rewritten = await migrate_legacy_checkpoints(pool)
+        finally:
+            await pool.close()
+        print(f"Rewrote {rewritten} legacy checkpoints.")
+
+    asyncio.run(main())
@@ -0,0 +1,196 @@
+"""Retention and compaction of the checkpoints table.
+
+Every graph step inserts a checkpoint row and nothing else removes them, so a
+background task periodically prunes rows according to a retention policy:
+
+* the last `keep_last` checkpoints of every thread are kept,
+* everything younger than `keep_all_for` is kept,
+* older checkpoints are thinned out to the latest one per hour,
+* checkpoints of threads that no longer exist are dropped.
+
+Rows that a kept delta checkpoint needs to be rebuilt are always kept.
+"""
+import asyncio
+import os
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Optional
+from uuid import UUID
+
+import asyncpg
+import structlog
+
+from app import metrics
+
+logger = structlog.get_logger(__name__)
+
+# Arbitrary key for the advisory lock ensuring a single compactor at a time.
+_LOCK_KEY = 0x6F67636B
+
+
+@dataclass
+class RetentionPolicy:
+    keep_last: int = 20
+    """Number of most recent checkpoints always kept per thread."""
+    keep_all_for: timedelta = timedelta(days=1)
+    """Checkpoints younger than this are never pruned."""
+    thread_batch_size: int = 100
+    """Number of threads processed per statement."""
+    row_batch_size: int = 5000
+    """Maximum number of rows deleted per statement."""
+
+    @classmethod
+    def from_env(cls) -> "RetentionPolicy":
+        return cls(
+            keep_last=int(os.environ.get("CHECKPOINT_KEEP_LAST", "20")),
+            keep_all_for=timedelta(
+                hours=float(os.environ.get("CHECKPOINT_KEEP_ALL_HOURS", "24"))
+            ),
+        )
+
+
+@dataclass
+class CompactionStats:
+    rows: int = 0
+    bytes: int = 0
+    orphan_threads: int = 0
+
+    def add(self, sizes: list[asyncpg.Record]) -> None:
+        self.rows += len(sizes)
+        self.bytes += sum(r[0] or 0 for r in sizes)
+
+
+_PRUNE_QUERY = """
+WITH RECURSIVE ranked AS (
+    SELECT thread_id, thread_ts, parent_ts, delta,
+        row_number() OVER (
+            PARTITION BY thread_id ORDER BY thread_ts DESC
+        ) AS rn,
+        row_number() OVER (
+            PARTITION BY thread_id, date_trunc('hour', thread_ts)
+            ORDER BY thread_ts DESC
+        ) AS hour_rn
+    FROM checkpoints
+    WHERE thread_id = ANY($1::text[])
+),
+keep AS (
+    SELECT thread_id, thread_ts, parent_ts, delta FROM ranked
+    WHERE rn <= $2 OR thread_ts > now() - $3::interval OR hour_rn = 1
+    UNION
+    SELECT c.thread_id, c.thread_ts, c.parent_ts, c.delta
+    FROM checkpoints c
+    JOIN keep k ON c.thread_id = k.thread_id AND c.thread_ts = k.parent_ts
+    WHERE k.delta
+),
+doomed AS (
+    SELECT r.thread_id, r.thread_ts FROM ranked r
+    WHERE NOT EXISTS (
+        SELECT 1 FROM keep k
+        WHERE k.thread_id = r.thread_id AND k.thread_ts = r.thread_ts
+    )
+    LIMIT $4
+)
+DELETE FROM checkpoints c USING doomed d
+WHERE c.thread_id = d.thread_id AND c.thread_ts = d.thread_ts
+RETURNING octet_length(c.checkpoint)
+"""
+
+
+def _parse_uuid(value: str) -> Optional[UUID]:
+    try:
+        return UUID(value)
+    except ValueError:
+        return None
+
+
+async def _compact_threads(
+    conn: asyncpg.Connection,
+    thread_ids: list[str],
+    policy: RetentionPolicy,
+    stats: CompactionStats,
+) -> None:
+    uuids = [u for u in map(_parse_uuid, thread_ids) if u is not None]
+    existing = {
+        str(r[0])
+        for r in await conn.fetch(
+            "SELECT thread_id FROM thread WHERE thread_id = ANY($1::uuid[])", uuids
+        )
+    }
+    orphans = [t for t in thread_ids if t not in existing]
+    if orphans:
+        stats.orphan_threads += len(orphans)
+        stats.add(
+            await conn.fetch(
+                "DELETE FROM checkpoints WHERE thread_id = ANY($1::text[]) "
+                "RETURNING octet_length(checkpoint)",
+                orphans,
+            )
+        )
+    live = [t for t in thread_ids if t in existing]
+    while live:
+        deleted = await conn.fetch(
+            _PRUNE_QUERY,
+            live,
+            policy.keep_last,
+            policy.keep_all_for,
+            policy.row_batch_size,
+        )
+        stats.add(deleted)
+        if len(deleted) < policy.row_batch_size:
+            break
+
+
+async def compact_checkpoints(
+    pool: asyncpg.pool.Pool, policy: Optional[RetentionPolicy] = None
+) -> Optional[CompactionStats]:
+    """Run one compaction pass over all threads.
+
+    Returns None if another process is already compacting.
+    """
+    policy = policy or RetentionPolicy.from_env()
+    stats = CompactionStats()
+    async with pool.acquire() as lock_conn:
+        if not await lock_conn.fetchval("SELECT pg_try_advisory_lock($1)", _LOCK_KEY):
+            return None
+        try:
+            last_thread_id = ""
+            while True:
+                async with pool.acquire() as conn:
+                    thread_ids = [
+                        r[0]
+                        for r in await conn.fetch(
+                            "SELECT DISTINCT thread_id FROM checkpoints "
+                            "WHERE thread_id > $1 ORDER BY thread_id LIMIT $2",
+                            last_thread_id,
+                            policy.thread_batch_size,
+                        )
+                    ]
+                    if not thread_ids:
+                        break
+                    await _compact_threads(conn, thread_ids, policy, stats)
+                last_thread_id = thread_ids[-1]
+        finally:
+            await lock_conn.execute("SELECT pg_advisory_unlock($1)", _LOCK_KEY)
+    metrics.inc("checkpoint_compaction_rows_deleted", stats.rows)
+    metrics.inc("checkpoint_compaction_bytes_reclaimed", stats.bytes)
+    metrics.inc("checkpoint_compaction_orphan_threads", stats.orphan_threads)
+    return stats
+
+
+async def run_compaction(pool: asyncpg.pool.Pool, interval: float) -> None:
+    """Compact checkpoints every `interval` seconds until cancelled."""
+    while True:
+        try:
+            stats = await compact_checkpoints(pool)
+            if stats is not None:
+                logger.info(
+                    "checkpoint compaction finished",
+                    rows=stats.rows,
+                    bytes=stats.bytes,
+                    orphan_threads=stats.orphan_threads,
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.warn("checkpoint compaction failed", exc_info=True)
+        await asyncio.sleep(interval)
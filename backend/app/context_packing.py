@@ -0,0 +1,193 @@
+"""Assembly of the retrieved context and chat history of retrieval prompts.
+
+Retrieved chunks overlap: the splitter repeats the end of each chunk at the
+start of the next, and the same passage is often found by both searches of
+hybrid retrieval. Before they are put in the prompt, chunks are deduplicated,
+neighbouring chunks of the same source are merged, the rest are reordered by
+maximal marginal relevance, and they are packed into a token budget. The chat
+history is trimmed to a budget of its own.
+"""
+import os
+import re
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+import tiktoken
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage, HumanMessage
+
+CONTEXT_TOKENS = int(os.environ.get("RETRIEVAL_CONTEXT_TOKENS", "3000"))
+"""Maximum number of tokens of retrieved context in a prompt."""
+HISTORY_TOKENS = int(os.environ.get("RETRIEVAL_HISTORY_TOKENS", "3000"))
+"""Maximum number of tokens of chat history in a prompt."""
+MMR_LAMBDA = float(os.environ.get("RETRIEVAL_MMR_LAMBDA", "0.7"))
+"""Trade-off between relevance (1) and diversity (0) of the packed chunks."""
+
+# Context windows of the models too small for the default budgets.
+_CONTEXT_WINDOWS = {
+    "llama2": 4096,
+    "llama3-8b-8192": 8192,
+    "llama3-70b-8192": 8192,
+}
+_MIN_OVERLAP = 50
+_MAX_OVERLAP = 1000
+_WORD = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> tiktoken.Encoding:
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    """Approximate number of tokens of `text`, the same for every model."""
+    return len(_encoding().encode(text, disallowed_special=()))
+
+
+def token_budgets(llm: object) -> Tuple[int, int]:
+    """Token budgets of the context and the chat history of prompts to `llm`.
+
+    Models with small context windows get a quarter of it for each.
+    """
+    name = getattr(llm, "model_name", None) or getattr(llm, "model", None)
+    if (window := _CONTEXT_WINDOWS.get(name)) is None:
+        return CONTEXT_TOKENS, HISTORY_TOKENS
+    return min(CONTEXT_TOKENS, window // 4), min(HISTORY_TOKENS, window // 4)
+
+
+def _same_source(a: Document, b: Document) -> bool:
+    return (
+        a.metadata.get("source") is not None
+        and a.metadata.get("source") == b.metadata.get("source")
+        and a.metadata.get("page") == b.metadata.get("page")
+    )
+
+
+def _overlap(a: str, b: str) -> int:
+    """Length of the longest end of `a` that `b` starts with, if long enough."""
+    head = b[:_MIN_OVERLAP]
+    if len(head) < _MIN_OVERLAP:
+        return 0
+    i = a.find(head, max(0, len(a) - _MAX_OVERLAP))
+    while i != -1:
+        if b.startswith(a[i:]):
+            return len(a) - i
+        i = a.find(head, i + 1)
+    return 0
+
+
+def _dedupe(docs: Sequence[Document]) -> List[Document]:
+    """Drop chunks whose text is contained in a better ranked one."""
+    kept: List[Document] = []
+    for doc in docs:
+        text = " ".join(doc.page_content.split())
+        for i, other in enumerate(kept):
+            other_text = " ".join(other.page_content.split())
+            if text in other_text:
+                break
+            if other_text in text:
+                kept[i] = doc
+                break
+        else:
+            kept.append(doc)
+    return kept
+
+
+def _join(a: Document, b: Document) -> Optional[str]:
+    """Text of `a` and `b` joined where they overlap, if they are neighbours."""
+    if not _same_source(a, b):
+        return None
+    if n := _overlap(a.page_content, b.page_content):
+        return a.page_content + b.page_content[n:]
+    if n := _overlap(b.page_content, a.page_content):
+        return b.page_content + a.page_content[n:]
+    return None
+
+
+def _merge_adjacent(docs: Sequence[Document]) -> List[Document]:
+    """Join neighbouring chunks of the same source, at the rank of the best."""
+    docs = list(docs)
+    i = 0
+    while i < len(docs):
+        for j in range(i + 1, len(docs)):
+            if (text := _join(docs[i], docs[j])) is not None:
+                docs[i] = Document(page_content=text, metadata=docs[i].metadata)
+                del docs[j]
+                # The longer chunk may now neighbour one already passed.
+                i = 0
+                break
+        else:
+            i += 1
+    return docs
+
+
+def _similarity(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def _mmr(docs: List[Document], lambda_mult: float) -> List[Document]:
+    """Order chunks by maximal marginal relevance.
+
+    Relevance is taken from the retrieval rank and similarity is the overlap
+    of the chunks' words, so no embeddings are needed.
+    """
+    words = [set(_WORD.findall(d.page_content.lower())) for d in docs]
+    remaining = list(range(len(docs)))
+    selected: List[int] = []
+    while remaining:
+        best = max(
+            remaining,
+            key=lambda i: lambda_mult * (1 - i / len(docs))
+            - (1 - lambda_mult)
+            * max((_similarity(words[i], words[j]) for j in selected), default=0),
+        )
+        selected.append(best)
+        remaining.remove(best)
+    return [docs[i] for i in selected]
+
+
+def pack_documents(
+    docs: Sequence[Document],
+    max_tokens: int = CONTEXT_TOKENS,
+    lambda_mult: float = MMR_LAMBDA,
+) -> List[Document]:
+    """Select the retrieved chunks to put in a prompt, best first."""
+    packed: List[Document] = []
+    remaining = max_tokens
+    for doc in _mmr(_merge_adjacent(_dedupe(docs)), lambda_mult):
+        tokens = _encoding().encode(doc.page_content, disallowed_special=())
+        if len(tokens) <= remaining:
+            packed.append(doc)
+            remaining -= len(tokens)
+        elif not packed:
+            # Better part of the best chunk than no context at all.
+            text = _encoding().decode(tokens[:remaining])
+            packed.append(Document(page_content=text, metadata=doc.metadata))
+            remaining = 0
+    return packed
+
+
+def trim_history(
+    messages: Sequence[BaseMessage], max_tokens: int = HISTORY_TOKENS
+) -> List[BaseMessage]:
+    """Keep the latest messages fitting in `max_tokens`.
+
+    The kept history starts with a human message, as chat models expect, so it
+    holds at least the last human message and what follows it, even over
+    budget.
+    """
+    kept: List[BaseMessage] = []
+    remaining = max_tokens
+    for message in reversed(messages):
+        content = message.content
+        tokens = count_tokens(content if isinstance(content, str) else str(content))
+        if kept and tokens > remaining:
+            break
+        kept.append(message)
+        remaining -= tokens
+    kept.reverse()
+    for i, message in enumerate(kept):
+        if isinstance(message, HumanMessage):
+            return kept[i:]
+    humans = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+    return list(messages[humans[-1] :]) if humans else kept
@@ -0,0 +1,145 @@
+"""Deduplication of ingested content.
+
+Embeddings are cached in Postgres by embedding model and sha256 of the chunk
+text, so chunks repeated across documents (boilerplate headers, footers) or
+re-uploaded files are only embedded once. Whole blobs are also recorded per
+namespace, so uploading the same file to the same assistant or thread twice
+is a no-op.
+
+Both are stored through the app's asyncpg pool. Ingestion runs on threads, so
+the sync methods run their queries on the app's event loop.
+"""
+import hashlib
+from typing import List, Optional
+
+from langchain_community.document_loaders import Blob
+from langchain_core.embeddings import Embeddings
+from langchain_openai import AzureOpenAIEmbeddings
+
+from app import metrics
+from app.lifespan import get_pg_pool, run_in_loop
+
+_READ_CHUNK_SIZE = 1 << 20
+
+
+def _text_hash(text_: str) -> bytes:
+    return hashlib.sha256(text_.encode("utf-8")).digest()
+
+
+def blob_hash(blob: Blob) -> bytes:
+    """Return the sha256 of a blob, reading it in chunks."""
+    digest = hashlib.sha256()
+    with blob.as_bytes_io() as f:
+        while chunk := f.read(_READ_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def embedding_model_name(embeddings: Embeddings) -> str:
+    """Name identifying the vectors produced by `embeddings`.
+
+    Made of the model and, when set, the dimensions requested. Azure
+    deployments choose their own model, so they are part of the name too.
+    """
+    parts = [embeddings.__class__.__name__]
+    if model := getattr(embeddings, "model", None):
+        parts.append(model)
+    if isinstance(embeddings, AzureOpenAIEmbeddings) and embeddings.deployment:
+        parts.append(embeddings.deployment)
+    if dimensions := getattr(embeddings, "dimensions", None):
+        parts.append(str(dimensions))
+    return ":".join(parts)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings looking up every document in a Postgres cache first."""
+
+    def __init__(self, underlying: Embeddings) -> None:
+        self.underlying = underlying
+        self.model = embedding_model_name(underlying)
+
+    async def _lookup(self, hashes: List[bytes]) -> dict[bytes, List[float]]:
+        async with get_pg_pool().acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT text_hash, embedding FROM embedding_cache "
+                "WHERE model = $1 AND text_hash = ANY($2::bytea[])",
+                self.model,
+                list(set(hashes)),
+            )
+        return {bytes(row["text_hash"]): list(row["embedding"]) for row in rows}
+
+    async def _store(self, new: dict[bytes, List[float]]) -> None:
+        async with get_pg_pool().acquire() as conn:
+            await conn.executemany(
+                "INSERT INTO embedding_cache (model, text_hash, embedding) "
+                "VALUES ($1, $2, $3) ON CONFLICT DO NOTHING",
+                [(self.model, h, v) for h, v in new.items()],
+            )
+
+    def _missing(
+        self, texts: List[str], hashes: List[bytes], cached: dict
+    ) -> dict[bytes, str]:
+        missing = {h: t for h, t in zip(hashes, texts) if h not in cached}
+        metrics.inc("embedding_cache_hits", len(texts) - len(missing))
+        metrics.inc("embedding_cache_misses", len(missing))
+        return missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [_text_hash(t) for t in texts]
+        cached = run_in_loop(self._lookup(hashes))
+        if missing := self._missing(texts, hashes, cached):
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            new = dict(zip(missing, vectors))
+            run_in_loop(self._store(new))
+            cached.update(new)
+        return [cached[h] for h in hashes]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [_text_hash(t) for t in texts]
+        cached = await self._lookup(hashes)
+        if missing := self._missing(texts, hashes, cached):
+            vectors = await self.underlying.aembed_documents(list(missing.values()))
+            new = dict(zip(missing, vectors))
+            await self._store(new)
+            cached.update(new)
+        return [cached[h] for h in hashes]
+
+    def embed_query(self, text_: str) -> List[float]:
+        return self.underlying.embed_query(text_)
+
+    async def aembed_query(self, text_: str) -> List[float]:
+        return await self.underlying.aembed_query(text_)
+
+
+class BlobRegistry:
+    """Record of the blobs ingested into each namespace."""
+
+    async def acontains(self, namespace: str, digest: bytes) -> bool:
+        async with get_pg_pool().acquire() as conn:
+            return (
+                await conn.fetchval(
+                    "SELECT 1 FROM ingested_blob "
+                    "WHERE namespace = $1 AND blob_hash = $2",
+                    namespace,
+                    digest,
+                )
+                is not None
+            )
+
+    def contains(self, namespace: str, digest: bytes) -> bool:
+        return run_in_loop(self.acontains(namespace, digest))
+
+    async def aadd(
+        self, namespace: str, digest: bytes, chunks: Optional[int] = None
+    ) -> None:
+        async with get_pg_pool().acquire() as conn:
+            await conn.execute(
+                "INSERT INTO ingested_blob (namespace, blob_hash, chunks) "
+                "VALUES ($1, $2, $3) ON CONFLICT DO NOTHING",
+                namespace,
+                digest,
+                chunks,
+            )
+
+    def add(self, namespace: str, digest: bytes, chunks: Optional[int] = None) -> None:
+        run_in_loop(self.aadd(namespace, digest, chunks))
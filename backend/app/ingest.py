@@ -6,7 +6,11 @@ into a vector store.
 This code should be agnostic to how the blob got generated; i.e., it does not
 know about server/uploading etc.
 """
-from typing import List
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, List, Optional
 
 from langchain.text_splitter import TextSplitter
 from langchain_community.document_loaders import Blob
@@ -14,6 +18,9 @@ from langchain_community.document_loaders.base import BaseBlobParser
 from langchain_core.documents import Document
 from langchain_core.vectorstores import VectorStore
 
+from app.context_packing import count_tokens
+from app.embedding_cache import BlobRegistry, blob_hash
+
 
 def _update_document_metadata(document: Document, namespace: str) -> None:
     """Mutation in place that adds a namespace to the document metadata."""
@@ -27,6 +34,62 @@ def _sanitize_document_content(document: Document) -> Document:
     document.page_content = document.page_content.replace("\x00", "x")
 
 
+def _is_rate_limited(e: Exception) -> bool:
+    return (
+        getattr(e, "status_code", None) == 429 or type(e).__name__ == "RateLimitError"
+    )
+
+
+class _AdaptiveLimiter:
+    """Concurrency limit halved when rate limited and grown back on success."""
+
+    def __init__(self, max_concurrency: int) -> None:
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self._active = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self) -> None:
+        with self._cond:
+            self._cond.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+
+    def __exit__(self, *exc_info) -> None:
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def succeeded(self) -> None:
+        with self._cond:
+            if self.limit < self.max_concurrency:
+                self.limit += 1
+                self._cond.notify_all()
+
+    def rate_limited(self) -> None:
+        with self._cond:
+            self.limit = max(1, self.limit // 2)
+
+
+def _add_documents(
+    vectorstore: VectorStore,
+    docs: List[Document],
+    limiter: _AdaptiveLimiter,
+    max_retries: int,
+) -> List[str]:
+    for attempt in range(max_retries + 1):
+        try:
+            with limiter:
+                ids = vectorstore.add_documents(docs)
+        except Exception as e:
+            if not _is_rate_limited(e) or attempt == max_retries:
+                raise
+            limiter.rate_limited()
+            time.sleep(min(60, 2**attempt) * (1 + random.random()))
+        else:
+            limiter.succeeded()
+            return ids
+
+
 # PUBLIC API
 
 
@@ -38,22 +101,71 @@ def ingest_blob(
     namespace: str,
     *,
     batch_size: int = 100,
+    max_batch_tokens: int = 8000,
+    max_concurrency: int = 4,
+    max_retries: int = 6,
+    on_progress: Optional[Callable[[int], None]] = None,
+    registry: Optional[BlobRegistry] = None,
 ) -> List[str]:
-    """Ingest a document into the vectorstore."""
-    docs_to_index = []
-    ids = []
-    for document in parser.lazy_parse(blob):
-        docs = text_splitter.split_documents([document])
-        for doc in docs:
-            _sanitize_document_content(doc)
-            _update_document_metadata(doc, namespace)
-        docs_to_index.extend(docs)
-
-        if len(docs_to_index) >= batch_size:
-            ids.extend(vectorstore.add_documents(docs_to_index))
-            docs_to_index = []
-
-    if docs_to_index:
-        ids.extend(vectorstore.add_documents(docs_to_index))
+    """Ingest a document into the vectorstore.
+
+    Chunks are batched by token count (and at most `batch_size` chunks), and
+    up to `max_concurrency` batches are embedded and stored while parsing
+    continues. Rate-limited batches are retried with exponential backoff, and
+    the concurrency is halved until requests succeed again.
+
+    `on_progress` is called with the number of chunks stored by each batch.
+    If a `registry` is given, blobs already ingested into the namespace are
+    skipped.
+    """
+    if registry is not None:
+        digest = blob_hash(blob)
+        if registry.contains(namespace, digest):
+            return []
+
+    batch: List[Document] = []
+    batch_tokens = 0
+    futures: List[Future] = []
+    limiter = _AdaptiveLimiter(max_concurrency)
+
+    def _store(docs: List[Document]) -> List[str]:
+        ids = _add_documents(vectorstore, docs, limiter, max_retries)
+        if on_progress is not None:
+            on_progress(len(docs))
+        return ids
+
+    with ThreadPoolExecutor(max_concurrency, thread_name_prefix="embed") as pool:
+
+        def _flush() -> None:
+            nonlocal batch, batch_tokens
+            futures.append(pool.submit(_store, batch))
+            batch, batch_tokens = [], 0
+            # Parsing continues while batches are embedded, but only a couple
+            # of batches ahead, to bound memory.
+            while True:
+                pending = [f for f in futures if not f.done()]
+                if len(pending) <= 2 * max_concurrency:
+                    break
+                wait(pending, return_when=FIRST_COMPLETED)
+
+        for document in parser.lazy_parse(blob):
+            docs = text_splitter.split_documents([document])
+            for doc in docs:
+                _sanitize_document_content(doc)
+                _update_document_metadata(doc, namespace)
+                tokens = count_tokens(doc.page_content)
+                if batch and (
+                    batch_tokens + tokens > max_batch_tokens or len(batch) >= batch_size
+                ):
+                    _flush()
+                batch.append(doc)
+                batch_tokens += tokens
+
+        if batch:
+            _flush()
+
+        ids = [id_ for future in futures for id_ in future.result()]
 
+    if registry is not None:
+        registry.add(namespace, digest, len(ids))
     return ids
@@ -0,0 +1,141 @@
+"""Execute queued ingestion jobs.
+
+`POST /ingest` stores the uploaded files with an ingestion job and returns
+right away. Workers claim jobs like runs, with `FOR UPDATE SKIP LOCKED`, and
+parse, split, embed and store each file on a thread so the event loop stays
+responsive. Files are stored in parts and spooled back to disk for parsing,
+so neither side holds a whole upload in memory. Progress is recorded on the
+job as files and chunks complete.
+
+Claimed jobs hold a lease like runs. If the worker's process dies, the job is
+requeued and resumes from the first file not yet ingested.
+"""
+import asyncio
+import os
+from datetime import timedelta
+
+import structlog
+from langchain_core.document_loaders.blob_loaders import Blob
+
+from app.lifespan import add_background_task, add_listener
+from app.schema import IngestJob
+from app.storage import (
+    INGEST_CHANNEL,
+    add_ingest_progress,
+    claim_ingest_job,
+    finish_ingest_job,
+    get_ingest_file,
+    read_ingest_file,
+    renew_ingest_leases,
+    requeue_expired_ingest_jobs,
+)
+from app.upload import get_ingest_runnable, spool
+
+logger = structlog.get_logger(__name__)
+
+CONCURRENCY = int(os.environ.get("INGEST_WORKER_CONCURRENCY", "2"))
+"""Maximum number of jobs executed at once by this process. 0 disables."""
+POLL_INTERVAL = float(os.environ.get("INGEST_WORKER_POLL_INTERVAL", "5"))
+"""Seconds between queue polls when no notification arrives."""
+LEASE = timedelta(seconds=float(os.environ.get("INGEST_LEASE_SECONDS", "60")))
+"""Time after which a job whose worker stopped renewing its lease is requeued."""
+MAX_ATTEMPTS = int(os.environ.get("INGEST_MAX_ATTEMPTS", "3"))
+"""Number of times a job is claimed before it fails for good."""
+
+_wakeup = asyncio.Event()
+_jobs: set[str] = set()
+
+
+def _on_job_created(_payload: str) -> None:
+    _wakeup.set()
+
+
+async def _execute(job: IngestJob) -> None:
+    job_id = str(job["job_id"])
+    loop = asyncio.get_running_loop()
+    _jobs.add(job_id)
+
+    def _on_progress(chunks: int) -> None:
+        # Called from the ingestion thread.
+        asyncio.run_coroutine_threadsafe(
+            add_ingest_progress(job_id, chunks=chunks), loop
+        )
+
+    try:
+        runnable = get_ingest_runnable(job["config"])
+        for position in range(job["files_done"], job["files_total"]):
+            file_name, mime_type = await get_ingest_file(job_id, position)
+            with spool() as f:
+                async for data in read_ingest_file(job_id, position):
+                    await asyncio.to_thread(f.write, data)
+                await asyncio.to_thread(f.flush)
+                blob = Blob.from_path(
+                    f.name, mime_type=mime_type, metadata={"source": file_name}
+                )
+                await asyncio.to_thread(runnable.ingest, blob, _on_progress)
+            await add_ingest_progress(job_id, files=1)
+    except asyncio.CancelledError:
+        await asyncio.shield(finish_ingest_job(job_id, "error", "worker shut down"))
+        raise
+    except Exception as e:
+        logger.warn("ingestion failed", job_id=job_id, exc_info=True)
+        await finish_ingest_job(job_id, "error", str(e))
+    else:
+        await finish_ingest_job(job_id, "success")
+    finally:
+        _jobs.discard(job_id)
+
+
+async def run_ingest_worker() -> None:
+    """Claim and execute pending ingestion jobs until cancelled."""
+    if CONCURRENCY <= 0:
+        return
+    slots = asyncio.Semaphore(CONCURRENCY)
+    tasks: set[asyncio.Task] = set()
+    try:
+        while True:
+            await slots.acquire()
+            _wakeup.clear()
+            try:
+                job = await claim_ingest_job(LEASE)
+            except Exception:
+                logger.warn("failed to claim ingestion job", exc_info=True)
+                job = None
+            if job is None:
+                slots.release()
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(_execute(job))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            task.add_done_callback(lambda _: slots.release())
+    finally:
+        pending = list(tasks)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def renew_leases() -> None:
+    """Renew the leases of executing jobs and requeue expired ones until cancelled."""
+    if CONCURRENCY <= 0:
+        return
+    while True:
+        await asyncio.sleep(LEASE.total_seconds() / 3)
+        try:
+            if _jobs:
+                await renew_ingest_leases(list(_jobs), LEASE)
+            if requeued := await requeue_expired_ingest_jobs(MAX_ATTEMPTS, LEASE):
+                logger.warn(
+                    "requeued ingestion jobs with expired leases", count=requeued
+                )
+        except Exception:
+            logger.warn("failed to renew ingestion leases", exc_info=True)
+
+
+add_listener(INGEST_CHANNEL, _on_job_created)
+add_background_task(run_ingest_worker)
+add_background_task(renew_leases)
@@ -1,18 +1,190 @@
+import asyncio
 import os
+import struct
+import time
+from collections import defaultdict
 from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Coroutine, Optional, TypeVar
 
 import asyncpg
 import orjson
 import structlog
 from fastapi import FastAPI
 
+from app import metrics
+from app.compaction import run_compaction
+
+T = TypeVar("T")
+
+logger = structlog.get_logger(__name__)
+
 _pg_pool = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_hot_queries: list[str] = []
+_listeners: defaultdict[str, list[Callable[[str], None]]] = defaultdict(list)
+_resets: list[Callable[[], None]] = []
+_background_tasks: list[Callable[[], Awaitable[None]]] = []
+
+
+class Connection(asyncpg.Connection):
+    """Connection holding prepared statements for the hot queries."""
+
+    __slots__ = ("_prepared",)
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._prepared: dict[str, asyncpg.prepared_stmt.PreparedStatement] = {}
+
+    async def prepared(self, query: str) -> asyncpg.prepared_stmt.PreparedStatement:
+        """Return the statement for `query`, preparing it on first use."""
+        if (statement := self._prepared.get(query)) is None:
+            statement = self._prepared[query] = await self.prepare(query)
+        return statement
+
+
+class _TimedAcquire:
+    def __init__(self, context: Any) -> None:
+        self._context = context
+
+    async def __aenter__(self) -> Connection:
+        start = time.perf_counter()
+        try:
+            return await self._context.__aenter__()
+        finally:
+            metrics.observe("pg_pool_acquire_seconds", time.perf_counter() - start)
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self._context.__aexit__(*exc_info)
+
+    def __await__(self):
+        return self.__aenter__().__await__()
+
+
+class _InstrumentedPool:
+    """Pool recording how long callers wait for a connection."""
+
+    def __init__(self, pool: asyncpg.pool.Pool) -> None:
+        self._pool = pool
+
+    def acquire(self, *, timeout: Optional[float] = None) -> _TimedAcquire:
+        return _TimedAcquire(self._pool.acquire(timeout=timeout))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._pool, name)
 
 
 def get_pg_pool() -> asyncpg.pool.Pool:
     return _pg_pool
 
 
+def run_in_loop(coro: Coroutine[Any, Any, T]) -> T:
+    """Run `coro` on the app's event loop from another thread and wait for it.
+
+    Lets code running on threads, like ingestion, use the pool.
+    """
+    if _loop is None:
+        raise RuntimeError("The app is not running")
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is _loop:
+        raise RuntimeError("run_in_loop would block the event loop")
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
+
+def prepare(query: str) -> str:
+    """Prepare `query` on every new connection.
+
+    Use with `await conn.prepared(query)`. Returns the query.
+    """
+    _hot_queries.append(query)
+    return query
+
+
+def add_listener(
+    channel: str,
+    callback: Callable[[str], None],
+    on_reset: Optional[Callable[[], None]] = None,
+) -> None:
+    """Call `callback` with the payload of every NOTIFY on `channel`.
+
+    Listeners are attached to a dedicated connection while the app runs. If
+    that connection is lost, it is re-established and `on_reset()` is called,
+    since notifications sent in the meantime were missed.
+    """
+    _listeners[channel].append(callback)
+    if on_reset is not None:
+        _resets.append(on_reset)
+
+
+def add_background_task(fn: Callable[[], Awaitable[None]]) -> None:
+    """Run `fn()` as a task while the app runs.
+
+    Tasks start once the pool and listeners are ready and are cancelled on
+    shutdown.
+    """
+    _background_tasks.append(fn)
+
+
+async def _listen(conn: asyncpg.Connection) -> None:
+    for channel, callbacks in _listeners.items():
+
+        def _dispatch(_conn, _pid, _channel, payload, callbacks=callbacks):
+            for callback in callbacks:
+                callback(payload)
+
+        await conn.add_listener(channel, _dispatch)
+
+
+def _connect_kwargs() -> dict[str, Any]:
+    return {
+        "database": os.environ["POSTGRES_DB"],
+        "user": os.environ["POSTGRES_USER"],
+        "password": os.environ["POSTGRES_PASSWORD"],
+        "host": os.environ["POSTGRES_HOST"],
+        "port": os.environ["POSTGRES_PORT"],
+    }
+
+
+async def _connect_listener() -> asyncpg.Connection:
+    """Open the listening connection.
+
+    It is kept outside the pool, so it never takes a connection from queries,
+    and a pool reset can't drop its listeners.
+    """
+    conn = await asyncpg.connect(**_connect_kwargs())
+    try:
+        await _listen(conn)
+    except BaseException:
+        await conn.close()
+        raise
+    return conn
+
+
+async def _keep_listening(conn: asyncpg.Connection) -> None:
+    """Hold the listening connection, re-establishing it whenever it is lost."""
+    try:
+        while True:
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda _conn: lost.set())
+            await lost.wait()
+            logger.warn("Lost the listening connection, reconnecting")
+            conn.terminate()
+            conn = None
+            while conn is None:
+                try:
+                    conn = await _connect_listener()
+                except (OSError, asyncpg.PostgresError):
+                    logger.warn("Failed to listen, retrying", exc_info=True)
+                    await asyncio.sleep(1)
+            for reset in _resets:
+                reset()
+    finally:
+        if conn is not None:
+            await conn.close()
+
+
 async def _init_connection(conn) -> None:
     await conn.set_type_codec(
         "json",
@@ -29,6 +201,28 @@ async def _init_connection(conn) -> None:
     await conn.set_type_codec(
         "uuid", encoder=lambda v: str(v), decoder=lambda v: v, schema="pg_catalog"
     )
+    # pgvector's binary format: dimensions, unused, then float4s.
+    await conn.set_type_codec(
+        "vector",
+        encoder=lambda v: struct.pack(f">HH{len(v)}f", len(v), 0, *v),
+        decoder=lambda b: list(struct.unpack_from(f">{len(b) // 4 - 1}f", b, 4)),
+        schema="public",
+        format="binary",
+    )
+    conn.add_query_logger(_observe_query)
+    for query in _hot_queries:
+        await conn.prepared(query)
+
+
+def _observe_query(record: asyncpg.connection.LoggedQuery) -> None:
+    metrics.observe("pg_query_seconds", record.elapsed)
+    if record.exception is not None:
+        metrics.inc("pg_query_errors")
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value else None
 
 
 @asynccontextmanager
@@ -46,16 +240,38 @@ async def lifespan(app: FastAPI):
         cache_logger_on_first_use=True,
     )
 
-    global _pg_pool
+    global _pg_pool, _loop
 
-    _pg_pool = await asyncpg.create_pool(
-        database=os.environ["POSTGRES_DB"],
-        user=os.environ["POSTGRES_USER"],
-        password=os.environ["POSTGRES_PASSWORD"],
-        host=os.environ["POSTGRES_HOST"],
-        port=os.environ["POSTGRES_PORT"],
+    pool = await asyncpg.create_pool(
+        **_connect_kwargs(),
+        min_size=int(os.environ.get("PG_POOL_MIN_SIZE", "10")),
+        max_size=int(os.environ.get("PG_POOL_MAX_SIZE", "10")),
+        max_inactive_connection_lifetime=float(
+            os.environ.get("PG_POOL_MAX_INACTIVE_LIFETIME", "300")
+        ),
+        command_timeout=_env_float("PG_COMMAND_TIMEOUT"),
+        statement_cache_size=int(os.environ.get("PG_STATEMENT_CACHE_SIZE", "100")),
+        connection_class=Connection,
         init=_init_connection,
     )
+    metrics.register("pg_pool_size", pool.get_size)
+    metrics.register("pg_pool_idle", pool.get_idle_size)
+    metrics.register("pg_pool_max_size", pool.get_max_size)
+    _pg_pool = _InstrumentedPool(pool)
+    _loop = asyncio.get_running_loop()
+    listen_conn = await _connect_listener()
+    listening = asyncio.create_task(_keep_listening(listen_conn))
+    compaction_interval = float(
+        os.environ.get("CHECKPOINT_COMPACTION_INTERVAL", "3600")
+    )
+    tasks = [asyncio.create_task(fn()) for fn in _background_tasks]
+    if compaction_interval > 0:
+        tasks.append(asyncio.create_task(run_compaction(_pg_pool, compaction_interval)))
     yield
+    listening.cancel()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(listening, *tasks, return_exceptions=True)
     await _pg_pool.close()
     _pg_pool = None
+    _loop = None
@@ -64,6 +64,16 @@ def get_openai_llm(model: str = "gpt-4o", azure: bool = False):
 
 
 
+def get_query_rewrite_llm():
+    """Model writing retrieval search queries, if RETRIEVAL_REWRITE_MODEL is set.
+
+    A small OpenAI model such as gpt-4o-mini answers much sooner than the
+    model of the assistant.
+    """
+    model = os.environ.get("RETRIEVAL_REWRITE_MODEL")
+    return get_openai_llm(model=model) if model else None
+
+
 @lru_cache(maxsize=2)
 def get_anthropic_llm(bedrock: bool = False):
     if bedrock:
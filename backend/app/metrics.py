@@ -0,0 +1,53 @@
+"""In-process metrics.
+
+Values are kept per worker process and reset when the process restarts.
+"""
+import bisect
+from collections import defaultdict
+from typing import Callable
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+"""Upper bounds, in seconds, of the histogram buckets."""
+
+_counters: defaultdict[str, float] = defaultdict(float)
+_callbacks: dict[str, Callable[[], float]] = {}
+_histograms: dict[str, list[float]] = {}
+
+
+def inc(name: str, value: float = 1) -> None:
+    """Increment a counter."""
+    _counters[name] += value
+
+
+def register(name: str, callback: Callable[[], float]) -> None:
+    """Report the value returned by `callback` under `name`."""
+    _callbacks[name] = callback
+
+
+def observe(name: str, value: float) -> None:
+    """Record a duration in a histogram."""
+    # One count per bucket, then the +Inf count and the sum.
+    histogram = _histograms.setdefault(name, [0.0] * (len(BUCKETS) + 2))
+    histogram[bisect.bisect_left(BUCKETS, value)] += 1
+    histogram[-1] += value
+
+
+def snapshot() -> dict[str, float]:
+    """Return the current value of all metrics."""
+    values = {
+        **_counters,
+        **{name: callback() for name, callback in _callbacks.items()},
+    }
+    for name, histogram in _histograms.items():
+        count = 0.0
+        for bound, n in zip((*BUCKETS, "+Inf"), histogram):
+            count += n
+            values[f'{name}_bucket{{le="{bound}"}}'] = count
+        values[f"{name}_sum"] = histogram[-1]
+        values[f"{name}_count"] = count
+    return values
+
+
+def render() -> str:
+    """Return all metrics in the Prometheus text format."""
+    return "".join(f"{name} {value}\n" for name, value in snapshot().items())
@@ -1,18 +1,58 @@
 import operator
-from typing import Annotated, List, Sequence, TypedDict
+import os
+import re
+from typing import Annotated, Callable, List, Optional, Sequence, TypedDict
 from uuid import uuid4
 
 from langchain_core.language_models.base import LanguageModelLike
 from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
 from langchain_core.prompts import PromptTemplate
 from langchain_core.retrievers import BaseRetriever
-from langchain_core.runnables import chain
+from langchain_core.runnables import RunnableConfig, chain
 from langgraph.checkpoint import BaseCheckpointSaver
 from langgraph.graph import END
 from langgraph.graph.state import StateGraph
 
+from app import metrics
+from app.cache import TTLCache
+from app.context_packing import pack_documents, token_budgets, trim_history
 from app.message_types import LiberalToolMessage, add_messages_liberal
 
+QUERY_PLANNING = os.environ.get("RETRIEVAL_QUERY_PLANNING", "auto")
+"""How follow-up questions are turned into search queries.
+
+`auto` only asks the LLM to rewrite questions that depend on the
+conversation, `always` rewrites every follow-up, and `never` searches the
+last message as is.
+"""
+REWRITE_WINDOW = int(os.environ.get("RETRIEVAL_REWRITE_WINDOW", "6"))
+"""Number of trailing messages the search query is written from."""
+
+rewrite_cache: TTLCache[str] = TTLCache(
+    int(os.environ.get("RETRIEVAL_REWRITE_CACHE_SIZE", "1000")),
+    float(os.environ.get("RETRIEVAL_REWRITE_CACHE_TTL", "3600")),
+)
+"""Search queries by the conversation window they were written from."""
+
+# Words referring back to the conversation, and openings of follow-ups.
+_REFERRING = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|he|him|his|she|her|"
+    r"there|above|previous|earlier|former|latter|same|again|else|more)\b",
+    re.IGNORECASE,
+)
+_FOLLOW_UP = re.compile(r"^(and|but|so|also|what about|how about)\b", re.IGNORECASE)
+_MIN_STANDALONE_WORDS = 4
+
+
+def _is_standalone(question: str) -> bool:
+    """Whether `question` can likely be searched without the conversation."""
+    return (
+        len(question.split()) >= _MIN_STANDALONE_WORDS
+        and not _REFERRING.search(question)
+        and not _FOLLOW_UP.match(question.strip())
+    )
+
+
 search_prompt = PromptTemplate.from_template(
     """Given the conversation below, come up with a search query to look up.
 
@@ -37,10 +77,19 @@ Respond to the user using ONLY the context provided below. Do not make anything
 
 def get_retrieval_executor(
     llm: LanguageModelLike,
-    retriever: BaseRetriever,
+    get_retriever: Callable[[Optional[str], Optional[str]], BaseRetriever],
     system_message: str,
     checkpoint: BaseCheckpointSaver,
+    rewrite_llm: Optional[LanguageModelLike] = None,
 ):
+    """Build the retrieval graph.
+
+    Search queries for follow-up questions are written by `rewrite_llm` if
+    given, which can be a smaller, faster model than `llm`.
+    """
+    rewrite_llm = rewrite_llm or llm
+    context_tokens, history_tokens = token_budgets(llm)
+
     class AgentState(TypedDict):
         messages: Annotated[List[BaseMessage], add_messages_liberal]
         msg_count: Annotated[int, operator.add]
@@ -54,28 +103,45 @@ def get_retrieval_executor(
             if isinstance(m, HumanMessage):
                 chat_history.append(m)
         response = messages[-1].content
-        content = "\n".join([d.page_content for d in response])
+        docs = pack_documents(response, context_tokens)
+        content = "\n".join([d.page_content for d in docs])
         return [
             SystemMessage(
                 content=response_prompt_template.format(
                     instructions=system_message, context=content
                 )
             )
-        ] + chat_history
+        ] + trim_history(chat_history, history_tokens)
 
     @chain
-    async def get_search_query(messages: Sequence[BaseMessage]):
+    async def get_search_query(messages: Sequence[BaseMessage]) -> str:
+        questions = [m for m in messages if isinstance(m, HumanMessage)]
+        question = questions[-1].content if questions else None
+        if isinstance(question, str) and (
+            QUERY_PLANNING == "never"
+            or (
+                QUERY_PLANNING == "auto"
+                and (len(questions) == 1 or _is_standalone(question))
+            )
+        ):
+            metrics.inc("retrieval_rewrites_skipped")
+            return question
+
         convo = []
-        for m in messages:
+        for m in messages[-REWRITE_WINDOW:]:
             if isinstance(m, AIMessage):
                 if "function_call" not in m.additional_kwargs:
                     convo.append(f"AI: {m.content}")
             if isinstance(m, HumanMessage):
                 convo.append(f"Human: {m.content}")
         conversation = "\n".join(convo)
+        if (query := rewrite_cache.get(conversation)) is not None:
+            metrics.inc("retrieval_rewrite_cache_hits")
+            return query
         prompt = await search_prompt.ainvoke({"conversation": conversation})
-        response = await llm.ainvoke(prompt, {"tags": ["nostream"]})
-        return response
+        response = await rewrite_llm.ainvoke(prompt, {"tags": ["nostream"]})
+        rewrite_cache.put(conversation, response.content)
+        return response.content
 
     async def invoke_retrieval(state: AgentState):
         messages = state["messages"]
@@ -100,23 +166,28 @@ def get_retrieval_executor(
             return {
                 "messages": [
                     AIMessage(
-                        id=search_query.id,
                         content="",
                         tool_calls=[
                             {
                                 "id": uuid4().hex,
                                 "name": "retrieval",
-                                "args": {"query": search_query.content},
+                                "args": {"query": search_query},
                             }
                         ],
                     )
                 ]
             }
 
-    async def retrieve(state: AgentState):
+    async def retrieve(state: AgentState, config: RunnableConfig):
         messages = state["messages"]
         params = messages[-1].tool_calls[0]
         query = params["args"]["query"]
+        # The executor is shared between threads, so the retriever is scoped
+        # to the assistant and thread of the current run.
+        retriever = get_retriever(
+            config["configurable"].get("assistant_id"),
+            config["configurable"].get("thread_id"),
+        )
         response = await retriever.ainvoke(query)
         msg = LiberalToolMessage(
             name="retrieval", content=response, tool_call_id=params["id"]
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import Any, Optional
 
 from typing_extensions import TypedDict
 
@@ -65,4 +65,58 @@ class ThreadInfo(TypedDict):
     thread_counter: int
     """The number of threads the user has."""
     thread_max_counter: int
-    """The maximum number of threads the user can have."""
\ No newline at end of file
+    """The maximum number of threads the user can have."""
+
+
+class Run(TypedDict):
+    run_id: str
+    """The ID of the run."""
+    thread_id: str
+    """The thread the run executes on."""
+    assistant_id: Optional[str]
+    """The assistant that executes the run."""
+    project_id: str
+    """The ID of the project that owns the run."""
+    input: Optional[Any]
+    """The input of the run."""
+    config: dict
+    """The config the run executes with."""
+    status: str
+    """One of pending, running, success, error or cancelled."""
+    error: Optional[str]
+    """The error message of failed runs."""
+    attempts: int
+    """The number of times a worker claimed the run."""
+    lease_expires_at: Optional[datetime]
+    """When the run is requeued unless its worker renews the lease."""
+    created_at: datetime
+    """The time the run was created."""
+    updated_at: datetime
+    """The last time the run status changed."""
+
+
+class IngestJob(TypedDict):
+    job_id: str
+    """The ID of the ingestion job."""
+    project_id: str
+    """The ID of the project that owns the job."""
+    config: dict
+    """The config with the assistant_id or thread_id to ingest into."""
+    status: str
+    """One of pending, running, success or error."""
+    files_total: int
+    """The number of uploaded files."""
+    files_done: int
+    """The number of files ingested so far."""
+    chunks_done: int
+    """The number of chunks stored so far."""
+    error: Optional[str]
+    """The error message of failed jobs."""
+    attempts: int
+    """The number of times a worker claimed the job."""
+    lease_expires_at: Optional[datetime]
+    """When the job is requeued unless its worker renews the lease."""
+    created_at: datetime
+    """The time the job was created."""
+    updated_at: datetime
+    """The last time the job progressed."""
@@ -0,0 +1,141 @@
+"""Binary codec for checkpoints stored in Postgres.
+
+Checkpoints are written as a short versioned header followed by an orjson
+payload. Messages and documents are stored as plain tagged dicts and turned
+back into langchain objects when read.
+
+Rows written before this codec existed are plain pickles; they are detected
+by the missing header and still decoded, so old threads keep working while
+they are rewritten in the new format with `python -m app.checkpoint`.
+"""
+import pickle
+from typing import Any, Optional
+
+import orjson
+import structlog
+from langchain_core.documents import Document
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    ChatMessage,
+    ChatMessageChunk,
+    FunctionMessage,
+    FunctionMessageChunk,
+    HumanMessage,
+    HumanMessageChunk,
+    SystemMessage,
+    SystemMessageChunk,
+    ToolMessage,
+    ToolMessageChunk,
+)
+from langgraph.checkpoint.base import Checkpoint
+
+from app import metrics
+from app.message_types import LiberalFunctionMessage, LiberalToolMessage
+
+logger = structlog.get_logger(__name__)
+
+HEADER = b"OGC"
+"""Magic prefix of checkpoints written by this codec."""
+VERSION = 1
+"""Current payload version, stored in the byte following the header."""
+
+_MESSAGE_TAG = "__message__"
+_DOCUMENT_TAG = "__document__"
+
+MESSAGE_CLASSES: dict[str, type[BaseMessage]] = {
+    cls.__name__: cls
+    for cls in (
+        AIMessage,
+        AIMessageChunk,
+        ChatMessage,
+        ChatMessageChunk,
+        FunctionMessage,
+        FunctionMessageChunk,
+        HumanMessage,
+        HumanMessageChunk,
+        SystemMessage,
+        SystemMessageChunk,
+        ToolMessage,
+        ToolMessageChunk,
+        LiberalFunctionMessage,
+        LiberalToolMessage,
+    )
+}
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseMessage):
+        name = obj.__class__.__name__
+        if name not in MESSAGE_CLASSES:
+            raise TypeError(f"Unsupported message type {name}")
+        # Read the fields directly instead of calling .dict(), which would
+        # flatten nested documents into untagged dicts.
+        return {
+            _MESSAGE_TAG: name,
+            **{field: getattr(obj, field) for field in obj.__fields__},
+        }
+    if isinstance(obj, Document):
+        return {
+            _DOCUMENT_TAG: True,
+            "page_content": obj.page_content,
+            "metadata": obj.metadata,
+        }
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not serializable")
+
+
+def _revive(value: Any) -> Any:
+    if isinstance(value, list):
+        return [_revive(v) for v in value]
+    if isinstance(value, dict):
+        if _MESSAGE_TAG in value:
+            fields = {k: _revive(v) for k, v in value.items() if k != _MESSAGE_TAG}
+            return MESSAGE_CLASSES[value[_MESSAGE_TAG]](**fields)
+        if _DOCUMENT_TAG in value:
+            return Document(
+                page_content=value["page_content"], metadata=value["metadata"]
+            )
+        return {k: _revive(v) for k, v in value.items()}
+    return value
+
+
+def _legacy_loads(data: bytes) -> Checkpoint:
+    loaded: Checkpoint = pickle.loads(data)
+    for key, value in loaded["channel_values"].items():
+        if isinstance(value, list) and all(isinstance(v, BaseMessage) for v in value):
+            loaded["channel_values"][key] = [v.__class__(**v.__dict__) for v in value]
+    return loaded
+
+
+def is_legacy(data: bytes) -> bool:
+    """Whether the blob was written before the versioned codec."""
+    return not data.startswith(HEADER)
+
+
+class CheckpointSerializer:
+    """Versioned orjson codec for checkpoints, with a pickle read fallback."""
+
+    def dumps(self, obj: Checkpoint) -> bytes:
+        try:
+            return HEADER + bytes([VERSION]) + orjson.dumps(obj, default=_default)
+        except TypeError:
+            # Tool outputs can hold arbitrary objects; keep those checkpoints
+            # readable by falling back to the legacy format.
+            logger.warn(
+                "checkpoint not encodable, falling back to pickle", exc_info=True
+            )
+            metrics.inc("checkpoint_pickle_fallbacks")
+            return pickle.dumps(obj)
+
+    def loads(self, data: bytes) -> Checkpoint:
+        if is_legacy(data):
+            return _legacy_loads(data)
+        version: Optional[int] = data[len(HEADER)] if len(data) > len(HEADER) else None
+        if version != VERSION:
+            raise ValueError(f"Unsupported checkpoint version {version}")
+        loaded = orjson.loads(data[len(HEADER) + 1 :])
+        loaded["channel_values"] = _revive(loaded["channel_values"])
+        return loaded
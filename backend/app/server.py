@@ -1,18 +1,29 @@
 import os
+import secrets
 from pathlib import Path
+from typing import Optional
 
 import orjson
 import structlog
-from fastapi import FastAPI, Form, UploadFile
+from fastapi import FastAPI, Form, Header, UploadFile
 from fastapi.exceptions import HTTPException
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
 import app.storage as storage
+from app import metrics
 from app.api import router as api_router
 from app.auth.handlers import AuthedUser
 from app.lifespan import lifespan
-from app.upload import convert_ingestion_input_to_blob, ingest_runnable
+from app import ingest_worker  # noqa: F401 registers the ingestion worker
+from app.schema import IngestJob
+from app.upload import (
+    MAX_REQUEST_BYTES,
+    UploadSizeLimitMiddleware,
+    guess_file_mimetype,
+    read_upload,
+)
 
 import stripe
 
@@ -26,6 +37,9 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["*"]
 )
+app.add_middleware(
+    UploadSizeLimitMiddleware, path="/ingest", max_bytes=MAX_REQUEST_BYTES
+)
 
 # Get root of app, used to point to directory containing static files
 ROOT = Path(__file__).parent.parent
@@ -37,8 +51,8 @@ print("Server started")
 @app.post("/ingest", description="Upload files to the given assistant.")
 async def ingest_files(
     files: list[UploadFile], user: AuthedUser, config: str = Form(...)
-) -> None:
-    """Ingest a list of files."""
+) -> IngestJob:
+    """Queue a list of files for ingestion and return the ingestion job."""
     config = orjson.loads(config)
 
     assistant_id = config["configurable"].get("assistant_id")
@@ -53,8 +67,31 @@ async def ingest_files(
         if thread is None:
             raise HTTPException(status_code=404, detail="Thread not found.")
 
-    file_blobs = [convert_ingestion_input_to_blob(file) for file in files]
-    return ingest_runnable.batch(file_blobs, config)
+    if (assistant_id is None) == (thread_id is None):
+        raise HTTPException(
+            status_code=400,
+            detail="Exactly one of assistant_id or thread_id must be provided.",
+        )
+
+    # The files were spooled to disk while the request was parsed, and are
+    # copied to the job part by part.
+    uploads = [
+        (
+            file.filename,
+            guess_file_mimetype(file.filename, file.file),
+            read_upload(file),
+        )
+        for file in files
+    ]
+    return await storage.create_ingest_job(user["project_id"], config, uploads)
+
+
+@app.get("/ingest/{job_id}", description="Get the progress of an ingestion job.")
+async def get_ingest_job(job_id: str, user: AuthedUser) -> IngestJob:
+    job = await storage.get_ingest_job(user["project_id"], job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingestion job not found.")
+    return job
 
 
 @app.get("/health")
@@ -62,6 +99,21 @@ async def health() -> dict:
     return {"status": "ok"}
 
 
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+"""Bearer token required to read /metrics. The endpoint is disabled if unset."""
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(authorization: Optional[str] = Header(None)) -> str:
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not authorization or not secrets.compare_digest(
+        authorization, f"Bearer {METRICS_TOKEN}"
+    ):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return metrics.render()
+
+
 ui_dir = str(ROOT / "ui")
 
 if os.path.exists(ui_dir):
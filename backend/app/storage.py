@@ -1,37 +1,135 @@
-from datetime import datetime, timezone
-from typing import Any, List, Optional, Sequence, Union
-
-import bcrypt
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, List, Optional, Sequence, Union
 
 from langchain_core.messages import AnyMessage
 from langchain_core.runnables import RunnableConfig
 
-from app.agent import agent
-from app.lifespan import get_pg_pool
-from app.schema import Assistant, Thread, User, ThreadInfo
+from app import billing
+from app.agent import CHECKPOINTER, agent
+from app.auth.cache import USERS_CHANNEL, invalidate_user
+from app.auth.passwords import hash_password, needs_rehash, verify_password
+from app.cache import TTLCache
+from app.lifespan import add_listener, get_pg_pool, prepare
+from app.schema import Assistant, IngestJob, Run, Thread, User, ThreadInfo
+
+Cursor = tuple[Any, str]
+"""Sort key and ID of the last row of a page."""
 
-import stripe
 
-async def list_assistants(project_id: str) -> List[Assistant]:
-    """List all assistants for the current user."""
+def _page(
+    query: str,
+    args: list,
+    order: tuple[str, str],
+    *,
+    after: Optional[Cursor],
+    limit: Optional[int],
+    descending: bool = True,
+) -> tuple[str, list]:
+    """Add keyset pagination on `order` to a query with a WHERE clause."""
+    direction, op = ("DESC", "<") if descending else ("ASC", ">")
+    if after is not None:
+        query += f" AND ({order[0]}, {order[1]}) {op} (${len(args) + 1}, ${len(args) + 2})"
+        args = [*args, *after]
+    query += f" ORDER BY {order[0]} {direction}, {order[1]} {direction}"
+    if limit is not None:
+        query += f" LIMIT ${len(args) + 1}"
+        args = [*args, limit]
+    return query, args
+
+
+_ASSISTANT_SUMMARY = "assistant_id, project_id, name, updated_at, public"
+_THREAD_SUMMARY = "thread_id, assistant_id, project_id, name, updated_at"
+# List queries take the selected columns and are paginated with `_page`.
+_LIST_ASSISTANTS = "SELECT {} FROM assistant WHERE project_id = $1"
+_LIST_PUBLIC_ASSISTANTS = "SELECT {} FROM assistant WHERE public IS true"
+_LIST_THREADS = "SELECT {} FROM thread WHERE project_id = $1"
+# Changes whenever a row of the list is created, updated or deleted.
+_LIST_VERSION = "max(updated_at), count(*)"
+
+
+async def _list_version(query: str, args: list) -> tuple[Optional[datetime], int]:
     async with get_pg_pool().acquire() as conn:
-        return await conn.fetch("SELECT * FROM assistant WHERE project_id = $1", project_id)
+        return tuple(await conn.fetchrow(query.format(_LIST_VERSION), *args))
+
+
+async def list_assistants(
+    project_id: str,
+    *,
+    after: Optional[Cursor] = None,
+    limit: Optional[int] = None,
+    full: bool = True,
+) -> List[Assistant]:
+    """List the assistants of a project, most recently updated first.
+
+    Without `full`, the config is left out.
+    """
+    query, args = _page(
+        _LIST_ASSISTANTS.format("*" if full else _ASSISTANT_SUMMARY),
+        [project_id],
+        ("updated_at", "assistant_id"),
+        after=after,
+        limit=limit,
+    )
+    async with get_pg_pool().acquire() as conn:
+        return await conn.fetch(query, *args)
+
+
+async def list_assistants_version(project_id: str) -> tuple[Optional[datetime], int]:
+    """Return a value that changes whenever the assistants of a project do."""
+    return await _list_version(_LIST_ASSISTANTS, [project_id])
+
+
+ASSISTANTS_CHANNEL = "assistants"
+"""Channel notified with the assistant ID whenever an assistant changes."""
+
+assistant_cache: TTLCache[Assistant] = TTLCache(
+    int(os.environ.get("ASSISTANT_CACHE_SIZE", "1000")),
+    float(os.environ.get("ASSISTANT_CACHE_TTL", "60")),
+)
+"""Assistants by ID, checked against the requesting project on every hit."""
+
+add_listener(ASSISTANTS_CHANNEL, assistant_cache.invalidate, assistant_cache.clear)
+
+_GET_ASSISTANT = prepare(
+    "SELECT * FROM assistant WHERE assistant_id = $1 AND (project_id = $2 OR public IS true)"
+)
 
 
 async def get_assistant(project_id: str, assistant_id: str) -> Optional[Assistant]:
     """Get an assistant by ID."""
+    cached = assistant_cache.get(str(assistant_id))
+    if cached is not None and (cached["project_id"] == project_id or cached["public"]):
+        return cached
     async with get_pg_pool().acquire() as conn:
-        return await conn.fetchrow(
-            "SELECT * FROM assistant WHERE assistant_id = $1 AND (project_id = $2 OR public IS true)",
-            assistant_id,
-            project_id,
-        )
+        statement = await conn.prepared(_GET_ASSISTANT)
+        assistant = await statement.fetchrow(assistant_id, project_id)
+    if assistant is not None:
+        assistant_cache.put(str(assistant_id), assistant)
+    return assistant
 
 
-async def list_public_assistants() -> List[Assistant]:
-    """List all the public assistants."""
+async def list_public_assistants(
+    *,
+    after: Optional[Cursor] = None,
+    limit: Optional[int] = None,
+    full: bool = True,
+) -> List[Assistant]:
+    """List the public assistants, most recently updated first."""
+    query, args = _page(
+        _LIST_PUBLIC_ASSISTANTS.format("*" if full else _ASSISTANT_SUMMARY),
+        [],
+        ("updated_at", "assistant_id"),
+        after=after,
+        limit=limit,
+    )
     async with get_pg_pool().acquire() as conn:
-        return await conn.fetch(("SELECT * FROM assistant WHERE public IS true;"))
+        return await conn.fetch(query, *args)
+
+
+async def list_public_assistants_version() -> tuple[Optional[datetime], int]:
+    """Return a value that changes whenever the public assistants do."""
+    return await _list_version(_LIST_PUBLIC_ASSISTANTS, [])
 
 
 async def put_assistant(
@@ -69,6 +167,8 @@ async def put_assistant(
                 updated_at,
                 public,
             )
+            await conn.execute("SELECT pg_notify($1, $2)", ASSISTANTS_CHANNEL, assistant_id)
+    assistant_cache.invalidate(str(assistant_id))
     return {
         "assistant_id": assistant_id,
         "project_id": project_id,
@@ -83,10 +183,17 @@ async def delete_assistant(project_id: str, assistant_id: str) -> None:
     """Delete an assistant by ID."""
     async with get_pg_pool().acquire() as conn:
         await conn.execute(
-            "DELETE FROM assistant WHERE assistant_id = $1 AND project_id = $2",
+            """
+            WITH deleted AS (
+                DELETE FROM assistant WHERE assistant_id = $1 AND project_id = $2
+                RETURNING assistant_id
+            )
+            SELECT pg_notify($3, assistant_id::text) FROM deleted""",
             assistant_id,
             project_id,
+            ASSISTANTS_CHANNEL,
         )
+    assistant_cache.invalidate(str(assistant_id))
 
 async def increment_thread_count(user_id: str, assistant_id: str) -> None:
     """Increment the thread count."""
@@ -96,30 +203,93 @@ async def increment_thread_count(user_id: str, assistant_id: str) -> None:
         )
         print("assistant Type", assistant["config"]["configurable"]["type==agent/agent_type"])
         if assistant is not None:
-            agent_token_price = await conn.fetchrow('SELECT * FROM assistant_token_price WHERE agent_type = $1', assistant["config"]["configurable"]["type==agent/agent_type"])
+            agent_token_price = await conn.fetchrow(_GET_AGENT_PRICE, assistant["config"]["configurable"]["type==agent/agent_type"])
             print("agent_token_price", agent_token_price)
             if agent_token_price is None:
                 agent_token_price = {"price": 1}
             await conn.execute(
-            'UPDATE "user" SET thread_counter = thread_counter +  $1 WHERE user_id = $2',
-            agent_token_price["price"],
-            user_id,
-        )
+                """
+                WITH updated AS (
+                    UPDATE "user" SET thread_counter = thread_counter + $1
+                    WHERE user_id = $2
+                    RETURNING user_id
+                )
+                SELECT pg_notify($3, user_id::text) FROM updated""",
+                agent_token_price["price"],
+                user_id,
+                USERS_CHANNEL,
+            )
+            invalidate_user(user_id)
+
+async def list_threads(
+    project_id: str,
+    *,
+    after: Optional[Cursor] = None,
+    limit: Optional[int] = None,
+    full: bool = True,
+) -> List[Thread]:
+    """List the threads of a project, most recently updated first.
+
+    Without `full`, the metadata is left out.
+    """
+    query, args = _page(
+        _LIST_THREADS.format("*" if full else _THREAD_SUMMARY),
+        [project_id],
+        ("updated_at", "thread_id"),
+        after=after,
+        limit=limit,
+    )
+    async with get_pg_pool().acquire() as conn:
+        return await conn.fetch(query, *args)
+
+
+async def list_threads_version(project_id: str) -> tuple[Optional[datetime], int]:
+    """Return a value that changes whenever the threads of a project do."""
+    return await _list_version(_LIST_THREADS, [project_id])
 
-async def list_threads(project_id: str) -> List[Thread]:
-    """List all threads for the current user."""
+
+_GET_THREAD = prepare("SELECT * FROM thread WHERE thread_id = $1 AND project_id = $2")
+
+_ASSISTANT_COLUMNS = ("assistant_id", "project_id", "name", "config", "updated_at", "public")
+_GET_THREAD_WITH_ASSISTANT = prepare(
+    "SELECT t.*, "
+    + ", ".join(f"a.{column} AS a__{column}" for column in _ASSISTANT_COLUMNS)
+    + ", p.price AS a__price "
+    "FROM thread t "
+    "LEFT JOIN assistant a ON a.assistant_id = t.assistant_id "
+    "AND (a.project_id = $2 OR a.public IS true) "
+    "LEFT JOIN assistant_token_price p "
+    "ON p.agent_type = a.config->'configurable'->>'type==agent/agent_type' "
+    "WHERE t.thread_id = $1 AND t.project_id = $2"
+)
+
+
+async def get_thread_with_assistant(
+    project_id: str, thread_id: str
+) -> Optional[tuple[Thread, Optional[Assistant], Optional[float]]]:
+    """Get a thread, its assistant and the assistant's token price at once.
+
+    Returns None if the thread doesn't exist. The assistant and price are None
+    if the thread has no assistant the project can access.
+    """
     async with get_pg_pool().acquire() as conn:
-        return await conn.fetch("SELECT * FROM thread WHERE project_id = $1", project_id)
+        statement = await conn.prepared(_GET_THREAD_WITH_ASSISTANT)
+        record = await statement.fetchrow(thread_id, project_id)
+    if record is None:
+        return None
+    thread = {k: v for k, v in record.items() if not k.startswith("a__")}
+    if record["a__assistant_id"] is None:
+        return thread, None, None
+    assistant = {column: record[f"a__{column}"] for column in _ASSISTANT_COLUMNS}
+    assistant_cache.put(str(assistant["assistant_id"]), assistant)
+    return thread, assistant, record["a__price"]
 
 
 async def get_thread(project_id: str, thread_id: str) -> Optional[Thread]:
     """Get a thread by ID."""
     async with get_pg_pool().acquire() as conn:
-        return await conn.fetchrow(
-            "SELECT * FROM thread WHERE thread_id = $1 AND project_id = $2",
-            thread_id,
-            project_id,
-        )
+        statement = await conn.prepared(_GET_THREAD)
+        return await statement.fetchrow(thread_id, project_id)
 
 
 async def get_thread_state(*, project_id: str, thread_id: str, assistant: Assistant):
@@ -159,23 +329,64 @@ async def update_thread_state(
     )
 
 
-async def get_thread_history(*, project_id: str, thread_id: str, assistant: Assistant):
-    """Get the history of a thread."""
-    return [
-        {
+async def astream_thread_history(
+    *,
+    project_id: str,
+    thread_id: str,
+    assistant: Assistant,
+    limit: Optional[int] = None,
+    before: Optional[datetime] = None,
+    metadata_only: bool = False,
+) -> AsyncIterator[dict]:
+    """Stream past states of a thread, newest first.
+
+    Args:
+        limit: Maximum number of states to return.
+        before: Only return states older than this checkpoint timestamp.
+        metadata_only: Only return checkpoint configs, without decoding
+            the stored state.
+    """
+    config = {
+        "configurable": {
+            **assistant["config"]["configurable"],
+            "thread_id": thread_id,
+            "assistant_id": assistant["assistant_id"],
+            "history_before": before,
+            "history_limit": limit,
+        }
+    }
+    if metadata_only:
+        async for c in CHECKPOINTER.alist_metadata(config):
+            yield c
+        return
+    async for c in agent.aget_state_history(config):
+        yield {
             "values": c.values,
             "next": c.next,
             "config": c.config,
             "parent": c.parent_config,
         }
-        async for c in agent.aget_state_history(
-            {
-                "configurable": {
-                    **assistant["config"]["configurable"],
-                    "thread_id": thread_id,
-                    "assistant_id": assistant["assistant_id"],
-                }
-            }
+
+
+async def get_thread_history(
+    *,
+    project_id: str,
+    thread_id: str,
+    assistant: Assistant,
+    limit: Optional[int] = None,
+    before: Optional[datetime] = None,
+    metadata_only: bool = False,
+):
+    """Get the history of a thread."""
+    return [
+        c
+        async for c in astream_thread_history(
+            project_id=project_id,
+            thread_id=thread_id,
+            assistant=assistant,
+            limit=limit,
+            before=before,
+            metadata_only=metadata_only,
         )
     ]
 
@@ -228,6 +439,336 @@ async def delete_thread(project_id: str, thread_id: str):
             project_id,
         )
 
+RUNS_CHANNEL = "runs"
+"""Channel notified with the run ID when a run is created."""
+RUN_CANCEL_CHANNEL = "run_cancel"
+"""Channel notified with the run ID when a run is cancelled."""
+STREAM_CANCEL_CHANNEL = "stream_cancel"
+"""Channel notified with "<project id>:<run id>" to stop a streamed run."""
+
+
+async def create_run(
+    project_id: str,
+    thread_id: str,
+    assistant_id: str,
+    *,
+    input: Any,
+    config: dict,
+) -> Run:
+    """Queue a run for execution by a worker."""
+    async with get_pg_pool().acquire() as conn:
+        return await conn.fetchrow(
+            """
+            WITH created AS (
+                INSERT INTO run (project_id, thread_id, assistant_id, input, config)
+                VALUES ($1, $2, $3, $4, $5)
+                RETURNING *
+            )
+            SELECT created.* FROM created, pg_notify($6, created.run_id::text)""",
+            project_id,
+            thread_id,
+            assistant_id,
+            input,
+            config,
+            RUNS_CHANNEL,
+        )
+
+
+_GET_RUN = "SELECT * FROM run WHERE run_id = $1 AND project_id = $2"
+
+
+async def get_run(project_id: str, run_id: str) -> Optional[Run]:
+    """Get a run by ID."""
+    async with get_pg_pool().acquire() as conn:
+        return await conn.fetchrow(_GET_RUN, run_id, project_id)
+
+
+async def cancel_run(project_id: str, run_id: str) -> Optional[Run]:
+    """Cancel a pending or running run.
+
+    Returns None if the run does not exist or has already finished.
+    """
+    async with get_pg_pool().acquire() as conn:
+        return await conn.fetchrow(
+            """
+            WITH cancelled AS (
+                UPDATE run SET status = 'cancelled', updated_at = now()
+                WHERE run_id = $1 AND project_id = $2
+                    AND status IN ('pending', 'running')
+                RETURNING *
+            )
+            SELECT cancelled.* FROM cancelled, pg_notify($3, cancelled.run_id::text)""",
+            run_id,
+            project_id,
+            RUN_CANCEL_CHANNEL,
+        )
+
+
+async def cancel_stream(project_id: str, run_id: str) -> None:
+    """Ask the process executing a streamed run to stop it."""
+    async with get_pg_pool().acquire() as conn:
+        await conn.execute(
+            "SELECT pg_notify($1, $2)", STREAM_CANCEL_CHANNEL, f"{project_id}:{run_id}"
+        )
+
+
+_CLAIM_RUN = """
+UPDATE run SET status = 'running', attempts = attempts + 1,
+    lease_expires_at = now() + $1::interval, updated_at = now()
+WHERE run_id = (
+    SELECT run_id FROM run WHERE status = 'pending'
+    ORDER BY created_at
+    FOR UPDATE SKIP LOCKED
+    LIMIT 1
+)
+RETURNING *"""
+
+
+async def claim_run(lease: timedelta) -> Optional[Run]:
+    """Mark the oldest pending run as running and return it.
+
+    The run is requeued by `requeue_expired_runs` unless its lease is renewed
+    with `renew_run_leases` within `lease`.
+    """
+    async with get_pg_pool().acquire() as conn:
+        return await conn.fetchrow(_CLAIM_RUN, lease)
+
+
+async def renew_run_leases(run_ids: Sequence[str], lease: timedelta) -> None:
+    """Extend the leases of the running runs executed by this process."""
+    async with get_pg_pool().acquire() as conn:
+        await conn.execute(
+            "UPDATE run SET lease_expires_at = now() + $2::interval "
+            "WHERE run_id = ANY($1::uuid[]) AND status = 'running'",
+            run_ids,
+            lease,
+        )
+
+
+_REQUEUE_EXPIRED_RUNS = """
+WITH expired AS (
+    UPDATE run SET
+        status = CASE WHEN attempts < $1 THEN 'pending' ELSE 'error' END,
+        error = CASE WHEN attempts < $1 THEN error ELSE 'worker lost' END,
+        lease_expires_at = NULL,
+        updated_at = now()
+    WHERE status = 'running'
+        AND COALESCE(lease_expires_at, updated_at + $2::interval) < now()
+    RETURNING run_id, status
+),
+requeued AS (SELECT run_id FROM expired WHERE status = 'pending')
+SELECT requeued.run_id FROM requeued, pg_notify($3, requeued.run_id::text)"""
+
+
+async def requeue_expired_runs(max_attempts: int, lease: timedelta) -> int:
+    """Requeue the running runs whose worker stopped renewing their lease.
+
+    Runs already claimed `max_attempts` times fail instead. Rows claimed
+    before leases existed expire `lease` after they were claimed. Returns the
+    number of runs requeued.
+    """
+    async with get_pg_pool().acquire() as conn:
+        requeued = await conn.fetch(
+            _REQUEUE_EXPIRED_RUNS, max_attempts, lease, RUNS_CHANNEL
+        )
+    return len(requeued)
+
+
+async def finish_run(run_id: str, status: str, error: Optional[str] = None) -> None:
+    """Record the outcome of a running run, unless it was cancelled."""
+    async with get_pg_pool().acquire() as conn:
+        await conn.execute(
+            "UPDATE run SET status = $2, error = $3, updated_at = now() "
+            "WHERE run_id = $1 AND status = 'running'",
+            run_id,
+            status,
+            error,
+        )
+
+
+INGEST_CHANNEL = "ingest_jobs"
+"""Channel notified with the job ID when an ingestion job is created."""
+
+_INGEST_JOB_COLUMNS = (
+    "job_id, project_id, config, status, files_total, files_done, chunks_done, "
+    "error, attempts, lease_expires_at, created_at, updated_at"
+)
+
+
+async def create_ingest_job(
+    project_id: str,
+    config: dict,
+    files: Sequence[tuple[str, str, AsyncIterator[bytes]]],
+) -> IngestJob:
+    """Store uploaded (file name, mime type, data parts) files for ingestion.
+
+    Each part is written as it is read, so uploads are never held in memory
+    whole. The job is only created if all files are stored.
+    """
+    async with get_pg_pool().acquire() as conn:
+        async with conn.transaction():
+            job = await conn.fetchrow(
+                "INSERT INTO ingest_job (project_id, config, files_total) "
+                f"VALUES ($1, $2, $3) RETURNING {_INGEST_JOB_COLUMNS}",
+                project_id,
+                config,
+                len(files),
+            )
+            for position, (file_name, mime_type, parts) in enumerate(files):
+                await conn.execute(
+                    "INSERT INTO ingest_file (job_id, position, file_name, mime_type) "
+                    "VALUES ($1, $2, $3, $4)",
+                    job["job_id"],
+                    position,
+                    file_name,
+                    mime_type,
+                )
+                part = 0
+                async for data in parts:
+                    await conn.execute(
+                        "INSERT INTO ingest_file_part (job_id, position, part, data) "
+                        "VALUES ($1, $2, $3, $4)",
+                        job["job_id"],
+                        position,
+                        part,
+                        data,
+                    )
+                    part += 1
+            await conn.execute("SELECT pg_notify($1, $2)", INGEST_CHANNEL, job["job_id"])
+    return job
+
+
+async def get_ingest_job(project_id: str, job_id: str) -> Optional[IngestJob]:
+    """Get an ingestion job by ID."""
+    async with get_pg_pool().acquire() as conn:
+        return await conn.fetchrow(
+            f"SELECT {_INGEST_JOB_COLUMNS} FROM ingest_job "
+            "WHERE job_id = $1 AND project_id = $2",
+            job_id,
+            project_id,
+        )
+
+
+_CLAIM_INGEST_JOB = f"""
+UPDATE ingest_job SET status = 'running', attempts = attempts + 1,
+    lease_expires_at = now() + $1::interval, updated_at = now()
+WHERE job_id = (
+    SELECT job_id FROM ingest_job WHERE status = 'pending'
+    ORDER BY created_at
+    FOR UPDATE SKIP LOCKED
+    LIMIT 1
+)
+RETURNING {_INGEST_JOB_COLUMNS}"""
+
+
+async def claim_ingest_job(lease: timedelta) -> Optional[IngestJob]:
+    """Mark the oldest pending ingestion job as running and return it.
+
+    The job is requeued by `requeue_expired_ingest_jobs` unless its lease is
+    renewed with `renew_ingest_leases` within `lease`.
+    """
+    async with get_pg_pool().acquire() as conn:
+        return await conn.fetchrow(_CLAIM_INGEST_JOB, lease)
+
+
+async def renew_ingest_leases(job_ids: Sequence[str], lease: timedelta) -> None:
+    """Extend the leases of the running jobs executed by this process."""
+    async with get_pg_pool().acquire() as conn:
+        await conn.execute(
+            "UPDATE ingest_job SET lease_expires_at = now() + $2::interval "
+            "WHERE job_id = ANY($1::uuid[]) AND status = 'running'",
+            job_ids,
+            lease,
+        )
+
+
+_REQUEUE_EXPIRED_INGEST_JOBS = """
+WITH expired AS (
+    UPDATE ingest_job SET
+        status = CASE WHEN attempts < $1 THEN 'pending' ELSE 'error' END,
+        error = CASE WHEN attempts < $1 THEN error ELSE 'worker lost' END,
+        lease_expires_at = NULL,
+        updated_at = now()
+    WHERE status = 'running'
+        AND COALESCE(lease_expires_at, updated_at + $2::interval) < now()
+    RETURNING job_id, status
+),
+failed AS (
+    DELETE FROM ingest_file
+    WHERE job_id IN (SELECT job_id FROM expired WHERE status = 'error')
+),
+requeued AS (SELECT job_id FROM expired WHERE status = 'pending')
+SELECT requeued.job_id FROM requeued, pg_notify($3, requeued.job_id::text)"""
+
+
+async def requeue_expired_ingest_jobs(max_attempts: int, lease: timedelta) -> int:
+    """Requeue the running ingestion jobs whose worker stopped renewing their lease.
+
+    Jobs resume from the first file not yet ingested. Jobs already claimed
+    `max_attempts` times fail instead, and their files are dropped. Returns
+    the number of jobs requeued.
+    """
+    async with get_pg_pool().acquire() as conn:
+        requeued = await conn.fetch(
+            _REQUEUE_EXPIRED_INGEST_JOBS, max_attempts, lease, INGEST_CHANNEL
+        )
+    return len(requeued)
+
+
+async def get_ingest_file(job_id: str, position: int) -> tuple[str, str]:
+    """Get the (file name, mime type) of an uploaded file."""
+    async with get_pg_pool().acquire() as conn:
+        return tuple(
+            await conn.fetchrow(
+                "SELECT file_name, mime_type FROM ingest_file "
+                "WHERE job_id = $1 AND position = $2",
+                job_id,
+                position,
+            )
+        )
+
+
+async def read_ingest_file(job_id: str, position: int) -> AsyncIterator[bytes]:
+    """Yield the data of an uploaded file one stored part at a time."""
+    async with get_pg_pool().acquire() as conn:
+        async with conn.transaction():
+            async for row in conn.cursor(
+                "SELECT data FROM ingest_file_part "
+                "WHERE job_id = $1 AND position = $2 ORDER BY part",
+                job_id,
+                position,
+                prefetch=1,
+            ):
+                yield row["data"]
+
+
+async def add_ingest_progress(job_id: str, *, files: int = 0, chunks: int = 0) -> None:
+    """Count files and chunks ingested by a job."""
+    async with get_pg_pool().acquire() as conn:
+        await conn.execute(
+            "UPDATE ingest_job SET files_done = files_done + $2, "
+            "chunks_done = chunks_done + $3, updated_at = now() WHERE job_id = $1",
+            job_id,
+            files,
+            chunks,
+        )
+
+
+async def finish_ingest_job(job_id: str, status: str, error: Optional[str] = None) -> None:
+    """Record the outcome of an ingestion job and drop its uploaded files."""
+    async with get_pg_pool().acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                "UPDATE ingest_job SET status = $2, error = $3, updated_at = now() "
+                "WHERE job_id = $1",
+                job_id,
+                status,
+                error,
+            )
+            await conn.execute("DELETE FROM ingest_file_part WHERE job_id = $1", job_id)
+            await conn.execute("DELETE FROM ingest_file WHERE job_id = $1", job_id)
+
+
 async def get_projects(user_id: str) -> List[dict]:
     """Get all projects for a user."""
     async with get_pg_pool().acquire() as conn:
@@ -249,10 +790,26 @@ async def create_project(user_id: str, name: str, description: str) -> dict:
             "description": description,
         }
 
-async def list_projects(user_id: str) -> List[dict]:
-    """List all projects for the current user."""
+_LIST_PROJECTS = "SELECT * FROM project WHERE user_id = $1"
+
+
+async def list_projects(
+    user_id: str,
+    *,
+    after: Optional[Cursor] = None,
+    limit: Optional[int] = None,
+) -> List[dict]:
+    """List the projects of a user by name."""
+    query, args = _page(
+        _LIST_PROJECTS,
+        [user_id],
+        ("name", "project_id"),
+        after=after,
+        limit=limit,
+        descending=False,
+    )
     async with get_pg_pool().acquire() as conn:
-        return await conn.fetch("SELECT * FROM project WHERE user_id = $1 ORDER BY name", user_id)
+        return await conn.fetch(query, *args)
         
 
 async def get_project(user_id: str, project_id: str) -> Optional[dict]:
@@ -294,57 +851,105 @@ async def get_user(email: str, password: str) -> User:
     """Returns the user."""
     async with get_pg_pool().acquire() as conn:
         user = await conn.fetchrow('SELECT * FROM "user" WHERE email = $1', email)
-        if user is not None:
-            if bcrypt.checkpw(password.encode("utf-8"), user["password"].encode("utf-8")):
-                return dict(user)
-
+    if user is None or not await verify_password(password, user["password"]):
         return None
+    if needs_rehash(user["password"]):
+        hashed = await hash_password(password)
+        async with get_pg_pool().acquire() as conn:
+            await conn.execute(
+                'UPDATE "user" SET password = $1 WHERE user_id = $2',
+                hashed,
+                user["user_id"],
+            )
+        return {**user, "password": hashed}
+    return dict(user)
+_GET_USER = 'SELECT * FROM "user" WHERE user_id = $1'
+_GET_USER_BY_EMAIL_AND_PROVIDER = (
+    'SELECT * FROM "user" WHERE email = $1 AND provider = $2'
+)
+_GET_AGENT_PRICE = "SELECT * FROM assistant_token_price WHERE agent_type = $1"
+
+
 async def get_user_by_id(user_id: str) -> User:
     """Returns the user."""
     async with get_pg_pool().acquire() as conn:
-        return await conn.fetchrow('SELECT * FROM "user" WHERE user_id = $1', user_id)
+        return await conn.fetchrow(_GET_USER, user_id)
 
 async def create_user(email: str, password: str, provider: str) -> User:
     """Create a new user."""
 
     password_encoded = ""
     if password is not None:
-        bytes = password.encode("utf-8")
-        salt = bcrypt.gensalt()
-        hashed = bcrypt.hashpw(bytes, salt)
-        password_encoded = hashed.decode("utf-8")
-    stripe_client_id = stripe.Customer.create(email=email)
+        password_encoded = await hash_password(password)
+    stripe_client_id = await billing.create_customer(email)
 
     async with get_pg_pool().acquire() as conn:
         user = await conn.fetchrow(
-            'INSERT INTO "user" (email, password, stripe_client_id, provider) VALUES ($1, $2, $3, $4) RETURNING *', email, password_encoded, stripe_client_id["id"], provider
+            'INSERT INTO "user" (email, password, stripe_client_id, provider) VALUES ($1, $2, $3, $4) RETURNING *', email, password_encoded, stripe_client_id, provider
         )
         return user
     
 async def get_user_by_email_and_provider(email: str, provider: str) -> User:
     async with get_pg_pool().acquire() as conn:
-        return await conn.fetchrow('SELECT * FROM "user" WHERE email = $1 AND provider = $2', email, provider)
+        return await conn.fetchrow(_GET_USER_BY_EMAIL_AND_PROVIDER, email, provider)
 
 async def get_thread_info(user_id: str) -> ThreadInfo:
     async with get_pg_pool().acquire() as conn:
-        return await conn.fetch('SELECT * FROM "user" WHERE user_id = $1', user_id)
+        return await conn.fetch(_GET_USER, user_id)
     
 async def get_agent_price(agent_name: str) -> dict:
     async with get_pg_pool().acquire() as conn:
-        return await conn.fetchrow('SELECT * FROM assistant_token_price WHERE agent_type = $1', agent_name)
+        return await conn.fetchrow(_GET_AGENT_PRICE, agent_name)
     
-async def increment_user_token_counter(stripe_customer_id : str, token_quantity : int) -> None:
+_CREDIT_TOKENS = """
+WITH updated AS (
+    UPDATE "user" SET max_thread_counter = max_thread_counter + $1
+    WHERE stripe_client_id = $2
+    RETURNING user_id
+)
+SELECT user_id, pg_notify($3, user_id::text) FROM updated"""
+
+
+async def increment_user_token_counter(
+    stripe_customer_id: str, token_quantity: int, *, event_id: Optional[str] = None
+) -> bool:
+    """Credit tokens to the customer's user.
+
+    If `event_id` is given, the Stripe event is recorded in the same
+    transaction, and tokens are only credited the first time it's seen.
+    Returns whether the tokens were credited.
+    """
     async with get_pg_pool().acquire() as conn:
-        await conn.execute(
-            'UPDATE "user" SET max_thread_counter = max_thread_counter +  $1 WHERE stripe_client_id = $2',
-            token_quantity,
-            stripe_customer_id,
-        )
+        async with conn.transaction():
+            if event_id is not None and not await conn.fetchval(
+                "INSERT INTO stripe_event (event_id) VALUES ($1) "
+                "ON CONFLICT DO NOTHING RETURNING true",
+                event_id,
+            ):
+                return False
+            updated = await conn.fetch(
+                _CREDIT_TOKENS,
+                token_quantity,
+                stripe_customer_id,
+                USERS_CHANNEL,
+            )
+    for record in updated:
+        invalidate_user(record["user_id"])
+    return True
 
 async def update_user_stripe_id(user: User) -> User:
+    stripe_client_id = await billing.create_customer(user["email"])
     async with get_pg_pool().acquire() as conn:
-        stripe_client_id = stripe.Customer.create(email=user.email)
-
-        return await conn.fetchrow(
-            'UPDATE "user" SET stripe_client_id = $1 WHERE user_id = $2 RETURNING *', stripe_client_id, user["user_id"]
-        )
\ No newline at end of file
+        updated = await conn.fetchrow(
+            """
+            WITH updated AS (
+                UPDATE "user" SET stripe_client_id = $1 WHERE user_id = $2
+                RETURNING *
+            )
+            SELECT updated.* FROM updated, pg_notify($3, updated.user_id::text)""",
+            stripe_client_id,
+            user["user_id"],
+            USERS_CHANNEL,
+        )
+    invalidate_user(user["user_id"])
+    return updated
@@ -1,22 +1,50 @@
+import asyncio
 import functools
+import os
+from collections import OrderedDict
 from typing import Any, AsyncIterator, Dict, Optional, Sequence, Union
 
 import orjson
 import structlog
-from langchain_core.messages import AnyMessage, BaseMessage, message_chunk_to_message
+from langchain_core.messages import (
+    AIMessageChunk,
+    AnyMessage,
+    BaseMessage,
+    message_chunk_to_message,
+)
 from langchain_core.runnables import Runnable, RunnableConfig
+from typing_extensions import TypedDict
 
 logger = structlog.get_logger(__name__)
 
-MessagesStream = AsyncIterator[Union[list[AnyMessage], str]]
+
+class MessageDelta(TypedDict):
+    """New content of a message being generated."""
+
+    id: str
+    """The ID of the message."""
+    content: Union[str, list]
+    """Content generated since the previous delta."""
+    tool_call_chunks: list
+    """Fragments of tool call arguments generated since the previous delta."""
+
+
+MessagesStream = AsyncIterator[Union[list[AnyMessage], MessageDelta, str]]
 
 
 async def astream_state(
     app: Runnable,
     input: Union[Sequence[AnyMessage], Dict[str, Any]],
     config: RunnableConfig,
+    *,
+    deltas: bool = False,
 ) -> MessagesStream:
-    """Stream messages from the runnable."""
+    """Stream messages from the runnable.
+
+    By default every chunk of a message being generated yields the whole
+    message so far. With `deltas`, only the new fragment is yielded, and the
+    full message follows once it's complete.
+    """
     root_run_id: Optional[str] = None
     messages: dict[str, BaseMessage] = {}
 
@@ -48,11 +76,20 @@ async def astream_state(
                 yield new_messages
         elif event["event"] == "on_chat_model_stream":
             message: BaseMessage = event["data"]["chunk"]
-            if message.id not in messages:
+            if deltas:
+                tool_call_chunks = getattr(message, "tool_call_chunks", None) or []
+                if message.content or tool_call_chunks:
+                    yield {
+                        "id": message.id,
+                        "content": message.content,
+                        "tool_call_chunks": tool_call_chunks,
+                    }
+            elif message.id not in messages:
                 messages[message.id] = message
+                yield [messages[message.id]]
             else:
                 messages[message.id] += message
-            yield [messages[message.id]]
+                yield [messages[message.id]]
 
 
 def _default(obj) -> Any:
@@ -76,6 +113,8 @@ async def to_sse(messages_stream: MessagesStream) -> AsyncIterator[dict]:
                     "event": "metadata",
                     "data": orjson.dumps({"run_id": chunk}).decode(),
                 }
+            elif isinstance(chunk, dict):
+                yield {"event": "delta", "data": dumps(chunk).decode()}
             else:
                 yield {
                     "event": "data",
@@ -97,3 +136,202 @@ async def to_sse(messages_stream: MessagesStream) -> AsyncIterator[dict]:
 
     # Send an end event to signal the end of the stream
     yield {"event": "end"}
+
+
+REPLAY_BUFFER_SIZE = int(os.environ.get("STREAM_REPLAY_BUFFER_SIZE", "1000"))
+"""Maximum number of events kept per run for clients that reconnect."""
+REPLAY_TTL = float(os.environ.get("STREAM_REPLAY_TTL", "60"))
+"""Seconds a finished run's events are kept for clients that reconnect."""
+
+
+class ReplayBuffer:
+    """Events of a run executing independently of the client consuming them.
+
+    Every event is given an ID of the form `<run_id>:<seq>`, so a client that
+    reconnects with `Last-Event-ID` can resume after the last event it saw.
+
+    Each chunk of a message being generated is sent as the whole message so
+    far, so only the latest snapshot of each message is kept. A client
+    resuming before it gets that snapshot instead of the earlier ones.
+    Messages streamed as deltas are also kept whole while being generated, so
+    a client that missed deltas dropped from the buffer gets them whole
+    instead. Other events are dropped once more than `maxlen` are buffered,
+    and a client that needs them gets an error telling it to reload the thread
+    instead.
+    """
+
+    def __init__(self, owner: str, maxlen: int = REPLAY_BUFFER_SIZE) -> None:
+        self.owner = owner
+        self.run_id: Optional[str] = None
+        self.done = False
+        self.maxlen = maxlen
+        self._events: OrderedDict[int, tuple[Optional[str], dict]] = OrderedDict()
+        self._snapshots: dict[str, int] = {}
+        self._partials: dict[str, tuple[int, dict]] = {}
+        self._last = -1
+        self._evicted = -1
+        self._evicted_deltas = -1
+        self._changed = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+
+    async def append(
+        self,
+        event: dict,
+        message_id: Optional[str] = None,
+        snapshot: Optional[dict] = None,
+    ) -> None:
+        """Buffer `event`, replacing the previous snapshot of `message_id`.
+
+        For a delta event, `snapshot` is a data event with the whole message
+        generated so far.
+        """
+        async with self._changed:
+            self._last += 1
+            if self.run_id is not None:
+                event = {**event, "id": f"{self.run_id}:{self._last}"}
+            if snapshot is not None and message_id is not None:
+                if self.run_id is not None:
+                    snapshot = {**snapshot, "id": event["id"]}
+                self._partials[message_id] = (self._last, snapshot)
+            elif message_id is not None:
+                if (previous := self._snapshots.get(message_id)) is not None:
+                    del self._events[previous]
+                self._snapshots[message_id] = self._last
+                self._partials.pop(message_id, None)
+            self._events[self._last] = (message_id, event)
+            while len(self._events) > self.maxlen:
+                seq, (evicted, evicted_event) = self._events.popitem(last=False)
+                if evicted_event["event"] == "delta":
+                    self._evicted_deltas = seq
+                else:
+                    self._evicted = seq
+                    if self._snapshots.get(evicted) == seq:
+                        del self._snapshots[evicted]
+            self._changed.notify_all()
+
+    async def close(self) -> None:
+        async with self._changed:
+            self.done = True
+            self._changed.notify_all()
+
+    async def subscribe(self, after: int = -1) -> AsyncIterator[dict]:
+        """Yield the buffered events after `after`, then live ones."""
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.done or self._last > after)
+                lost = after < self._evicted
+                pending = [
+                    (seq, e) for seq, (_, e) in self._events.items() if seq > after
+                ]
+                if after < self._evicted_deltas:
+                    # Send the messages being generated whole instead of deltas.
+                    pending = [(s, e) for s, e in pending if e["event"] != "delta"]
+                    pending += [p for p in self._partials.values() if p[0] > after]
+                    pending.sort(key=lambda p: p[0])
+                done = self.done
+            if lost:
+                yield _LOST_EVENTS
+                yield {"event": "end"}
+                return
+            for seq, event in pending:
+                after = seq
+                yield event
+            if done:
+                return
+
+
+_LOST_EVENTS = {
+    "event": "error",
+    "data": orjson.dumps(
+        {"status_code": 409, "message": "Stream events were lost, reload the thread"}
+    ).decode(),
+}
+
+_buffers: dict[str, ReplayBuffer] = {}
+
+
+async def _track_chunks(
+    buffer: ReplayBuffer, messages_stream: MessagesStream, snapshots: list
+) -> MessagesStream:
+    """Record the run ID, the message ID of single message chunks, and the
+    whole message each delta belongs to."""
+    partials: dict[str, AIMessageChunk] = {}
+    async for chunk in messages_stream:
+        if isinstance(chunk, str) and buffer.run_id is None:
+            buffer.run_id = chunk
+            _buffers[chunk] = buffer
+        if isinstance(chunk, dict):
+            delta = AIMessageChunk(**chunk)
+            if chunk["id"] in partials:
+                delta = partials[chunk["id"]] + delta
+            partials[chunk["id"]] = delta
+            snapshot = {
+                "event": "data",
+                "data": dumps([message_chunk_to_message(delta)]).decode(),
+            }
+            snapshots.append((chunk["id"], snapshot))
+        elif isinstance(chunk, list) and len(chunk) == 1:
+            partials.pop(chunk[0].id, None)
+            snapshots.append((chunk[0].id, None))
+        else:
+            snapshots.append((None, None))
+        yield chunk
+
+
+async def _produce(buffer: ReplayBuffer, messages_stream: MessagesStream) -> None:
+    # to_sse turns each chunk into one event, then adds error and end events.
+    snapshots: list[tuple[Optional[str], Optional[dict]]] = []
+    try:
+        async for event in to_sse(_track_chunks(buffer, messages_stream, snapshots)):
+            message_id, snapshot = snapshots.pop() if snapshots else (None, None)
+            if event["event"] in ("data", "delta"):
+                await buffer.append(event, message_id, snapshot)
+            else:
+                await buffer.append(event)
+    except asyncio.CancelledError:
+        await buffer.append({"event": "end"})
+        raise
+    finally:
+        await buffer.close()
+        if buffer.run_id is not None:
+            asyncio.get_running_loop().call_later(
+                REPLAY_TTL, _buffers.pop, buffer.run_id, None
+            )
+
+
+def detached_sse(messages_stream: MessagesStream, owner: str) -> AsyncIterator[dict]:
+    """Like `to_sse`, but keep the run going if the client disconnects.
+
+    The events are buffered so the client can resume with `resume_sse`.
+    """
+    buffer = ReplayBuffer(owner)
+    buffer._task = asyncio.create_task(_produce(buffer, messages_stream))
+    return buffer.subscribe()
+
+
+def cancel_detached(run_id: str, owner: str) -> bool:
+    """Stop a detached run executing in this process.
+
+    Returns whether the run was found.
+    """
+    buffer = _buffers.get(run_id)
+    if buffer is None or buffer.owner != owner or buffer._task is None:
+        return False
+    buffer._task.cancel()
+    return True
+
+
+def resume_sse(
+    last_event_id: Optional[str], owner: str
+) -> Optional[AsyncIterator[dict]]:
+    """Resume a detached stream after the event with ID `last_event_id`.
+
+    Returns None if the run is unknown to this process or has expired.
+    """
+    if not last_event_id:
+        return None
+    run_id, _, seq = last_event_id.rpartition(":")
+    buffer = _buffers.get(run_id)
+    if buffer is None or buffer.owner != owner or not seq.isdigit():
+        return None
+    return buffer.subscribe(int(seq))
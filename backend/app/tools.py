@@ -21,11 +21,13 @@ from langchain_community.tools.tavily_search import (
 from langchain_community.utilities.arxiv import ArxivAPIWrapper
 from langchain_community.utilities.dalle_image_generator import DallEAPIWrapper
 from langchain_community.utilities.tavily_search import TavilySearchAPIWrapper
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import Tool
 from langchain_robocorp import ActionServerToolkit
 from typing_extensions import TypedDict
 
 from app.upload import vstore
+from app.vectorstore import HybridRetriever
 
 
 class DDGInput(BaseModel):
@@ -205,20 +207,43 @@ If the user asks a vague question, they are likely meaning to look up info from
 
 
 def get_retriever(assistant_id: str, thread_id: str):
-    return vstore.as_retriever(
-        search_kwargs={"filter": {"namespace": {"$in": [assistant_id, thread_id]}}}
-    )
+    return HybridRetriever(vectorstore=vstore, namespaces=[assistant_id, thread_id])
+
+
+RETRIEVAL_TOOL_NAME = "Retriever"
 
 
 @lru_cache(maxsize=5)
-def get_retrieval_tool(assistant_id: str, thread_id: str, description: str):
+def get_retrieval_tool(
+    assistant_id: Optional[str], thread_id: Optional[str], description: str
+):
     return create_retriever_tool(
         get_retriever(assistant_id, thread_id),
-        "Retriever",
+        RETRIEVAL_TOOL_NAME,
         description,
     )
 
 
+def bind_runtime_tools(tools: list, config: RunnableConfig) -> list:
+    """Scope tools that depend on the current run to its assistant and thread.
+
+    Cached agent executors are shared across threads, so they are built with
+    an unscoped retrieval tool which is swapped here at call time.
+    """
+    bound = []
+    for tool in tools:
+        if tool.name == RETRIEVAL_TOOL_NAME:
+            assistant_id = config["configurable"].get("assistant_id")
+            thread_id = config["configurable"].get("thread_id")
+            if assistant_id is None or thread_id is None:
+                raise ValueError(
+                    "Both assistant_id and thread_id must be provided if Retrieval tool is used"
+                )
+            tool = get_retrieval_tool(assistant_id, thread_id, tool.description)
+        bound.append(tool)
+    return bound
+
+
 @lru_cache(maxsize=1)
 def _get_duck_duck_go():
     return DuckDuckGoSearchRun(args_schema=DDGInput)
@@ -11,26 +11,44 @@ from __future__ import annotations
 
 import mimetypes
 import os
-from typing import BinaryIO, List, Optional
+import tempfile
+from typing import IO, AsyncIterator, BinaryIO, Callable, List, Optional
 
-from fastapi import UploadFile
-from langchain_community.vectorstores.pgvector import PGVector
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse
 from langchain_core.document_loaders.blob_loaders import Blob
-from langchain_core.runnables import (
-    ConfigurableField,
-    RunnableConfig,
-    RunnableSerializable,
-)
+from langchain_core.runnables import RunnableConfig, RunnableSerializable
 from langchain_core.vectorstores import VectorStore
 from langchain_openai import AzureOpenAIEmbeddings, OpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter, TextSplitter
 
+from app.embedding_cache import BlobRegistry, CachedEmbeddings
 from app.ingest import ingest_blob
 from app.parsing import MIMETYPE_BASED_PARSER
+from app.vectorstore import PGVectorStore
+
+
+EMBED_CONCURRENCY = int(os.environ.get("INGEST_EMBED_CONCURRENCY", "4"))
+"""Maximum number of concurrent embedding requests per ingested file."""
+EMBED_BATCH_TOKENS = int(os.environ.get("INGEST_EMBED_BATCH_TOKENS", "8000"))
+"""Maximum number of tokens per embedding request."""
+MAX_FILE_BYTES = int(os.environ.get("INGEST_MAX_FILE_BYTES", str(50 << 20)))
+"""Maximum size of an uploaded file."""
+MAX_REQUEST_BYTES = int(os.environ.get("INGEST_MAX_REQUEST_BYTES", str(200 << 20)))
+"""Maximum size of an upload request, enforced while it is received."""
+SPOOL_DIR = os.environ.get("INGEST_SPOOL_DIR") or None
+"""Directory of the temporary files uploads are spooled to."""
+PART_SIZE = 1 << 20
+"""Size of the parts uploads are read and stored in."""
+SNIFF_BYTES = 2048
+"""Number of leading bytes used to guess the mime-type of a file."""
 
 
 def _guess_mimetype(file_name: str, file_bytes: bytes) -> str:
-    """Guess the mime-type of a file based on its name or bytes."""
+    """Guess the mime-type of a file based on its name or first bytes.
+
+    Only the first `SNIFF_BYTES` of the file are needed.
+    """
     # Guess based on the file extension
     mime_type, _ = mimetypes.guess_type(file_name)
 
@@ -65,41 +83,83 @@ def _guess_mimetype(file_name: str, file_bytes: bytes) -> str:
     return "application/octet-stream"
 
 
-def convert_ingestion_input_to_blob(file: UploadFile) -> Blob:
-    """Convert ingestion input to blob."""
-    file_data = file.file.read()
-    file_name = file.filename
+def guess_file_mimetype(file_name: str, file: BinaryIO) -> str:
+    """Guess the mime-type of a file from its name or header, then rewind it."""
+    header = file.read(SNIFF_BYTES)
+    file.seek(0)
+    return _guess_mimetype(file_name, header)
 
-    # Check if file_name is a valid string
-    if not isinstance(file_name, str):
-        raise TypeError(f"Expected string for file name, got {type(file_name)}")
 
-    mimetype = _guess_mimetype(file_name, file_data)
-    return Blob.from_data(
-        data=file_data,
-        path=file_name,
-        mime_type=mimetype,
-    )
+def spool() -> IO[bytes]:
+    """Temporary file to spool an upload to, deleted when closed."""
+    return tempfile.NamedTemporaryFile(prefix="upload-", dir=SPOOL_DIR)
+
+
+async def read_upload(file: UploadFile) -> AsyncIterator[bytes]:
+    """Read an upload in parts, failing once it exceeds `MAX_FILE_BYTES`."""
+    size = 0
+    while data := await file.read(PART_SIZE):
+        size += len(data)
+        if size > MAX_FILE_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"{file.filename} is larger than {MAX_FILE_BYTES} bytes.",
+            )
+        yield data
+
+
+class UploadSizeLimitMiddleware:
+    """Reject requests to `path` with a body larger than `max_bytes`.
+
+    The body is counted as it is received, so oversized uploads are cut off
+    before they are spooled whole, including chunked ones without a
+    Content-Length.
+    """
 
+    def __init__(self, app, path: str, max_bytes: int) -> None:
+        self.app = app
+        self.path = path
+        self.max_bytes = max_bytes
 
-def _determine_azure_or_openai_embeddings() -> PGVector:
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or scope["path"] != self.path:
+            return await self.app(scope, receive, send)
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and int(content_length) > self.max_bytes:
+            response = PlainTextResponse("Request body too large", status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def _receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(
+                        status_code=413, detail="Request body too large."
+                    )
+            return message
+
+        await self.app(scope, _receive, send)
+
+
+def _determine_azure_or_openai_embeddings() -> PGVectorStore:
     if os.environ.get("OPENAI_API_KEY"):
-        return PGVector(
-            connection_string=PG_CONNECTION_STRING,
-            embedding_function=OpenAIEmbeddings(),
-            use_jsonb=True,
-        )
+        return PGVectorStore(CachedEmbeddings(OpenAIEmbeddings()))
     if os.environ.get("AZURE_OPENAI_API_KEY"):
-        return PGVector(
-            connection_string=PG_CONNECTION_STRING,
-            embedding_function=AzureOpenAIEmbeddings(
-                azure_endpoint=os.environ.get("AZURE_OPENAI_API_BASE"),
-                azure_deployment=os.environ.get(
-                    "AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT_NAME"
+        return PGVectorStore(
+            CachedEmbeddings(
+                AzureOpenAIEmbeddings(
+                    azure_endpoint=os.environ.get("AZURE_OPENAI_API_BASE"),
+                    azure_deployment=os.environ.get(
+                        "AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT_NAME"
+                    ),
+                    openai_api_version=os.environ.get("AZURE_OPENAI_API_VERSION"),
                 ),
-                openai_api_version=os.environ.get("AZURE_OPENAI_API_VERSION"),
-            ),
-            use_jsonb=True,
+            )
         )
     raise ValueError(
         "Either OPENAI_API_KEY or AZURE_OPENAI_API_KEY needs to be set for embeddings to work."
@@ -119,6 +179,8 @@ class IngestRunnable(RunnableSerializable[BinaryIO, List[str]]):
     
     ID is used as the namespace, and is filtered on at query time.
     """
+    blob_registry: Optional[BlobRegistry] = None
+    """Registry used to skip blobs already ingested into the namespace."""
 
     class Config:
         arbitrary_types_allowed = True
@@ -134,39 +196,40 @@ class IngestRunnable(RunnableSerializable[BinaryIO, List[str]]):
         return self.assistant_id if self.assistant_id is not None else self.thread_id
 
     def invoke(self, blob: Blob, config: Optional[RunnableConfig] = None) -> List[str]:
+        return self.ingest(blob)
+
+    def ingest(
+        self, blob: Blob, on_progress: Optional[Callable[[int], None]] = None
+    ) -> List[str]:
+        """Ingest a blob, reporting the number of chunks stored per batch."""
         out = ingest_blob(
             blob,
             MIMETYPE_BASED_PARSER,
             self.text_splitter,
             self.vectorstore,
             self.namespace,
+            max_batch_tokens=EMBED_BATCH_TOKENS,
+            max_concurrency=EMBED_CONCURRENCY,
+            on_progress=on_progress,
+            registry=self.blob_registry,
         )
         return out
 
 
-PG_CONNECTION_STRING = PGVector.connection_string_from_db_params(
-    driver="psycopg2",
-    host=os.environ["POSTGRES_HOST"],
-    port=int(os.environ["POSTGRES_PORT"]),
-    database=os.environ["POSTGRES_DB"],
-    user=os.environ["POSTGRES_USER"],
-    password=os.environ["POSTGRES_PASSWORD"],
-)
 vstore = _determine_azure_or_openai_embeddings()
+blob_registry = BlobRegistry()
 
 
-ingest_runnable = IngestRunnable(
-    text_splitter=RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200),
-    vectorstore=vstore,
-).configurable_fields(
-    assistant_id=ConfigurableField(
-        id="assistant_id",
-        annotation=str,
-        name="Assistant ID",
-    ),
-    thread_id=ConfigurableField(
-        id="thread_id",
-        annotation=str,
-        name="Thread ID",
-    ),
-)
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+
+
+def get_ingest_runnable(config: RunnableConfig) -> IngestRunnable:
+    """Get the ingestion runnable for the assistant or thread in `config`."""
+    configurable = config.get("configurable") or {}
+    return IngestRunnable(
+        text_splitter=text_splitter,
+        vectorstore=vstore,
+        assistant_id=configurable.get("assistant_id"),
+        thread_id=configurable.get("thread_id"),
+        blob_registry=blob_registry,
+    )
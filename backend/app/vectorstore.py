@@ -0,0 +1,416 @@
+"""Vector store on the shared asyncpg pool.
+
+Chunks are stored in the `chunk` table with the namespace they were ingested
+into (an assistant or thread ID) in a column of its own, and searched through
+an HNSW index on cosine distance, filtered by namespace. Inserts are copied in
+bulk with COPY.
+
+Retrieval is hybrid: a full-text search on the content finds exact terms,
+like identifiers, that embeddings miss, and its ranking is merged with the
+vector search by reciprocal rank fusion.
+
+Ingestion runs on threads, so the sync methods run their queries on the app's
+event loop.
+"""
+import itertools
+import os
+import time
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+from uuid import uuid4
+
+import orjson
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+from app import metrics
+from app.cache import TTLCache
+from app.lifespan import add_listener, get_pg_pool, run_in_loop
+
+EF_SEARCH = int(os.environ.get("VECTOR_EF_SEARCH", "100"))
+"""Candidates kept by HNSW searches. Higher finds more neighbours, slower."""
+ITERATIVE_SCAN = os.environ.get("VECTOR_ITERATIVE_SCAN", "strict_order")
+"""`hnsw.iterative_scan` mode (pgvector >= 0.8). Set to off for older versions.
+
+Lets searches in small namespaces keep scanning until they find `k` chunks.
+Searches still finding fewer are retried as an exact scan of the namespaces.
+"""
+RRF_K = float(os.environ.get("RETRIEVAL_RRF_K", "60"))
+"""Rank offset of reciprocal rank fusion. Higher flattens the top ranks."""
+VECTOR_WEIGHT = float(os.environ.get("RETRIEVAL_VECTOR_WEIGHT", "1"))
+"""Weight of the vector search ranking in hybrid retrieval."""
+LEXICAL_WEIGHT = float(os.environ.get("RETRIEVAL_LEXICAL_WEIGHT", "1"))
+"""Weight of the full-text search ranking in hybrid retrieval. 0 disables it."""
+HYBRID_CANDIDATES = 4
+"""Candidates taken from each search per chunk returned."""
+
+CHUNKS_CHANNEL = "chunks"
+"""Channel notified with the namespace whenever its chunks change."""
+
+query_embedding_cache: TTLCache[List[float]] = TTLCache(
+    int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", "10000")),
+    float(os.environ.get("QUERY_EMBEDDING_CACHE_TTL", "86400")),
+)
+"""Embeddings of normalized queries."""
+retrieval_cache: TTLCache[List[Document]] = TTLCache(
+    int(os.environ.get("RETRIEVAL_CACHE_SIZE", "10000")),
+    float(os.environ.get("RETRIEVAL_CACHE_TTL", "3600")),
+)
+"""Hybrid search results by namespace generations, normalized query and k."""
+
+_generations: TTLCache[int] = TTLCache(retrieval_cache.maxsize, retrieval_cache.ttl)
+"""Generation of each namespace, changed whenever its chunks are."""
+_next_generation = itertools.count()
+
+
+def _bump_generation(namespace: str) -> None:
+    _generations.put(namespace, next(_next_generation))
+
+
+def _generation(namespace: str) -> int:
+    # Generations are never reused, so a namespace evicted from the cache
+    # can't match results cached before it was last changed.
+    if (generation := _generations.get(namespace)) is None:
+        generation = next(_next_generation)
+        _generations.put(namespace, generation)
+    return generation
+
+
+add_listener(CHUNKS_CHANNEL, _bump_generation, retrieval_cache.clear)
+
+
+def _normalize(query: str) -> str:
+    return " ".join(query.split()).casefold()
+
+
+_SEARCH = """
+SELECT id, content, metadata, embedding <=> $1 AS distance FROM chunk
+WHERE namespace = ANY($2::text[])
+ORDER BY embedding <=> $1
+LIMIT $3"""
+
+# Each search ranks its candidates, and chunks are scored by the sum of
+# weight / (RRF_K + rank) over the searches that found them. Ranks are
+# computed after the LIMIT so the searches still use their indexes. The words
+# of the text query are ORed, the ranking puts chunks matching more first.
+_HYBRID_SEARCH = """
+WITH vector AS (
+    SELECT id, row_number() OVER (ORDER BY distance) AS rank FROM (
+        SELECT id, embedding <=> $1 AS distance FROM chunk
+        WHERE namespace = ANY($2::text[])
+        ORDER BY embedding <=> $1
+        LIMIT $4
+    ) candidates
+), lexical AS (
+    SELECT id, row_number() OVER (ORDER BY score DESC) AS rank FROM (
+        SELECT id, ts_rank_cd(content_tsv, query) AS score
+        FROM chunk,
+            replace(plainto_tsquery('english', $3)::text, '&', '|')::tsquery query
+        WHERE namespace = ANY($2::text[]) AND content_tsv @@ query AND $6::float8 > 0
+        ORDER BY score DESC
+        LIMIT $4
+    ) candidates
+)
+SELECT chunk.id, content, metadata,
+    COALESCE($5::float8 / ($7::float8 + vector.rank), 0)
+        + COALESCE($6::float8 / ($7::float8 + lexical.rank), 0) AS score,
+    (SELECT count(*) FROM vector) AS vector_candidates
+FROM vector
+FULL OUTER JOIN lexical USING (id)
+JOIN chunk USING (id)
+ORDER BY score DESC
+LIMIT $8"""
+
+# COPY uses the binary format, which the text jsonb and uuid codecs of the
+# pool can't write, so rows are staged as text first.
+_CREATE_STAGING = """
+CREATE TEMP TABLE chunk_staging (
+    id TEXT, namespace TEXT, content TEXT, metadata TEXT, embedding vector
+) ON COMMIT DROP"""
+
+_INSERT_STAGED = """
+INSERT INTO chunk (id, namespace, content, metadata, embedding)
+SELECT id::uuid, namespace, content, metadata::jsonb, embedding FROM chunk_staging"""
+
+
+async def _tune_search(conn: Any, candidates: int, *, exact: bool = False) -> None:
+    """Configure the vector searches of the current transaction."""
+    await conn.execute(
+        "SELECT set_config('hnsw.ef_search', $1, true)",
+        str(max(EF_SEARCH, candidates)),
+    )
+    if ITERATIVE_SCAN and ITERATIVE_SCAN != "off":
+        await conn.execute(
+            "SELECT set_config('hnsw.iterative_scan', $1, true)", ITERATIVE_SCAN
+        )
+    if exact:
+        # Without index scans, the namespaces' chunks are read through the
+        # namespace index and sorted by distance.
+        await conn.execute("SELECT set_config('enable_indexscan', 'off', true)")
+
+
+class PGVectorStore(VectorStore):
+    """Chunks of ingested documents, searched by namespace."""
+
+    def __init__(self, embedding: Embeddings) -> None:
+        self.embedding = embedding
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def _records(
+        self,
+        texts: List[str],
+        vectors: List[List[float]],
+        metadatas: Optional[List[dict]],
+        namespace: Optional[str],
+    ) -> Tuple[List[str], List[tuple]]:
+        ids, records = [], []
+        for text, vector, metadata in zip(
+            texts, vectors, metadatas or [{} for _ in texts]
+        ):
+            if (ns := namespace or metadata.get("namespace")) is None:
+                raise ValueError("Chunks must be added to a namespace")
+            ids.append(str(uuid4()))
+            records.append((ids[-1], ns, text, orjson.dumps(metadata).decode(), vector))
+        return ids, records
+
+    async def _embed_query(self, query: str) -> List[float]:
+        key = _normalize(query)
+        if (embedding := query_embedding_cache.get(key)) is None:
+            metrics.inc("query_embedding_cache_misses")
+            embedding = await self.embedding.aembed_query(query)
+            query_embedding_cache.put(key, embedding)
+        else:
+            metrics.inc("query_embedding_cache_hits")
+        return embedding
+
+    async def _insert(self, records: List[tuple]) -> None:
+        namespaces = list({record[1] for record in records})
+        async with get_pg_pool().acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(_CREATE_STAGING)
+                await conn.copy_records_to_table("chunk_staging", records=records)
+                await conn.execute(_INSERT_STAGED)
+                await conn.execute(
+                    "SELECT pg_notify($1, ns) FROM unnest($2::text[]) ns",
+                    CHUNKS_CHANNEL,
+                    namespaces,
+                )
+        # Don't wait for the notification to stop serving stale results here.
+        for namespace in namespaces:
+            _bump_generation(namespace)
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        *,
+        namespace: Optional[str] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        """Embed and store texts, in `namespace` or that of their metadata."""
+        texts = list(texts)
+        vectors = self.embedding.embed_documents(texts)
+        ids, records = self._records(texts, vectors, metadatas, namespace)
+        run_in_loop(self._insert(records))
+        return ids
+
+    async def aadd_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        *,
+        namespace: Optional[str] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        vectors = await self.embedding.aembed_documents(texts)
+        ids, records = self._records(texts, vectors, metadatas, namespace)
+        await self._insert(records)
+        return ids
+
+    async def adelete(
+        self, ids: Optional[List[str]] = None, **kwargs: Any
+    ) -> Optional[bool]:
+        async with get_pg_pool().acquire() as conn:
+            rows = await conn.fetch(
+                """
+                WITH deleted AS (
+                    DELETE FROM chunk WHERE id = ANY($1::uuid[]) RETURNING namespace
+                )
+                SELECT ns, pg_notify($2, ns)
+                FROM (SELECT DISTINCT namespace AS ns FROM deleted) namespaces""",
+                ids,
+                CHUNKS_CHANNEL,
+            )
+        for row in rows:
+            _bump_generation(row["ns"])
+        return True
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        return run_in_loop(self.adelete(ids))
+
+    async def asimilarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        *,
+        namespaces: Sequence[Optional[str]],
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        """Find the `k` chunks of `namespaces` closest to `embedding`."""
+        namespaces = [ns for ns in namespaces if ns]
+        start = time.perf_counter()
+        async with get_pg_pool().acquire() as conn:
+            async with conn.transaction():
+                await _tune_search(conn, k)
+                rows = await conn.fetch(_SEARCH, embedding, namespaces, k)
+                if len(rows) < k:
+                    metrics.inc("exact_vector_searches")
+                    await _tune_search(conn, k, exact=True)
+                    rows = await conn.fetch(_SEARCH, embedding, namespaces, k)
+        metrics.observe("vector_search_seconds", time.perf_counter() - start)
+        return [
+            (
+                Document(page_content=row["content"], metadata=row["metadata"]),
+                row["distance"],
+            )
+            for row in rows
+        ]
+
+    async def asimilarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [
+            doc
+            for doc, _ in await self.asimilarity_search_with_score_by_vector(
+                embedding, k, **kwargs
+            )
+        ]
+
+    async def asimilarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        embedding = await self._embed_query(query)
+        return await self.asimilarity_search_with_score_by_vector(
+            embedding, k, **kwargs
+        )
+
+    async def asimilarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        embedding = await self._embed_query(query)
+        return await self.asimilarity_search_by_vector(embedding, k, **kwargs)
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return run_in_loop(self.asimilarity_search(query, k, **kwargs))
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return run_in_loop(self.asimilarity_search_with_score(query, k, **kwargs))
+
+    async def ahybrid_search(
+        self,
+        query: str,
+        k: int = 4,
+        *,
+        namespaces: Sequence[Optional[str]],
+        vector_weight: float = VECTOR_WEIGHT,
+        lexical_weight: float = LEXICAL_WEIGHT,
+        rrf_k: float = RRF_K,
+    ) -> List[Document]:
+        """Find the `k` chunks of `namespaces` ranking best in either search."""
+        namespaces = sorted({ns for ns in namespaces if ns})
+        key = (
+            tuple((ns, _generation(ns)) for ns in namespaces),
+            _normalize(query),
+            k,
+            vector_weight,
+            lexical_weight,
+            rrf_k,
+        )
+        if (cached := retrieval_cache.get(key)) is not None:
+            metrics.inc("retrieval_cache_hits")
+            return list(cached)
+        metrics.inc("retrieval_cache_misses")
+
+        embedding = await self._embed_query(query)
+        candidates = HYBRID_CANDIDATES * k
+        start = time.perf_counter()
+        args = (
+            embedding,
+            namespaces,
+            query,
+            candidates,
+            vector_weight,
+            lexical_weight,
+            rrf_k,
+            k,
+        )
+        async with get_pg_pool().acquire() as conn:
+            async with conn.transaction():
+                await _tune_search(conn, candidates)
+                rows = await conn.fetch(_HYBRID_SEARCH, *args)
+                if not rows or rows[0]["vector_candidates"] < candidates:
+                    metrics.inc("exact_vector_searches")
+                    await _tune_search(conn, candidates, exact=True)
+                    rows = await conn.fetch(_HYBRID_SEARCH, *args)
+        metrics.observe("hybrid_search_seconds", time.perf_counter() - start)
+        docs = [
+            Document(page_content=row["content"], metadata=row["metadata"])
+            for row in rows
+        ]
+        # Results of a search that raced with a write are stored under the
+        # generation read before it, which the write has already moved past.
+        retrieval_cache.put(key, docs)
+        return list(docs)
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any,
+    ) -> "PGVectorStore":
+        store = cls(embedding)
+        store.add_texts(texts, metadatas, **kwargs)
+        return store
+
+
+class HybridRetriever(BaseRetriever):
+    """Retriever of the chunks of some namespaces by hybrid search."""
+
+    vectorstore: PGVectorStore
+    namespaces: List[Optional[str]]
+    k: int = 4
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return run_in_loop(
+            self.vectorstore.ahybrid_search(query, self.k, namespaces=self.namespaces)
+        )
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return await self.vectorstore.ahybrid_search(
+            query, self.k, namespaces=self.namespaces
+        )
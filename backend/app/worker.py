@@ -0,0 +1,132 @@
+"""Execute queued runs.
+
+Runs are stored in the run table by `POST /runs` and claimed by workers with
+`FOR UPDATE SKIP LOCKED`, so any number of API processes can share the queue.
+Workers are woken by NOTIFY on run creation and fall back to polling, so runs
+queued while no worker was listening are still picked up.
+
+Claimed runs hold a lease that their worker renews while executing them. If
+the worker's process dies, the lease expires and the run is requeued.
+"""
+import asyncio
+import os
+from datetime import timedelta
+from typing import Any
+
+import structlog
+
+from app.agent import agent
+from app.lifespan import add_background_task, add_listener
+from app.message_types import _convert_pydantic_dict_to_message
+from app.schema import Run
+from app.storage import (
+    RUN_CANCEL_CHANNEL,
+    RUNS_CHANNEL,
+    claim_run,
+    finish_run,
+    renew_run_leases,
+    requeue_expired_runs,
+)
+
+logger = structlog.get_logger(__name__)
+
+CONCURRENCY = int(os.environ.get("RUN_WORKER_CONCURRENCY", "4"))
+"""Maximum number of runs executed at once by this process. 0 disables."""
+POLL_INTERVAL = float(os.environ.get("RUN_WORKER_POLL_INTERVAL", "5"))
+"""Seconds between queue polls when no notification arrives."""
+LEASE = timedelta(seconds=float(os.environ.get("RUN_LEASE_SECONDS", "60")))
+"""Time after which a run whose worker stopped renewing its lease is requeued."""
+MAX_ATTEMPTS = int(os.environ.get("RUN_MAX_ATTEMPTS", "3"))
+"""Number of times a run is claimed before it fails for good."""
+
+_wakeup = asyncio.Event()
+_tasks: dict[str, asyncio.Task] = {}
+_cancelled: set[str] = set()
+
+
+def _on_run_created(_payload: str) -> None:
+    _wakeup.set()
+
+
+def _on_run_cancelled(run_id: str) -> None:
+    if task := _tasks.get(run_id):
+        _cancelled.add(run_id)
+        task.cancel()
+
+
+def _revive_input(input: Any) -> Any:
+    if isinstance(input, list):
+        return [_convert_pydantic_dict_to_message(m) for m in input]
+    if isinstance(input, dict) and isinstance(input.get("messages"), list):
+        return {**input, "messages": _revive_input(input["messages"])}
+    return input
+
+
+async def _execute(run: Run) -> None:
+    run_id = str(run["run_id"])
+    try:
+        await agent.ainvoke(_revive_input(run["input"]), run["config"])
+    except asyncio.CancelledError:
+        if run_id not in _cancelled:
+            # Cancelled by shutdown rather than by the user.
+            await asyncio.shield(finish_run(run_id, "error", "worker shut down"))
+            raise
+    except Exception as e:
+        logger.warn("run failed", run_id=run_id, exc_info=True)
+        await finish_run(run_id, "error", str(e))
+    else:
+        await finish_run(run_id, "success")
+    finally:
+        _tasks.pop(run_id, None)
+        _cancelled.discard(run_id)
+
+
+async def run_worker() -> None:
+    """Claim and execute pending runs until cancelled."""
+    if CONCURRENCY <= 0:
+        return
+    slots = asyncio.Semaphore(CONCURRENCY)
+    try:
+        while True:
+            await slots.acquire()
+            _wakeup.clear()
+            try:
+                run = await claim_run(LEASE)
+            except Exception:
+                logger.warn("failed to claim run", exc_info=True)
+                run = None
+            if run is None:
+                slots.release()
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(_execute(run))
+            task.add_done_callback(lambda _: slots.release())
+            _tasks[str(run["run_id"])] = task
+    finally:
+        for task in list(_tasks.values()):
+            task.cancel()
+        await asyncio.gather(*_tasks.values(), return_exceptions=True)
+
+
+async def renew_leases() -> None:
+    """Renew the leases of executing runs and requeue expired ones until cancelled."""
+    if CONCURRENCY <= 0:
+        return
+    while True:
+        await asyncio.sleep(LEASE.total_seconds() / 3)
+        try:
+            if _tasks:
+                await renew_run_leases(list(_tasks), LEASE)
+            if requeued := await requeue_expired_runs(MAX_ATTEMPTS, LEASE):
+                logger.warn("requeued runs with expired leases", count=requeued)
+        except Exception:
+            logger.warn("failed to renew run leases", exc_info=True)
+
+
+add_listener(RUNS_CHANNEL, _on_run_created)
+add_listener(RUN_CANCEL_CHANNEL, _on_run_cancelled)
+add_background_task(run_worker)
+add_background_task(renew_leases)
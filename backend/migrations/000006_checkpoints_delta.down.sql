@@ -0,0 +1,5 @@
+-- Delta rows cannot be read without their parents; drop them before the column.
+DELETE FROM checkpoints WHERE delta;
+
+ALTER TABLE checkpoints
+    DROP COLUMN IF EXISTS delta;
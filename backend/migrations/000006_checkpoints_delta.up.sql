@@ -0,0 +1,2 @@
+ALTER TABLE checkpoints
+    ADD COLUMN IF NOT EXISTS delta BOOLEAN NOT NULL DEFAULT false;
@@ -0,0 +1,15 @@
+CREATE TABLE IF NOT EXISTS run (
+    run_id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    thread_id UUID NOT NULL REFERENCES thread(thread_id) ON DELETE CASCADE,
+    assistant_id UUID REFERENCES assistant(assistant_id) ON DELETE SET NULL,
+    project_id UUID NOT NULL,
+    input JSONB,
+    config JSONB NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC'),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC')
+);
+
+CREATE INDEX IF NOT EXISTS run_pending_idx ON run (created_at) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS run_thread_id_idx ON run (thread_id);
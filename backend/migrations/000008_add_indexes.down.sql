@@ -0,0 +1,7 @@
+DROP INDEX IF EXISTS assistant_token_price_agent_type_idx;
+DROP INDEX IF EXISTS user_stripe_client_id_idx;
+DROP INDEX IF EXISTS project_user_id_name_idx;
+DROP INDEX IF EXISTS assistant_public_idx;
+DROP INDEX IF EXISTS assistant_project_id_updated_at_idx;
+DROP INDEX IF EXISTS thread_assistant_id_idx;
+DROP INDEX IF EXISTS thread_project_id_updated_at_idx;
@@ -0,0 +1,15 @@
+CREATE INDEX IF NOT EXISTS thread_project_id_updated_at_idx
+    ON thread (project_id, updated_at DESC);
+CREATE INDEX IF NOT EXISTS thread_assistant_id_idx ON thread (assistant_id);
+
+CREATE INDEX IF NOT EXISTS assistant_project_id_updated_at_idx
+    ON assistant (project_id, updated_at DESC);
+CREATE INDEX IF NOT EXISTS assistant_public_idx
+    ON assistant (updated_at DESC) WHERE public IS true;
+
+CREATE INDEX IF NOT EXISTS project_user_id_name_idx ON "project" (user_id, name);
+
+CREATE INDEX IF NOT EXISTS user_stripe_client_id_idx ON "user" (stripe_client_id);
+
+CREATE INDEX IF NOT EXISTS assistant_token_price_agent_type_idx
+    ON "assistant_token_price" (agent_type);
@@ -0,0 +1 @@
+DROP TABLE IF EXISTS stripe_event;
@@ -0,0 +1,4 @@
+CREATE TABLE IF NOT EXISTS stripe_event (
+    event_id VARCHAR(255) PRIMARY KEY,
+    received_at TIMESTAMP WITH TIME ZONE DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC')
+);
@@ -0,0 +1,2 @@
+DROP TABLE IF EXISTS ingest_file;
+DROP TABLE IF EXISTS ingest_job;
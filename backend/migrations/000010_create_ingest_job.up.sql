@@ -0,0 +1,23 @@
+CREATE TABLE IF NOT EXISTS ingest_job (
+    job_id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    project_id UUID NOT NULL,
+    config JSONB NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    files_total INT NOT NULL,
+    files_done INT NOT NULL DEFAULT 0,
+    chunks_done INT NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC'),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC')
+);
+
+CREATE INDEX IF NOT EXISTS ingest_job_pending_idx ON ingest_job (created_at) WHERE status = 'pending';
+
+CREATE TABLE IF NOT EXISTS ingest_file (
+    job_id UUID NOT NULL REFERENCES ingest_job(job_id) ON DELETE CASCADE,
+    position INT NOT NULL,
+    file_name TEXT NOT NULL,
+    mime_type TEXT NOT NULL,
+    data BYTEA NOT NULL,
+    PRIMARY KEY (job_id, position)
+);
@@ -0,0 +1,2 @@
+DROP TABLE IF EXISTS ingested_blob;
+DROP TABLE IF EXISTS embedding_cache;
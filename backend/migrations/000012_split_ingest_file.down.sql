@@ -0,0 +1,10 @@
+ALTER TABLE ingest_file ADD COLUMN data BYTEA NOT NULL DEFAULT '';
+
+UPDATE ingest_file f SET data = COALESCE((
+    SELECT string_agg(p.data, ''::bytea ORDER BY p.part) FROM ingest_file_part p
+    WHERE p.job_id = f.job_id AND p.position = f.position
+), '');
+
+ALTER TABLE ingest_file ALTER COLUMN data DROP DEFAULT;
+
+DROP TABLE IF EXISTS ingest_file_part;
@@ -0,0 +1,13 @@
+CREATE TABLE IF NOT EXISTS ingest_file_part (
+    job_id UUID NOT NULL,
+    position INT NOT NULL,
+    part INT NOT NULL,
+    data BYTEA NOT NULL,
+    PRIMARY KEY (job_id, position, part),
+    FOREIGN KEY (job_id, position) REFERENCES ingest_file(job_id, position) ON DELETE CASCADE
+);
+
+INSERT INTO ingest_file_part (job_id, position, part, data)
+SELECT job_id, position, 0, data FROM ingest_file;
+
+ALTER TABLE ingest_file DROP COLUMN data;
@@ -0,0 +1,27 @@
+-- 1536 dimensions, those of the OpenAI embedding models.
+CREATE TABLE IF NOT EXISTS chunk (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    namespace TEXT NOT NULL,
+    content TEXT NOT NULL,
+    metadata JSONB NOT NULL DEFAULT '{}',
+    embedding vector(1536) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC')
+);
+
+CREATE INDEX IF NOT EXISTS chunk_namespace_idx ON chunk (namespace);
+CREATE INDEX IF NOT EXISTS chunk_embedding_idx ON chunk
+    USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);
+
+-- Carry over the chunks stored by the langchain PGVector store.
+DO $$
+BEGIN
+    IF to_regclass('langchain_pg_embedding') IS NOT NULL THEN
+        INSERT INTO chunk (id, namespace, content, metadata, embedding)
+        SELECT uuid, cmetadata::jsonb ->> 'namespace', document, cmetadata::jsonb, embedding
+        FROM langchain_pg_embedding
+        WHERE cmetadata::jsonb ? 'namespace'
+            AND document IS NOT NULL
+            AND vector_dims(embedding) = 1536
+        ON CONFLICT DO NOTHING;
+    END IF;
+END $$;
@@ -0,0 +1,2 @@
+DROP INDEX IF EXISTS chunk_content_tsv_idx;
+ALTER TABLE chunk DROP COLUMN IF EXISTS content_tsv;
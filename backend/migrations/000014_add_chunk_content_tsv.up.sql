@@ -0,0 +1,4 @@
+ALTER TABLE chunk ADD COLUMN IF NOT EXISTS content_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', content)) STORED;
+
+CREATE INDEX IF NOT EXISTS chunk_content_tsv_idx ON chunk USING gin (content_tsv);
@@ -0,0 +1,4 @@
+DROP INDEX IF EXISTS run_running_idx;
+ALTER TABLE run
+    DROP COLUMN IF EXISTS lease_expires_at,
+    DROP COLUMN IF EXISTS attempts;
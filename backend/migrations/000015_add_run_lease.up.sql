@@ -0,0 +1,5 @@
+ALTER TABLE run
+    ADD COLUMN IF NOT EXISTS attempts INT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE;
+
+CREATE INDEX IF NOT EXISTS run_running_idx ON run (updated_at) WHERE status = 'running';
@@ -0,0 +1,4 @@
+DROP INDEX IF EXISTS ingest_job_running_idx;
+ALTER TABLE ingest_job
+    DROP COLUMN IF EXISTS lease_expires_at,
+    DROP COLUMN IF EXISTS attempts;
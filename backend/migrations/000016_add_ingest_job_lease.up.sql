@@ -0,0 +1,5 @@
+ALTER TABLE ingest_job
+    ADD COLUMN IF NOT EXISTS attempts INT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE;
+
+CREATE INDEX IF NOT EXISTS ingest_job_running_idx ON ingest_job (updated_at) WHERE status = 'running';
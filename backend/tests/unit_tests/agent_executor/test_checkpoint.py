@@ -0,0 +1,48 @@
+"""Test delta encoding and caching of checkpoints."""
+from datetime import datetime, timezone
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from app.checkpoint import DELTAS_KEY, CheckpointCache, _apply, _diff, _Latest
+
+
+def _checkpoint(messages: list) -> dict:
+    return {"v": 1, "ts": "", "channel_values": {"__root__": messages, "n": 1}}
+
+
+def test_delta_roundtrip() -> None:
+    first = [HumanMessage(content="hi", id="1")]
+    parent = _checkpoint(first)
+    child = _checkpoint(first + [AIMessage(content="hello", id="2")])
+
+    delta = _diff(parent, child)
+    assert delta[DELTAS_KEY] == {"__root__": 1}
+    assert delta["channel_values"]["__root__"] == [AIMessage(content="hello", id="2")]
+    assert _apply(parent, delta) == child
+
+
+def test_rewritten_history_is_stored_in_full() -> None:
+    parent = _checkpoint([HumanMessage(content="hi", id="1")])
+    child = _checkpoint([HumanMessage(content="edited", id="1")])
+    assert _diff(parent, child) is None
+
+
+def test_cache_is_bounded_by_bytes() -> None:
+    cache = CheckpointCache(max_threads=10, max_bytes=100)
+    now = datetime.now(timezone.utc)
+    cache.put("a", _Latest(now, None, _checkpoint([]), 0, 60))
+    cache.put("b", _Latest(now, None, _checkpoint([]), 0, 60))
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+    assert cache.bytes == 60
+
+    # Notifications from other processes evict the thread.
+    cache.on_notify("other-process:b")
+    assert cache.get("b") is None
+    assert cache.bytes == 0
+
+    # Everything is dropped when notifications may have been missed.
+    cache.put("c", _Latest(now, None, _checkpoint([]), 0, 60))
+    cache.clear()
+    assert cache.get("c") is None
+    assert cache.bytes == 0
@@ -0,0 +1,59 @@
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
+
+from app.context_packing import count_tokens, pack_documents, trim_history
+
+TEXT = " ".join(f"Sentence number {i} of the manual." for i in range(40))
+
+
+def test_overlapping_chunks_are_merged() -> None:
+    """Test that chunks split with overlap are joined back, once."""
+    first, second = TEXT[:700], TEXT[500:]
+    docs = [
+        Document(page_content=second, metadata={"source": "manual.txt"}),
+        Document(page_content=first, metadata={"source": "manual.txt"}),
+        Document(page_content=first, metadata={"source": "manual.txt"}),
+    ]
+    assert [d.page_content for d in pack_documents(docs, 10_000)] == [TEXT]
+
+
+def test_chunks_of_other_sources_are_kept_apart() -> None:
+    docs = [
+        Document(page_content=TEXT[:700], metadata={"source": "a.txt"}),
+        Document(page_content=TEXT[500:], metadata={"source": "b.txt"}),
+    ]
+    assert len(pack_documents(docs, 10_000)) == 2
+
+
+def test_packing_respects_the_budget() -> None:
+    docs = [
+        Document(page_content=f"Chunk {i}: " + "lorem ipsum " * 50) for i in range(10)
+    ]
+    packed = pack_documents(docs, 300)
+    assert 0 < len(packed) < 10
+    assert sum(count_tokens(d.page_content) for d in packed) <= 300
+    # The best chunk is truncated rather than dropped.
+    assert count_tokens(pack_documents(docs, 20)[0].page_content) <= 20
+
+
+def test_history_is_trimmed_from_the_start() -> None:
+    history = [
+        HumanMessage(content="hello " * 100),
+        AIMessage(content="hi " * 100),
+        HumanMessage(content="What is the refund policy?"),
+    ]
+    assert trim_history(history, 50) == history[-1:]
+    assert trim_history(history, 10_000) == history
+
+
+def test_trimmed_history_starts_with_a_human_message() -> None:
+    history = [
+        HumanMessage(content="hello " * 100),
+        AIMessage(content="hi"),
+        HumanMessage(content="What is the refund policy?"),
+        AIMessage(content="Refunds are accepted within 30 days. " * 20),
+    ]
+    # The cut falls on an AI message, which is dropped.
+    assert trim_history(history, 200) == history[2:]
+    # Over budget, the last human message and the answer are still kept.
+    assert trim_history(history, 10) == history[2:]
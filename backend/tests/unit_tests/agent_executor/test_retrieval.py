@@ -0,0 +1,19 @@
+import pytest
+
+from app.retrieval import _is_standalone
+
+
+@pytest.mark.parametrize(
+    "question, standalone",
+    [
+        ("How do I reset my password on the dashboard?", True),
+        ("What is the refund policy for annual plans?", True),
+        ("Why?", False),
+        ("Can you explain that in more detail?", False),
+        ("What about the enterprise plan?", False),
+        ("And how long does shipping take?", False),
+        ("How much does it cost?", False),
+    ],
+)
+def test_is_standalone(question: str, standalone: bool) -> None:
+    assert _is_standalone(question) is standalone
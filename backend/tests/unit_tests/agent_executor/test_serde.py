@@ -0,0 +1,56 @@
+"""Test the checkpoint codec."""
+import pickle
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
+
+from app.message_types import LiberalToolMessage
+from app import metrics
+from app.serde import HEADER, CheckpointSerializer
+
+
+def _checkpoint() -> dict:
+    return {
+        "v": 1,
+        "ts": "2024-05-01T10:00:00+00:00",
+        "channel_values": {
+            "messages": [
+                HumanMessage(content="hi", id="1"),
+                AIMessage(
+                    content="",
+                    id="2",
+                    tool_calls=[{"id": "c1", "name": "retrieval", "args": {"q": "x"}}],
+                ),
+                LiberalToolMessage(
+                    content=[Document(page_content="doc", metadata={"a": 1})],
+                    tool_call_id="c1",
+                    id="3",
+                ),
+            ],
+            "msg_count": 2,
+        },
+        "channel_versions": {"messages": 3},
+        "versions_seen": {"agent": {"messages": 2}},
+    }
+
+
+def test_roundtrip() -> None:
+    serde = CheckpointSerializer()
+    data = serde.dumps(_checkpoint())
+    assert data.startswith(HEADER)
+    assert serde.loads(data) == _checkpoint()
+
+
+def test_unencodable_checkpoint_falls_back_to_pickle() -> None:
+    serde = CheckpointSerializer()
+    checkpoint = {**_checkpoint(), "channel_values": {"value": complex(1, 2)}}
+    fallbacks = metrics.snapshot().get("checkpoint_pickle_fallbacks", 0)
+    data = serde.dumps(checkpoint)
+    assert not data.startswith(HEADER)
+    assert serde.loads(data) == checkpoint
+    assert metrics.snapshot()["checkpoint_pickle_fallbacks"] == fallbacks + 1
+
+
+def test_reads_legacy_pickle() -> None:
+    serde = CheckpointSerializer()
+    assert serde.loads(pickle.dumps(_checkpoint())) == _checkpoint()
@@ -0,0 +1,153 @@
+"""Test the SSE stream protocol."""
+import asyncio
+
+import orjson
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+
+from app.stream import (
+    ReplayBuffer,
+    _produce,
+    astream_state,
+    cancel_detached,
+    detached_sse,
+    resume_sse,
+    to_sse,
+)
+
+
+async def _messages():
+    yield "run-1"
+    yield [AIMessage(content="hello", id="1")]
+    yield [AIMessage(content="hello world", id="1")]
+
+
+async def test_resume_after_last_event_id() -> None:
+    events = [e async for e in detached_sse(_messages(), "project")]
+    # The first snapshot of the message was replaced by the second.
+    assert [e["event"] for e in events] == ["metadata", "data", "end"]
+    assert [e["id"] for e in events] == ["run-1:0", "run-1:2", "run-1:3"]
+    assert orjson.loads(events[1]["data"])[0]["content"] == "hello world"
+
+    resumed = resume_sse(events[0]["id"], "project")
+    assert [e async for e in resumed] == events[1:]
+    assert resume_sse(events[0]["id"], "other project") is None
+
+
+async def test_resume_after_evicted_events() -> None:
+    buffer = ReplayBuffer("project", maxlen=2)
+    for i in range(4):
+        await buffer.append({"event": "data", "data": str(i)})
+    await buffer.close()
+
+    assert [e["data"] async for e in buffer.subscribe(1)] == ["2", "3"]
+    events = [e async for e in buffer.subscribe(0)]
+    assert [e["event"] for e in events] == ["error", "end"]
+    assert orjson.loads(events[0]["data"])["status_code"] == 409
+
+
+async def test_resume_after_evicted_deltas() -> None:
+    async def _deltas():
+        yield "run-4"
+        for content in ["hel", "lo", " wor", "ld"]:
+            yield {"id": "1", "content": content, "tool_call_chunks": []}
+
+    buffer = ReplayBuffer("project", maxlen=3)
+    await _produce(buffer, _deltas())
+
+    # The deltas the client missed were dropped, so it gets the whole message.
+    events = [e async for e in buffer.subscribe(0)]
+    assert [e["event"] for e in events] == ["data", "end"]
+    assert events[0]["id"] == "run-4:4"
+    assert orjson.loads(events[0]["data"])[0]["content"] == "hello world"
+
+    events = [e async for e in buffer.subscribe(3)]
+    assert [e["event"] for e in events] == ["delta", "end"]
+    assert orjson.loads(events[0]["data"])["content"] == "ld"
+
+
+async def test_cancel_detached() -> None:
+    started = asyncio.Event()
+
+    async def _slow():
+        yield "run-3"
+        started.set()
+        await asyncio.sleep(60)
+        yield [AIMessage(content="too late", id="1")]
+
+    events = detached_sse(_slow(), "project")
+    first = await events.__anext__()
+    await started.wait()
+    assert not cancel_detached("run-3", "other project")
+    assert cancel_detached("run-3", "project")
+
+    assert first["event"] == "metadata"
+    assert [e["event"] async for e in events] == ["end"]
+
+
+async def test_deltas() -> None:
+    async def _deltas():
+        yield "run-2"
+        yield {"id": "1", "content": "hel", "tool_call_chunks": []}
+        yield {"id": "1", "content": "lo", "tool_call_chunks": []}
+        yield [AIMessage(content="hello", id="1")]
+
+    events = [e async for e in to_sse(_deltas())]
+    assert [e["event"] for e in events] == ["metadata", "delta", "delta", "data", "end"]
+    assert orjson.loads(events[2]["data"])["content"] == "lo"
+
+
+class _FakeApp:
+    """Runnable replaying a fixed list of events."""
+
+    def __init__(self, events: list) -> None:
+        self.events = events
+
+    async def astream_events(self, input, config, **kwargs):
+        for event in self.events:
+            yield event
+
+
+_EVENTS = [
+    {"event": "on_chain_start", "run_id": "run-3", "data": {}},
+    {
+        "event": "on_chat_model_stream",
+        "run_id": "llm",
+        "data": {"chunk": AIMessageChunk(content="hel", id="1")},
+    },
+    {
+        "event": "on_chat_model_stream",
+        "run_id": "llm",
+        "data": {"chunk": AIMessageChunk(content="lo", id="1")},
+    },
+    {
+        "event": "on_chain_stream",
+        "run_id": "run-3",
+        "data": {
+            "chunk": [
+                HumanMessage(content="hi", id="0"),
+                AIMessage(content="hello", id="1"),
+            ]
+        },
+    },
+]
+
+
+async def test_astream_state_deltas() -> None:
+    chunks = [c async for c in astream_state(_FakeApp(_EVENTS), [], {}, deltas=True)]
+    assert chunks[0] == "run-3"
+    assert chunks[1:3] == [
+        {"id": "1", "content": "hel", "tool_call_chunks": []},
+        {"id": "1", "content": "lo", "tool_call_chunks": []},
+    ]
+    assert [m.content for m in chunks[3]] == ["hi", "hello"]
+
+    events = [
+        e async for e in to_sse(astream_state(_FakeApp(_EVENTS), [], {}, deltas=True))
+    ]
+    assert [e["event"] for e in events] == ["metadata", "delta", "delta", "data", "end"]
+
+
+async def test_astream_state_accumulates_without_deltas() -> None:
+    chunks = [c async for c in astream_state(_FakeApp(_EVENTS), [], {})]
+    assert [m.content for m in chunks[1]] == ["hel"]
+    assert [m.content for m in chunks[2]] == ["hello"]
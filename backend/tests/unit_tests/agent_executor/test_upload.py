@@ -1,8 +1,15 @@
 from io import BytesIO
 
+import pytest
+
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from fastapi import UploadFile
-from app.upload import IngestRunnable, _guess_mimetype, convert_ingestion_input_to_blob
+from langchain_core.document_loaders.blob_loaders import Blob
+from langchain_core.documents import Document
+from fastapi import HTTPException, UploadFile
+from langchain_openai import AzureOpenAIEmbeddings, OpenAIEmbeddings
+from app.embedding_cache import embedding_model_name
+from app.ingest import _AdaptiveLimiter, _add_documents
+from app.upload import IngestRunnable, guess_file_mimetype, read_upload
 from tests.unit_tests.fixtures import get_sample_paths
 from tests.unit_tests.utils import InMemoryVectorStore
 
@@ -17,24 +24,64 @@ def test_ingestion_runnable() -> None:
         input_key="file_contents",
         assistant_id="TheParrot",
     )
-    # Simulate file data
-    file_data = BytesIO(b"test data")
-    file_data.seek(0)
-    # Create UploadFile object
-    file = UploadFile(filename="testfile.txt", file=file_data)
-
-    # Convert the file to blob
-    blob = convert_ingestion_input_to_blob(file)
+    blob = Blob.from_data(
+        b"test data", mime_type="text/plain", metadata={"source": "testfile.txt"}
+    )
+    assert blob.source == "testfile.txt"
     ids = runnable.invoke(blob)
     assert len(ids) == 1
 
 
+class _InMemoryRegistry:
+    def __init__(self) -> None:
+        self.blobs: set = set()
+
+    def contains(self, namespace: str, digest: bytes) -> bool:
+        return (namespace, digest) in self.blobs
+
+    def add(self, namespace: str, digest: bytes, chunks: int) -> None:
+        self.blobs.add((namespace, digest))
+
+
+def test_ingestion_skips_duplicate_blobs() -> None:
+    """Test that a blob is only ingested once per namespace."""
+    vectorstore = InMemoryVectorStore()
+    runnable = IngestRunnable(
+        text_splitter=RecursiveCharacterTextSplitter(),
+        vectorstore=vectorstore,
+        assistant_id="TheParrot",
+        blob_registry=_InMemoryRegistry(),
+    )
+    blob = Blob.from_data(
+        b"test data", mime_type="text/plain", metadata={"source": "testfile.txt"}
+    )
+    assert len(runnable.invoke(blob)) == 1
+    assert runnable.invoke(blob) == []
+    assert len(vectorstore.store) == 1
+
+
+def test_embedding_model_name() -> None:
+    openai = OpenAIEmbeddings(model="text-embedding-3-small", openai_api_key="x")
+    assert embedding_model_name(openai) == "OpenAIEmbeddings:text-embedding-3-small"
+    openai = OpenAIEmbeddings(
+        model="text-embedding-3-small", dimensions=256, openai_api_key="x"
+    )
+    assert embedding_model_name(openai) == "OpenAIEmbeddings:text-embedding-3-small:256"
+    azure = AzureOpenAIEmbeddings(
+        azure_endpoint="https://example.openai.azure.com",
+        azure_deployment="embeddings",
+        openai_api_key="x",
+        openai_api_version="2024-02-01",
+    )
+    assert embedding_model_name(azure).endswith(":embeddings")
+
+
 def test_mimetype_guessing() -> None:
     """Verify mimetype guessing for all fixtures."""
     name_to_mime = {}
     for file in sorted(get_sample_paths()):
-        data = file.read_bytes()
-        name_to_mime[file.name] = _guess_mimetype(file.name, data)
+        with file.open("rb") as f:
+            name_to_mime[file.name] = guess_file_mimetype(file.name, f)
 
     assert {
         "sample.docx": (
@@ -47,3 +94,36 @@ def test_mimetype_guessing() -> None:
         "sample.rtf": "application/rtf",
         "sample.txt": "text/plain",
     } == name_to_mime
+
+
+async def test_oversized_upload_is_rejected(monkeypatch) -> None:
+    """Test that files over the size limit are rejected while reading."""
+    monkeypatch.setattr("app.upload.MAX_FILE_BYTES", 4)
+    file = UploadFile(filename="testfile.txt", file=BytesIO(b"test data"))
+    with pytest.raises(HTTPException):
+        async for _ in read_upload(file):
+            pass
+
+
+def test_rate_limited_batches_are_retried(monkeypatch) -> None:
+    """Test that a 429 halves the concurrency and the batch is retried."""
+
+    class RateLimitError(Exception):
+        status_code = 429
+
+    class FlakyVectorStore(InMemoryVectorStore):
+        calls = 0
+
+        def add_documents(self, documents, **kwargs):
+            self.calls += 1
+            if self.calls == 1:
+                raise RateLimitError()
+            return super().add_documents(documents, **kwargs)
+
+    monkeypatch.setattr("app.ingest.time.sleep", lambda _: None)
+    vectorstore = FlakyVectorStore()
+    limiter = _AdaptiveLimiter(4)
+    docs = [Document(page_content="a"), Document(page_content="b")]
+    assert len(_add_documents(vectorstore, docs, limiter, max_retries=2)) == 2
+    assert vectorstore.calls == 2
+    assert limiter.limit == 3
@@ -58,6 +58,11 @@ async def test_list_and_create_assistants(pool: asyncpg.pool.Pool) -> None:
                 "public": False,
             }
         ]
+        etag = response.headers["ETag"]
+        response = await client.get(
+            "/assistants/", headers={**headers, "If-None-Match": etag}
+        )
+        assert response.status_code == 304
 
         response = await client.put(
             f"/assistants/{aid}",
@@ -72,6 +77,13 @@ async def test_list_and_create_assistants(pool: asyncpg.pool.Pool) -> None:
             "public": False,
         }
 
+        # Updating the assistant changes the ETag.
+        response = await client.get(
+            "/assistants/", headers={**headers, "If-None-Match": etag}
+        )
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
         # Check not visible to other users
         headers = {"Cookie": "opengpts_user_id=2"}
         response = await client.get("/assistants/", headers=headers)
@@ -107,6 +119,11 @@ async def test_threads() -> None:
         assert response.status_code == 200
         assert response.json() == {"values": None, "next": []}
 
+        response = await client.get(
+            f"/threads/{tid}/history", params={"before": "yesterday"}, headers=headers
+        )
+        assert response.status_code == 422
+
         response = await client.get("/threads/", headers=headers)
 
         assert response.status_code == 200
@@ -126,3 +143,21 @@ async def test_threads() -> None:
             headers={"Cookie": "opengpts_user_id=2"},
         )
         assert response.status_code == 422
+
+
+async def test_metrics_require_token(monkeypatch) -> None:
+    """The metrics endpoint is disabled unless a token is configured."""
+    import app.server
+
+    async with get_client() as client:
+        monkeypatch.setattr(app.server, "METRICS_TOKEN", None)
+        response = await client.get("/metrics")
+        assert response.status_code == 404
+
+        monkeypatch.setattr(app.server, "METRICS_TOKEN", "secret")
+        response = await client.get("/metrics")
+        assert response.status_code == 401
+        response = await client.get(
+            "/metrics", headers={"Authorization": "Bearer secret"}
+        )
+        assert response.status_code == 200
@@ -0,0 +1,27 @@
+"""Test the authentication caches."""
+import time
+
+from app.auth.cache import cache_token, token_cache, token_key
+from app.cache import TTLCache
+
+
+def test_ttl_cache_expires_and_evicts() -> None:
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2, ttl=-1)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    cache.put("c", 3)
+    cache.put("d", 4)
+    assert cache.get("a") is None
+    cache.invalidate("c")
+    assert cache.get("c") is None
+    assert cache.get("d") == 4
+
+
+def test_token_cached_until_expiry() -> None:
+    valid = {"user_id": "1", "exp": time.time() + 60}
+    cache_token("expired", {"user_id": "1", "exp": time.time() - 1})
+    cache_token("valid", valid)
+    assert token_cache.get(token_key("expired")) is None
+    assert token_cache.get(token_key("valid")) == valid
@@ -0,0 +1,71 @@
+"""Test reading checkpoints back from the database."""
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from uuid import uuid4
+
+import asyncpg
+from langchain_core.messages import AIMessage, HumanMessage
+
+from app.checkpoint import PostgresCheckpoint
+
+
+def _checkpoint(ts: datetime, parent_ts: Optional[datetime], messages: list) -> dict:
+    return {
+        "v": 1,
+        "ts": ts.isoformat(),
+        "parent_ts": parent_ts.isoformat() if parent_ts else None,
+        "channel_values": {"__root__": messages},
+        "channel_versions": {},
+        "versions_seen": {},
+    }
+
+
+async def test_historical_read_is_not_cached_as_latest(
+    pool: asyncpg.pool.Pool,
+) -> None:
+    saver = PostgresCheckpoint(snapshot_interval=4)
+    config = {"configurable": {"thread_id": str(uuid4())}}
+    first = datetime.now(timezone.utc)
+    second = first + timedelta(seconds=1)
+    messages = [HumanMessage(content="hi", id="1")]
+    await saver.aput(config, _checkpoint(first, None, messages))
+    messages = messages + [AIMessage(content="hello", id="2")]
+    await saver.aput(config, _checkpoint(second, first, messages))
+    saver.cache.clear()
+
+    historical = {
+        "configurable": {**config["configurable"], "thread_ts": first.isoformat()}
+    }
+    old = await saver.aget_tuple(historical)
+    assert old.checkpoint["channel_values"]["__root__"] == messages[:1]
+
+    latest = await saver.aget_tuple(config)
+    assert latest.config["configurable"]["thread_ts"] == second
+    assert latest.checkpoint["channel_values"]["__root__"] == messages
+    assert saver.cache.get(config["configurable"]["thread_id"]).thread_ts == second
+
+
+async def test_metadata_history_is_limited(pool: asyncpg.pool.Pool) -> None:
+    saver = PostgresCheckpoint()
+    thread_id = str(uuid4())
+    config = {"configurable": {"thread_id": thread_id}}
+    start = datetime.now(timezone.utc)
+    parent_ts = None
+    for i in range(3):
+        ts = start + timedelta(seconds=i)
+        await saver.aput(config, _checkpoint(ts, parent_ts, []))
+        parent_ts = ts
+
+    # Thread history passes its arguments as configurable keys.
+    history = {
+        "configurable": {
+            "thread_id": thread_id,
+            "history_before": parent_ts,
+            "history_limit": 1,
+        }
+    }
+    listed = [c async for c in saver.alist_metadata(history)]
+    assert [c["config"]["configurable"]["thread_ts"] for c in listed] == [
+        start + timedelta(seconds=1)
+    ]
+    assert listed[0]["parent"]["configurable"]["thread_ts"] == start
@@ -0,0 +1,88 @@
+"""Test pruning of the checkpoints table."""
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import asyncpg
+from langchain_core.messages import HumanMessage
+
+from app.checkpoint import PostgresCheckpoint
+from app.compaction import RetentionPolicy, compact_checkpoints
+
+
+async def _create_thread(pool: asyncpg.pool.Pool) -> str:
+    async with pool.acquire() as conn:
+        project_id = await conn.fetchval(
+            'INSERT INTO "project" (name) VALUES ($1) RETURNING project_id', "test"
+        )
+        return await conn.fetchval(
+            "INSERT INTO thread (project_id, name) VALUES ($1, $2) RETURNING thread_id",
+            project_id,
+            "test",
+        )
+
+
+async def _write_history(saver: PostgresCheckpoint, thread_id: str, n: int) -> list:
+    """Write `n` checkpoints two days old, a second apart, in the same hour."""
+    start = datetime.now(timezone.utc).replace(minute=10) - timedelta(days=2)
+    config = {"configurable": {"thread_id": thread_id}}
+    timestamps, messages, parent_ts = [], [], None
+    for i in range(n):
+        ts = start + timedelta(seconds=i)
+        messages = messages + [HumanMessage(content=str(i), id=str(i))]
+        await saver.aput(
+            config,
+            {
+                "v": 1,
+                "ts": ts.isoformat(),
+                "parent_ts": parent_ts.isoformat() if parent_ts else None,
+                "channel_values": {"__root__": messages},
+                "channel_versions": {},
+                "versions_seen": {},
+            },
+        )
+        timestamps.append(ts)
+        parent_ts = ts
+    return timestamps
+
+
+async def test_pruning_keeps_delta_chains(pool: asyncpg.pool.Pool) -> None:
+    saver = PostgresCheckpoint(snapshot_interval=4)
+    thread_id = await _create_thread(pool)
+    timestamps = await _write_history(saver, thread_id, 10)
+    oldest_kept = {
+        "configurable": {"thread_id": thread_id, "thread_ts": timestamps[7].isoformat()}
+    }
+    latest = {"configurable": {"thread_id": thread_id}}
+    saver.cache.clear()
+    before = [await saver.aget_tuple(oldest_kept), await saver.aget_tuple(latest)]
+
+    policy = RetentionPolicy(keep_last=3, keep_all_for=timedelta(0))
+    stats = await compact_checkpoints(pool, policy)
+
+    # Rows 0-3 are pruned. The kept delta rows 7 down to 5 need the snapshot
+    # at row 4 to be rebuilt, so it is kept too.
+    assert stats.rows == 4
+    assert stats.orphan_threads == 0
+    async with pool.acquire() as conn:
+        kept = await conn.fetch(
+            "SELECT thread_ts FROM checkpoints WHERE thread_id = $1 ORDER BY thread_ts",
+            thread_id,
+        )
+    assert [r[0] for r in kept] == timestamps[4:]
+
+    saver.cache.clear()
+    after = [await saver.aget_tuple(oldest_kept), await saver.aget_tuple(latest)]
+    assert [t.checkpoint for t in after] == [t.checkpoint for t in before]
+    assert after[1].config == before[1].config
+
+
+async def test_checkpoints_of_deleted_threads_are_dropped(
+    pool: asyncpg.pool.Pool,
+) -> None:
+    saver = PostgresCheckpoint()
+    await _write_history(saver, str(uuid4()), 3)
+
+    stats = await compact_checkpoints(pool, RetentionPolicy())
+
+    assert stats.rows == 3
+    assert stats.orphan_threads == 1
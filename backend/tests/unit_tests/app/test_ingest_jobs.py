@@ -0,0 +1,84 @@
+"""Test the ingestion job queue."""
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from uuid import uuid4
+
+import asyncpg
+
+from app import storage
+
+
+async def _running_job(
+    conn: asyncpg.Connection,
+    project_id: str,
+    lease_expires_at: Optional[datetime],
+    updated_at: datetime,
+) -> str:
+    # Inserted as already claimed, so the app's own workers leave it alone.
+    job_id = await conn.fetchval(
+        "INSERT INTO ingest_job (project_id, config, files_total, status, attempts, "
+        "lease_expires_at, updated_at) VALUES ($1, $2, 1, 'running', 1, $3, $4) "
+        "RETURNING job_id",
+        project_id,
+        {"configurable": {}},
+        lease_expires_at,
+        updated_at,
+    )
+    await conn.execute(
+        "INSERT INTO ingest_file (job_id, position, file_name, mime_type) "
+        "VALUES ($1, 0, 'test.txt', 'text/plain')",
+        job_id,
+    )
+    await conn.execute(
+        "INSERT INTO ingest_file_part (job_id, position, part, data) "
+        "VALUES ($1, 0, 0, 'test')",
+        job_id,
+    )
+    return job_id
+
+
+async def _parts(conn: asyncpg.Connection, job_id: str) -> int:
+    return await conn.fetchval(
+        "SELECT count(*) FROM ingest_file_part WHERE job_id = $1", job_id
+    )
+
+
+async def test_jobs_with_expired_leases_are_reclaimed(
+    pool: asyncpg.pool.Pool,
+) -> None:
+    now = datetime.now(timezone.utc)
+    lease = timedelta(minutes=1)
+    project_id = str(uuid4())
+    async with pool.acquire() as conn:
+        expired = await _running_job(conn, project_id, now - lease, now)
+        renewed = await _running_job(conn, project_id, now, now)
+        # Claimed before leases existed.
+        legacy = await _running_job(conn, project_id, None, now - 2 * lease)
+
+    await storage.renew_ingest_leases([renewed], lease)
+    # With a single attempt allowed, expired jobs fail instead of being
+    # requeued, where the app's workers would pick them up.
+    assert await storage.requeue_expired_ingest_jobs(1, lease) == 0
+
+    statuses = {
+        job_id: (await storage.get_ingest_job(project_id, job_id))["status"]
+        for job_id in (expired, renewed, legacy)
+    }
+    assert statuses == {expired: "error", renewed: "running", legacy: "error"}
+    job = await storage.get_ingest_job(project_id, expired)
+    assert job["error"] == "worker lost"
+    assert job["lease_expires_at"] is None
+    async with pool.acquire() as conn:
+        assert await _parts(conn, expired) == 0
+        assert await _parts(conn, renewed) == 1
+
+
+async def test_finished_jobs_drop_their_files(pool: asyncpg.pool.Pool) -> None:
+    now = datetime.now(timezone.utc)
+    async with pool.acquire() as conn:
+        job_id = await _running_job(conn, str(uuid4()), now, now)
+
+    await storage.finish_ingest_job(job_id, "success")
+
+    async with pool.acquire() as conn:
+        assert await _parts(conn, job_id) == 0
@@ -0,0 +1,21 @@
+"""Test keyset cursors."""
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_roundtrip() -> None:
+    row = {
+        "updated_at": datetime(2024, 5, 1, 10, 0, 0, 123456, tzinfo=timezone.utc),
+        "thread_id": "c0b3a3e1-5f7a-4b8e-9f4e-2f1a0b6c7d8e",
+    }
+    cursor = encode_cursor(row, ("updated_at", "thread_id"))
+    assert decode_cursor(cursor) == (row["updated_at"], row["thread_id"])
+
+
+def test_invalid_cursor() -> None:
+    with pytest.raises(HTTPException):
+        decode_cursor("not a cursor")
@@ -0,0 +1,18 @@
+"""Test password hashing."""
+from unittest.mock import patch
+
+from app.auth import passwords
+
+
+async def test_hash_and_verify() -> None:
+    hashed = await passwords.hash_password("secret")
+    assert await passwords.verify_password("secret", hashed)
+    assert not await passwords.verify_password("wrong", hashed)
+    assert not await passwords.verify_password("secret", "")
+
+
+async def test_needs_rehash_after_cost_change() -> None:
+    hashed = await passwords.hash_password("secret")
+    assert not passwords.needs_rehash(hashed)
+    with patch.object(passwords, "BCRYPT_ROUNDS", passwords.BCRYPT_ROUNDS + 1):
+        assert passwords.needs_rehash(hashed)
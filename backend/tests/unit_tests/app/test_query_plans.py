@@ -0,0 +1,86 @@
+"""Test that the storage queries are served by indexes."""
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import asyncpg
+import pytest
+
+from app import storage
+
+_ID = str(uuid4())
+_CURSOR = (datetime.now(timezone.utc), _ID)
+
+
+def _paged(query: str, args: list, order: tuple, after: tuple, **kwargs) -> tuple:
+    """The first and a following page of a list query."""
+    first = storage._page(query, args, order, after=None, limit=20, **kwargs)
+    following = storage._page(query, args, order, after=after, limit=20, **kwargs)
+    return (first[0], *first[1]), (following[0], *following[1])
+
+
+QUERIES = [
+    *_paged(
+        storage._LIST_ASSISTANTS.format("*"),
+        [_ID],
+        ("updated_at", "assistant_id"),
+        _CURSOR,
+    ),
+    (storage._GET_ASSISTANT, _ID, _ID),
+    *_paged(
+        storage._LIST_PUBLIC_ASSISTANTS.format(storage._ASSISTANT_SUMMARY),
+        [],
+        ("updated_at", "assistant_id"),
+        _CURSOR,
+    ),
+    *_paged(
+        storage._LIST_THREADS.format(storage._THREAD_SUMMARY),
+        [_ID],
+        ("updated_at", "thread_id"),
+        _CURSOR,
+    ),
+    (storage._LIST_ASSISTANTS.format(storage._LIST_VERSION), _ID),
+    (storage._LIST_PUBLIC_ASSISTANTS.format(storage._LIST_VERSION),),
+    (storage._LIST_THREADS.format(storage._LIST_VERSION), _ID),
+    (storage._GET_THREAD, _ID, _ID),
+    (storage._GET_THREAD_WITH_ASSISTANT, _ID, _ID),
+    *_paged(
+        storage._LIST_PROJECTS,
+        [_ID],
+        ("name", "project_id"),
+        ("test", _ID),
+        descending=False,
+    ),
+    (storage._GET_USER, _ID),
+    (storage._GET_USER_BY_EMAIL_AND_PROVIDER, "a@b.c", "google"),
+    (storage._CREDIT_TOKENS, 1, "cus_1", storage.USERS_CHANNEL),
+    (storage._GET_AGENT_PRICE, "GPT 4o"),
+    (storage._GET_RUN, _ID, _ID),
+    (storage._CLAIM_RUN, timedelta(minutes=1)),
+    (storage._REQUEUE_EXPIRED_RUNS, 3, timedelta(minutes=1), storage.RUNS_CHANNEL),
+    (storage._CLAIM_INGEST_JOB, timedelta(minutes=1)),
+    (
+        storage._REQUEUE_EXPIRED_INGEST_JOBS,
+        3,
+        timedelta(minutes=1),
+        storage.INGEST_CHANNEL,
+    ),
+]
+
+
+def _seq_scans(plan: dict) -> list[str]:
+    scans = [plan["Relation Name"]] if plan["Node Type"] == "Seq Scan" else []
+    for child in plan.get("Plans", []):
+        scans.extend(_seq_scans(child))
+    return scans
+
+
+@pytest.mark.parametrize("query", QUERIES, ids=lambda q: " ".join(q[0].split())[:60])
+async def test_no_seq_scans(pool: asyncpg.pool.Pool, query: tuple) -> None:
+    sql, *args = query
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            # With sequential scans disabled, the planner only falls back to
+            # them when no index can serve the query.
+            await conn.execute("SET LOCAL enable_seqscan = off")
+            plan = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *args)
+    assert _seq_scans(plan[0]["Plan"]) == []
@@ -0,0 +1,61 @@
+"""Test the run queue."""
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import asyncpg
+
+from app import storage
+
+
+async def _running_run(
+    conn: asyncpg.Connection,
+    thread_id: str,
+    project_id: str,
+    lease_expires_at: Optional[datetime],
+    updated_at: datetime,
+) -> str:
+    # Inserted as already claimed, so the app's own workers leave it alone.
+    return await conn.fetchval(
+        "INSERT INTO run (thread_id, project_id, config, status, attempts, "
+        "lease_expires_at, updated_at) VALUES ($1, $2, $3, 'running', 1, $4, $5) "
+        "RETURNING run_id",
+        thread_id,
+        project_id,
+        {"configurable": {}},
+        lease_expires_at,
+        updated_at,
+    )
+
+
+async def test_runs_with_expired_leases_are_reclaimed(
+    pool: asyncpg.pool.Pool,
+) -> None:
+    now = datetime.now(timezone.utc)
+    lease = timedelta(minutes=1)
+    async with pool.acquire() as conn:
+        project_id = await conn.fetchval(
+            'INSERT INTO "project" (name) VALUES ($1) RETURNING project_id', "test"
+        )
+        thread_id = await conn.fetchval(
+            "INSERT INTO thread (project_id, name) VALUES ($1, $2) RETURNING thread_id",
+            project_id,
+            "test",
+        )
+        expired = await _running_run(conn, thread_id, project_id, now - lease, now)
+        renewed = await _running_run(conn, thread_id, project_id, now, now)
+        # Claimed before leases existed.
+        legacy = await _running_run(conn, thread_id, project_id, None, now - 2 * lease)
+
+    await storage.renew_run_leases([renewed], lease)
+    # With a single attempt allowed, expired runs fail instead of being
+    # requeued, where the app's workers would pick them up.
+    assert await storage.requeue_expired_runs(1, lease) == 0
+
+    statuses = {
+        run_id: (await storage.get_run(project_id, run_id))["status"]
+        for run_id in (expired, renewed, legacy)
+    }
+    assert statuses == {expired: "error", renewed: "running", legacy: "error"}
+    run = await storage.get_run(project_id, expired)
+    assert run["error"] == "worker lost"
+    assert run["lease_expires_at"] is None
@@ -0,0 +1,78 @@
+"""Test the asyncpg vector store."""
+import asyncio
+
+import asyncpg
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+import app.vectorstore
+from app.cache import TTLCache
+from app.vectorstore import PGVectorStore
+
+
+async def test_search_is_scoped_to_namespaces(pool: asyncpg.pool.Pool) -> None:
+    store = PGVectorStore(DeterministicFakeEmbedding(size=1536))
+    await store.aadd_texts(["apples", "pears"], namespace="a")
+    # Ingestion adds chunks from threads, with the namespace in the metadata.
+    await asyncio.to_thread(store.add_texts, ["apples"], [{"namespace": "b"}])
+
+    docs = await store.asimilarity_search("apples", k=4, namespaces=["a", None])
+    assert [d.page_content for d in docs] == ["apples", "pears"]
+
+    docs = await store.asimilarity_search("apples", k=4, namespaces=["b"])
+    assert [(d.page_content, d.metadata) for d in docs] == [
+        ("apples", {"namespace": "b"})
+    ]
+
+
+async def test_hybrid_search_finds_exact_terms(pool: asyncpg.pool.Pool) -> None:
+    store = PGVectorStore(DeterministicFakeEmbedding(size=1536))
+    texts = [f"Order {i} was shipped on time." for i in range(10)]
+    await store.aadd_texts(texts + ["Part SKU-48213 is out of stock."], namespace="a")
+
+    docs = await store.ahybrid_search("Is SKU-48213 available?", k=3, namespaces=["a"])
+    assert docs[0].page_content == "Part SKU-48213 is out of stock."
+    assert len(docs) == 3
+
+
+async def test_cached_results_are_dropped_on_ingestion(pool: asyncpg.pool.Pool) -> None:
+    store = PGVectorStore(DeterministicFakeEmbedding(size=1536))
+    await store.aadd_texts(["Order 1 was shipped."], namespace="c")
+    docs = await store.ahybrid_search("order  status", k=4, namespaces=["c"])
+    assert [d.page_content for d in docs] == ["Order 1 was shipped."]
+    assert await store.ahybrid_search("Order status", k=4, namespaces=["c"]) == docs
+
+    await store.aadd_texts(["Order 2 was shipped."], namespace="c")
+    docs = await store.ahybrid_search("Order status", k=4, namespaces=["c"])
+    assert len(docs) == 2
+
+
+async def test_small_namespace_in_large_table(
+    pool: asyncpg.pool.Pool, monkeypatch
+) -> None:
+    # The HNSW index returns the chunks closest to the query across all
+    # namespaces, which can leave none of a small namespace after filtering.
+    monkeypatch.setattr(app.vectorstore, "ITERATIVE_SCAN", "off")
+    store = PGVectorStore(DeterministicFakeEmbedding(size=1536))
+    await store.aadd_texts([f"Filler chunk {i}" for i in range(2000)], namespace="big")
+    await store.aadd_texts(["apples", "pears", "plums"], namespace="small")
+    async with pool.acquire() as conn:
+        await conn.execute("ANALYZE chunk")
+
+    docs = await store.asimilarity_search("Filler chunk 1", k=3, namespaces=["small"])
+    assert sorted(d.page_content for d in docs) == ["apples", "pears", "plums"]
+
+    docs = await store.ahybrid_search("Filler chunk 1", k=3, namespaces=["small"])
+    assert sorted(d.page_content for d in docs) == ["apples", "pears", "plums"]
+
+
+def test_namespace_generations_are_bounded(monkeypatch) -> None:
+    monkeypatch.setattr(app.vectorstore, "_generations", TTLCache(2, 60))
+    first = app.vectorstore._generation("a")
+    assert app.vectorstore._generation("a") == first
+    app.vectorstore._generation("b")
+    app.vectorstore._generation("c")
+    assert len(app.vectorstore._generations) == 2
+
+    # An evicted namespace gets a new generation, so it can't match results
+    # cached before it was last changed.
+    assert app.vectorstore._generation("a") != first
@@ -17,6 +17,7 @@ import { useNavigate } from "react-router-dom";
 import { useThreadAndAssistant } from "./hooks/useThreadAndAssistant.ts";
 import { Message } from "./types.ts";
 import { OrphanChat } from "./components/OrphanChat.tsx";
+import { ingestFiles, waitForIngestJob } from "./api/ingest.ts";
 
 function App(props: { edit?: boolean }) {
   const navigate = useNavigate();
@@ -51,13 +52,17 @@ function App(props: { edit?: boolean }) {
           "config",
           JSON.stringify({ configurable: { thread_id } }),
         );
-        await fetch(`${import.meta.env.VITE_BACKEND_URL}/ingest`, {
-          method: "POST",
-          headers: {
-            Authorization: `Bearer ${localStorage.getItem("token")}`,
-          },
-          body: formData,
-        });
+        // Wait for the files to be ingested, so the run can retrieve them.
+        try {
+          const job = await waitForIngestJob(
+            (await ingestFiles(formData)).job_id,
+          );
+          if (job.status === "error") {
+            console.error("Failed to ingest files:", job.error);
+          }
+        } catch (error) {
+          console.error("Failed to ingest files:", error);
+        }
       }
 
       // eslint-disable-next-line @typescript-eslint/no-explicit-any
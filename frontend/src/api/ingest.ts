@@ -0,0 +1,45 @@
+export interface IngestJob {
+  job_id: string;
+  status: "pending" | "running" | "success" | "error";
+  files_total: number;
+  files_done: number;
+  chunks_done: number;
+  error: string | null;
+}
+
+const POLL_INTERVAL_MS = 1000;
+
+export async function ingestFiles(formData: FormData): Promise<IngestJob> {
+  const response = await fetch(`${import.meta.env.VITE_BACKEND_URL}/ingest`, {
+    method: "POST",
+    headers: {
+      Authorization: `Bearer ${localStorage.getItem("token")}`,
+    },
+    body: formData,
+  });
+  if (!response.ok) {
+    throw new Error(`Failed to upload files: ${response.status}`);
+  }
+  return (await response.json()) as IngestJob;
+}
+
+export async function waitForIngestJob(jobId: string): Promise<IngestJob> {
+  for (;;) {
+    const response = await fetch(
+      `${import.meta.env.VITE_BACKEND_URL}/ingest/${jobId}`,
+      {
+        headers: {
+          Authorization: `Bearer ${localStorage.getItem("token")}`,
+        },
+      },
+    );
+    if (!response.ok) {
+      throw new Error(`Failed to get ingestion job: ${response.status}`);
+    }
+    const job = (await response.json()) as IngestJob;
+    if (job.status === "success" || job.status === "error") {
+      return job;
+    }
+    await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+  }
+}
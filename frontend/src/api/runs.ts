@@ -0,0 +1,13 @@
+export async function cancelRun(runId: string): Promise<void> {
+  try {
+    await fetch(`${import.meta.env.VITE_BACKEND_URL}/runs/${runId}/cancel`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "Authorization": `Bearer ${localStorage.getItem("token")}`,
+      },
+    });
+  } catch (error) {
+    console.error("Failed to cancel run:", error);
+  }
+}
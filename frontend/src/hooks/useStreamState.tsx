@@ -2,6 +2,7 @@
 import { useCallback, useState } from "react";
 import { fetchEventSource } from "@microsoft/fetch-event-source";
 import { Message } from "../types";
+import { cancelRun } from "../api/runs";
 
 export interface StreamState {
   status: "inflight" | "error" | "done";
@@ -89,6 +90,9 @@ export function useStreamState(): StreamStateProps {
 
   const stopStream = useCallback(
     (clear: boolean = false) => {
+      if (controller && current?.status === "inflight" && current.run_id) {
+        cancelRun(current.run_id);
+      }
       controller?.abort();
       setController(null);
       if (clear) {
@@ -104,7 +108,7 @@ export function useStreamState(): StreamStateProps {
         }));
       }
     },
-    [controller],
+    [controller, current],
   );
 
   return {